@@ -0,0 +1,353 @@
+#! /usr/bin/env python
+
+"""
+File: CatalogueIndex.py
+Author: Revolt
+--------------------------
+Desc:
+    This file contains the definition and implementation of the index
+    of the movies of all registered hard drives. It's kept in a single
+    local database so that movies can be found without connecting (or
+    even selecting) the drive holding them.
+--------------------------
+Copyright (C) 2010 Revolt
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, logging, threading, sqlite3, wx
+
+class CatalogueIndex(object):
+    """ The CatalogueIndex class """
+
+    __instance = None
+    __instanceLock = threading.Lock()
+
+    def __init__(self, dataFolder):
+        """
+        Initializes a new CatalogueIndex instance. Most code should use the
+        instance shared by the application (see Get).
+        ---
+        Params:
+            @ dataFolder (String) - The folder holding the index and the
+                                    databases of the hard drives.
+        """
+
+        self.__logger = logging.getLogger("mhdd.catalogueindex")
+        self.__dataFolder = dataFolder
+
+        if not os.path.isdir(dataFolder):
+            os.makedirs(dataFolder)
+
+        # The index is fed from several threads (for example when loading
+        # several categories at once), access to it is serialized
+        self.__lock = threading.RLock()
+        self.__dbConn = sqlite3.connect(os.path.join(dataFolder, "catalogue.db"),
+                                        check_same_thread = False)
+        self.__dbConn.row_factory = sqlite3.Row
+
+        dbCursor = self.__dbConn.cursor()
+
+        # Everything in here can be imported again from the drive databases,
+        # so commits don't need to wait for the disk
+        dbCursor.execute("PRAGMA journal_mode = WAL")
+        dbCursor.execute("PRAGMA synchronous = NORMAL")
+
+        dbCursor.execute("CREATE TABLE IF NOT EXISTS drives (uuid TEXT PRIMARY KEY, label TEXT)")
+        dbCursor.execute("CREATE TABLE IF NOT EXISTS entries (drive TEXT, category TEXT, " + \
+                         "path TEXT, catname TEXT, name TEXT, title TEXT, year TEXT, " + \
+                         "tmdb TEXT, PRIMARY KEY (drive, category, path))")
+        dbCursor.execute("CREATE INDEX IF NOT EXISTS entries_tmdb ON entries (tmdb)")
+        self.__dbConn.commit()
+
+        dbCursor.execute("SELECT uuid FROM drives")
+        self.__driveUuids = set(row['uuid'] for row in dbCursor)
+
+        dbCursor.close()
+
+    @staticmethod
+    def Get():
+        """
+        Return: (CatalogueIndex) The index shared by the whole application.
+                It's opened the first time it's requested.
+        """
+
+        with CatalogueIndex.__instanceLock:
+            if CatalogueIndex.__instance is None:
+                stdPaths = wx.StandardPaths.Get()
+                CatalogueIndex.__instance = CatalogueIndex(stdPaths.GetUserLocalDataDir())
+
+            return CatalogueIndex.__instance
+
+    # -- Get Properties --
+    def HasDrive(self, driveUuid):
+        """
+        Checks if the movies of a hard drive are in the index.
+        ---
+        Params:
+            @ driveUuid (String) - The uuid of the hard drive.
+        ---
+        Return: (Boolean) True if the drive is indexed, False otherwise.
+        """
+
+        with self.__lock:
+            return driveUuid in self.__driveUuids
+
+    # -- Methods --
+    def Find(self, text, limit = 100):
+        """
+        Finds the movies whose title or name contains the provided text,
+        on all indexed hard drives.
+        ---
+        Params:
+            @ text (String) - The text to look for (case insensitive).
+            @ limit (Integer) - The maximum number of movies returned.
+        ---
+        Return: (List of Rows) The movies found, sorted by title. Each row
+                has the keys drive (uuid), label, category (path), catname,
+                path, name, title, year and tmdb.
+        """
+
+        pattern = u"%" + text.replace(u"\\", u"\\\\").replace(u"%", u"\\%") \
+                             .replace(u"_", u"\\_") + u"%"
+
+        with self.__lock:
+            dbCursor = self.__dbConn.cursor()
+            dbCursor.execute("SELECT entries.drive, drives.label, entries.category, " + \
+                             "entries.catname, entries.path, entries.name, entries.title, " + \
+                             "entries.year, entries.tmdb FROM entries INNER JOIN drives " + \
+                             "ON drives.uuid = entries.drive WHERE entries.title LIKE ? " + \
+                             "ESCAPE '\\' OR entries.name LIKE ? ESCAPE '\\' " + \
+                             "ORDER BY entries.title, entries.name LIMIT ?",
+                             [pattern, pattern, limit])
+            results = dbCursor.fetchall()
+            dbCursor.close()
+
+        return results
+
+    def FindByTMDBID(self, tmdbID):
+        """
+        Finds the movies associated with a TMDB entry on all indexed drives.
+        ---
+        Params:
+            @ tmdbID (String) - The TMDB id of the movie.
+        ---
+        Return: (List of Rows) The movies found (see Find).
+        """
+
+        with self.__lock:
+            dbCursor = self.__dbConn.cursor()
+            dbCursor.execute("SELECT entries.drive, drives.label, entries.category, " + \
+                             "entries.catname, entries.path, entries.name, entries.title, " + \
+                             "entries.year, entries.tmdb FROM entries INNER JOIN drives " + \
+                             "ON drives.uuid = entries.drive WHERE entries.tmdb = ?",
+                             [tmdbID])
+            results = dbCursor.fetchall()
+            dbCursor.close()
+
+        return results
+
+    def Synchronize(self, hddList):
+        """
+        Makes the index cover exactly the provided hard drives: drives no
+        longer in the list are removed and drives not indexed yet are
+        imported from their databases.
+        ---
+        Params:
+            @ hddList (Iterable of HardDrives) - The registered hard drives.
+        """
+
+        with self.__lock:
+            registeredUuids = set()
+
+            for hdd in hddList:
+                registeredUuids.add(hdd.GetUuid())
+
+                if hdd.GetUuid() in self.__driveUuids:
+                    self.SetDriveLabel(hdd.GetUuid(), hdd.GetLabel())
+                else:
+                    self.ImportDrive(hdd.GetUuid(), hdd.GetLabel())
+
+            for driveUuid in self.__driveUuids - registeredUuids:
+                self.RemoveDrive(driveUuid)
+
+    def ImportDrive(self, driveUuid, label):
+        """
+        (Re)builds the index entries of a hard drive from its database.
+        ---
+        Params:
+            @ driveUuid (String) - The uuid of the hard drive.
+            @ label (String) - The label of the hard drive.
+        ---
+        Return: (Boolean) True on success, False otherwise.
+        """
+
+        self.__logger.debug("Importing drive '%s' into the catalogue index", label)
+
+        dbPath = os.path.join(self.__dataFolder, "databases", driveUuid)
+
+        with self.__lock:
+            dbCursor = self.__dbConn.cursor()
+
+            try:
+                dbCursor.execute("DELETE FROM entries WHERE drive = ?", [driveUuid])
+                dbCursor.execute("INSERT OR REPLACE INTO drives (uuid, label) VALUES (?, ?)",
+                                 [driveUuid, label])
+                self.__dbConn.commit()
+
+                if os.path.isfile(dbPath):
+                    # The drive database is read directly by attaching it
+                    dbCursor.execute("ATTACH DATABASE ? AS drive", [dbPath])
+
+                    try:
+                        dbCursor.execute("INSERT OR REPLACE INTO entries (drive, category, " + \
+                                         "path, catname, name, title, year, tmdb) SELECT ?, " + \
+                                         "categories.path, movies.path, categories.name, " + \
+                                         "movies.name, movies.title, movies.year, movies.tmdb " + \
+                                         "FROM drive.movies AS movies INNER JOIN " + \
+                                         "drive.categories AS categories " + \
+                                         "ON categories.id = movies.cat", [driveUuid])
+                        self.__dbConn.commit()
+                    except sqlite3.Error, e:
+                        # SQLite can't detach a database while a transaction
+                        # is open, so it's rolled back first
+                        self.__dbConn.rollback()
+                        raise
+                    finally:
+                        try:
+                            dbCursor.execute("DETACH DATABASE drive")
+                        except sqlite3.Error, e:
+                            self.__logger.exception("Error detaching drive database")
+
+                self.__driveUuids.add(driveUuid)
+            except sqlite3.Error, e:
+                self.__logger.exception("Error importing drive into the catalogue index")
+                self.__dbConn.rollback()
+                return False
+            finally:
+                dbCursor.close()
+
+        return True
+
+    def RemoveDrive(self, driveUuid):
+        """
+        Removes a hard drive and all its movies from the index.
+        ---
+        Params:
+            @ driveUuid (String) - The uuid of the hard drive.
+        """
+
+        with self.__lock:
+            dbCursor = self.__dbConn.cursor()
+            dbCursor.execute("DELETE FROM entries WHERE drive = ?", [driveUuid])
+            dbCursor.execute("DELETE FROM drives WHERE uuid = ?", [driveUuid])
+            self.__dbConn.commit()
+            dbCursor.close()
+
+            self.__driveUuids.discard(driveUuid)
+
+    def SetDriveLabel(self, driveUuid, label):
+        """
+        Changes the label with which an indexed hard drive is shown.
+        ---
+        Params:
+            @ driveUuid (String) - The uuid of the hard drive.
+            @ label (String) - The new label of the hard drive.
+        """
+
+        with self.__lock:
+            if driveUuid not in self.__driveUuids:
+                return
+
+            dbCursor = self.__dbConn.cursor()
+            dbCursor.execute("UPDATE drives SET label = ? WHERE uuid = ? AND label IS NOT ?",
+                             [label, driveUuid, label])
+            self.__dbConn.commit()
+            dbCursor.close()
+
+    def SetDriveCategories(self, driveUuid, catList):
+        """
+        Updates the categories of an indexed hard drive, removing the movies
+        of the categories that no longer exist.
+        ---
+        Params:
+            @ driveUuid (String) - The uuid of the hard drive.
+            @ catList (List of Categories) - The categories of the drive.
+        """
+
+        with self.__lock:
+            if driveUuid not in self.__driveUuids:
+                return
+
+            catNames = dict((cat.GetRelativePath(), cat.GetName()) for cat in catList)
+
+            dbCursor = self.__dbConn.cursor()
+            dbCursor.execute("SELECT DISTINCT category FROM entries WHERE drive = ?", [driveUuid])
+            removedCategories = [row['category'] for row in dbCursor
+                                 if row['category'] not in catNames]
+
+            dbCursor.executemany("DELETE FROM entries WHERE drive = ? AND category = ?",
+                                 [(driveUuid, catPath) for catPath in removedCategories])
+            dbCursor.executemany("UPDATE entries SET catname = ? WHERE drive = ? " + \
+                                 "AND category = ? AND catname IS NOT ?",
+                                 [(catName, driveUuid, catPath, catName)
+                                  for catPath, catName in catNames.iteritems()])
+            self.__dbConn.commit()
+            dbCursor.close()
+
+    def UpdateMovies(self, driveUuid, movieList):
+        """
+        Adds or updates the entries of several movies of an indexed drive.
+        Drives that aren't indexed yet are left to Synchronize.
+        ---
+        Params:
+            @ driveUuid (String) - The uuid of the hard drive of the movies.
+            @ movieList (List of Movies) - The movies to index.
+        """
+
+        with self.__lock:
+            if driveUuid not in self.__driveUuids or len(movieList) == 0:
+                return
+
+            dbCursor = self.__dbConn.cursor()
+            dbCursor.executemany("INSERT OR REPLACE INTO entries (drive, category, path, " + \
+                                 "catname, name, title, year, tmdb) VALUES " + \
+                                 "(?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [(driveUuid, movie.GetCategory().GetRelativePath(),
+                                   movie.GetRelativePath(), movie.GetCategory().GetName(),
+                                   movie.GetName(), movie.GetTitle(), movie.GetYear(),
+                                   movie.GetTMDBID()) for movie in movieList])
+            self.__dbConn.commit()
+            dbCursor.close()
+
+    def RemoveMovies(self, driveUuid, movieList):
+        """
+        Removes the entries of several movies of an indexed drive.
+        ---
+        Params:
+            @ driveUuid (String) - The uuid of the hard drive of the movies.
+            @ movieList (List of Movies) - The movies to remove.
+        """
+
+        with self.__lock:
+            if driveUuid not in self.__driveUuids or len(movieList) == 0:
+                return
+
+            dbCursor = self.__dbConn.cursor()
+            dbCursor.executemany("DELETE FROM entries WHERE drive = ? AND category = ? " + \
+                                 "AND path = ?",
+                                 [(driveUuid, movie.GetCategory().GetRelativePath(),
+                                   movie.GetRelativePath()) for movie in movieList])
+            self.__dbConn.commit()
+            dbCursor.close()
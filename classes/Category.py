@@ -29,6 +29,8 @@ from Movie import *
 class Category(object):
     """ The Category class """
 
+    __slots__ = ("__name", "__relpath", "__hdd", "__movieList", "__loaded")
+
     def __init__(self, name, relpath, hdd):
         """
         Constructor
@@ -113,23 +115,41 @@ class Category(object):
         self.__hdd = hdd
 
     # -- Methods --
-    def GetMovieList(self, refresh = False):
+    def GetMovieList(self, refresh = False, progress = None):
         """
         Retrieves the list of movies managed by this category.
         ---
         Params:
             @ refresh (Boolean) - Whether or not to force a refresh of the list.
+            @ progress (Function) - Called with each chunk of movies loaded,
+                                    if the list has to be loaded. Loading is
+                                    cancelled if it returns False.
         ---
-        Return (List of Movies): The list of movies under this category.
+        Return (List of Movies): The list of movies under this category or None
+                                 if it couldn't be loaded.
         """
 
         if self.__loaded and not refresh:
             return self.__movieList
 
-        self.__hdd.LoadCategoryMovieList(self)
+        if not self.__hdd.LoadCategoryMovieList(self, progress):
+            return None
 
         return self.__movieList
 
+    def SearchMovies(self, query):
+        """
+        Searches the movies of this category whose info matches a query.
+        ---
+        Params:
+            @ query (String) - The words to look for.
+        ---
+        Return: (List of Strings) The relative paths of the movies found, the
+                 most relevant first, or None if searching isn't supported.
+        """
+
+        return self.__hdd.SearchCategoryMovies(self, query)
+
     def SetMovieList(self, movieList):
         """
         Sets the list of movies managed by this category.
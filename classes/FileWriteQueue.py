@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+
+"""
+File: FileWriteQueue.py
+Author: Revolt
+--------------------------
+Desc:
+    This file contains the definition and implementation of a queue
+    that writes files in a background thread. Repeated writes to the
+    same file are coalesced and each file is replaced atomically.
+--------------------------
+Copyright (C) 2010 Revolt
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, sys, threading, logging, ctypes
+from collections import OrderedDict
+
+class FileWriteQueue(object):
+    """ The FileWriteQueue class """
+
+    # MoveFileEx flags: MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH
+    __moveFileFlags = 0x1 | 0x8
+
+    def __init__(self):
+        """
+        Initializes a new FileWriteQueue instance. The writer thread is
+        only running while there are pending writes.
+        """
+
+        self.__logger = logging.getLogger("mhdd.filewritequeue")
+        self.__condition = threading.Condition()
+        self.__pendingDict = OrderedDict()
+        self.__writing = None
+        self.__writer = None
+        self.__failed = False
+
+    # -- Get Properties --
+    def GetPendingData(self, path):
+        """
+        Gets the data waiting to be written to a file, so that reads can
+        see writes that haven't reached the disk yet.
+        ---
+        Params:
+            @ path (String) - The path of the file.
+        ---
+        Return: (Bytes) The pending data or None if there is none.
+        """
+
+        with self.__condition:
+            pending = self.__pendingDict.get(path)
+
+            if pending is not None:
+                return pending[0]
+
+            # The file may be in the middle of being written
+            if self.__writing is not None and self.__writing[0] == path:
+                return self.__writing[1]
+
+            return None
+
+    def HasPendingWrites(self):
+        """
+        Return: (Boolean) Whether there are writes that haven't finished yet.
+        """
+
+        with self.__condition:
+            return len(self.__pendingDict) > 0 or self.__writing is not None
+
+    # -- Methods --
+    def Write(self, path, data, binary = True):
+        """
+        Queues the contents of a file to be written. If the file already
+        has a pending write, it's replaced by this one.
+        ---
+        Params:
+            @ path (String) - The path of the file.
+            @ data (Bytes) - The new contents of the file.
+            @ binary (Boolean) - Whether to write the file in binary mode.
+        """
+
+        with self.__condition:
+            self.__pendingDict.pop(path, None)
+            self.__pendingDict[path] = (data, binary)
+
+            if self.__writer is None:
+                self.__writer = threading.Thread(target = self.__WriterLoop)
+                self.__writer.setDaemon(True)
+                self.__writer.start()
+
+    def Flush(self):
+        """
+        Waits until all queued writes are on the disk.
+        ---
+        Return: (Boolean) True if every write since the last flush
+                 succeeded, False otherwise.
+        """
+
+        with self.__condition:
+            while len(self.__pendingDict) > 0 or self.__writing is not None:
+                self.__condition.wait()
+
+            success = not self.__failed
+            self.__failed = False
+
+            return success
+
+    @staticmethod
+    def WriteFile(path, data, binary = True):
+        """
+        Replaces the contents of a file atomically by writing them to a
+        temporary file next to it and renaming it over the original.
+        ---
+        Params:
+            @ path (String) - The path of the file.
+            @ data (Bytes) - The new contents of the file.
+            @ binary (Boolean) - Whether to write the file in binary mode.
+        ---
+        Raises: IOError or OSError if the file can't be written.
+        """
+
+        folderPath = os.path.dirname(path)
+
+        if folderPath != "" and not os.path.isdir(folderPath):
+            os.makedirs(folderPath)
+
+        tempPath = path + ".tmp"
+        tempFile = open(tempPath, "wb" if binary else "w")
+
+        try:
+            try:
+                tempFile.write(data)
+                tempFile.flush()
+                os.fsync(tempFile.fileno())
+            finally:
+                tempFile.close()
+
+            FileWriteQueue.__ReplaceFile(tempPath, path)
+        except (IOError, OSError), e:
+            # The partial file isn't left behind
+            excInfo = sys.exc_info()
+
+            try:
+                os.remove(tempPath)
+            except OSError, removeError:
+                pass
+
+            raise excInfo[0], excInfo[1], excInfo[2]
+
+    @staticmethod
+    def __ReplaceFile(sourcePath, destPath):
+        """
+        Renames a file over another one in a single step, so that a crash
+        leaves either the old or the new file in place.
+        ---
+        Params:
+            @ sourcePath (String) - The path of the file to rename.
+            @ destPath (String) - The path of the file to replace.
+        ---
+        Raises: OSError if the file can't be renamed.
+        """
+
+        if sys.platform != "win32":
+            os.rename(sourcePath, destPath)
+            return
+
+        # os.rename can't replace an existing file on Windows, MoveFileEx can
+        encoding = sys.getfilesystemencoding()
+
+        if not isinstance(sourcePath, unicode):
+            sourcePath = sourcePath.decode(encoding)
+
+        if not isinstance(destPath, unicode):
+            destPath = destPath.decode(encoding)
+
+        if not ctypes.windll.kernel32.MoveFileExW(sourcePath, destPath,
+                                                  FileWriteQueue.__moveFileFlags):
+            raise ctypes.WinError()
+
+    def __WriterLoop(self):
+        """
+        The loop run by the writer thread. It stops once there are no more
+        pending writes.
+        """
+
+        while True:
+            with self.__condition:
+                if self.__writing is not None:
+                    self.__writing = None
+                    self.__condition.notifyAll()
+
+                if len(self.__pendingDict) == 0:
+                    self.__writer = None
+                    return
+
+                path = next(iter(self.__pendingDict))
+                data, binary = self.__pendingDict.pop(path)
+                self.__writing = (path, data)
+
+            try:
+                self.WriteFile(path, data, binary)
+            except Exception, e:
+                self.__logger.exception("Error writing file '%s'", path)
+
+                with self.__condition:
+                    self.__failed = True
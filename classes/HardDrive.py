@@ -24,8 +24,9 @@ Copyright (C) 2010 Revolt
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os, uuid, ConfigParser, logging
+import os, uuid, ConfigParser, logging, time
 from Category import *
+from WorkerPool import *
 from hddproviders.DBFileSyncProvider import *
 from hddproviders.DatabaseProvider import *
 
@@ -139,6 +140,10 @@ class HardDrive(object):
         """
         
         self.__logger.debug("Setting new provider '%s' on HDD '%s'", type(provider), self.__uuid)
+
+        if self.__provider is not None:
+            self.__provider.Flush()
+
         self.__provider = provider
 
     def SetCategoryList(self, catList):
@@ -190,12 +195,14 @@ class HardDrive(object):
 
         return self.__provider.SaveCategoryList()
 
-    def LoadCategoryMovieList(self, cat):
+    def LoadCategoryMovieList(self, cat, progress = None):
         """
         Loads all movies from the provided category and returns a list containing them.
         ---
         Params:
             @ cat (Category) - The category whose movies we wish to get.
+            @ progress (Function) - Called with each chunk of movies loaded.
+                                    Loading is cancelled if it returns False.
         ---
         Return: (List of Movies) The movies contained in the category.
         """
@@ -203,7 +210,82 @@ class HardDrive(object):
         if self.__provider is None:
             return False
 
-        return self.__provider.LoadCategoryMovieList(cat)
+        return self.__provider.LoadCategoryMovieList(cat, progress)
+
+    def SearchCategoryMovies(self, cat, query):
+        """
+        Searches the movies of the provided category matching a query.
+        ---
+        Params:
+            @ cat (Category) - The category whose movies we want to search.
+            @ query (String) - The words to look for.
+        ---
+        Return: (List of Strings) The relative paths of the movies found, the
+                 most relevant first, or None if searching isn't supported.
+        """
+
+        if self.__provider is None:
+            return None
+
+        return self.__provider.SearchCategoryMovies(cat, query)
+
+    def WarmCategories(self, maxWorkers = 4):
+        """
+        Loads (and syncs) the movie lists of all categories of this HDD,
+        several of them at the same time.
+        ---
+        Params:
+            @ maxWorkers (Integer) - How many categories to load at the same time.
+        ---
+        Return: (Dict) The time (in seconds) it took to load each category
+                 (by category name) or None if loading failed.
+        """
+
+        if self.__provider is None:
+            return None
+
+        categoryList = self.GetCategoryList()
+        timingDict = dict()
+
+        self.__logger.debug("Warming %d categories of HDD '%s'", len(categoryList), self.__label)
+
+        pool = WorkerPool(maxWorkers)
+
+        for cat in categoryList:
+            pool.Submit(cat, self.__TimeCategoryLoad, cat)
+
+        for i in range(len(categoryList)):
+            cat, loadTime, error = pool.GetResult()
+
+            if error is None:
+                self.__logger.debug("Loaded category '%s' in %.3f seconds", cat.GetName(), loadTime)
+            else:
+                self.__logger.error("Error loading category '%s'", cat.GetName())
+
+            timingDict[cat.GetName()] = loadTime
+
+        pool.Shutdown()
+
+        return timingDict
+
+    def __TimeCategoryLoad(self, cat):
+        """
+        Loads the movie list of a category.
+        ---
+        Params:
+            @ cat (Category) - The category to load.
+        ---
+        Return: (Float) The time (in seconds) it took to load the category.
+        ---
+        Raises: IOError if the category couldn't be loaded.
+        """
+
+        startTime = time.time()
+
+        if cat.GetMovieList(True) is None:
+            raise IOError("Couldn't load the movies of category '%s'" % cat.GetName())
+
+        return time.time() - startTime
 
     def LoadMovieInfo(self, movie):
         """
@@ -229,6 +311,54 @@ class HardDrive(object):
 
         return self.__provider.SaveMovieInfo(movie)
 
+    def GetMovieImageData(self, movie):
+        """
+        Reads the cover image of the specified movie.
+        ---
+        Return: (Bytes) The image data or None if the movie has no image.
+        """
+
+        if self.__provider is None:
+            return None
+
+        return self.__provider.GetMovieImageData(movie)
+
+    def GetMovieThumbnailData(self, movie):
+        """
+        Reads the thumbnail of the cover image of the specified movie.
+        ---
+        Return: (Bytes) The thumbnail data or None if there is none.
+        """
+
+        if self.__provider is None:
+            return None
+
+        return self.__provider.GetMovieThumbnailData(movie)
+
+    def SaveMovieThumbnailData(self, movie, thumbnailData):
+        """
+        Stores the thumbnail of the cover image of the specified movie.
+        ---
+        Return: (Boolean) True on success, False on failure.
+        """
+
+        if self.__provider is None:
+            return False
+
+        return self.__provider.SaveMovieThumbnailData(movie, thumbnailData)
+
+    def Flush(self):
+        """
+        Waits until all movie saves have been written to the HDD.
+        ---
+        Return: (Boolean) True on success, False on failure.
+        """
+
+        if self.__provider is None:
+            return True
+
+        return self.__provider.Flush()
+
     def CleanAllInfo(self):
         """
         Cleans all MHDD Organizer info from the HDD.
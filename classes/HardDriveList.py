@@ -26,6 +26,7 @@ Copyright (C) 2010 Revolt
 
 import wx, os
 from classes.HardDrive import *
+from classes.CatalogueIndex import *
 
 class HardDriveList(object):
     """ The HardDriveList class """
@@ -36,6 +37,7 @@ class HardDriveList(object):
         """ Constructor """
 
         self.__container = []
+        self.__uuidDict = dict()
         self.__logger = logging.getLogger("mhdd.hddlist")
 
     def __len__(self):
@@ -71,6 +73,7 @@ class HardDriveList(object):
             return False
 
         self.__container.append(hardDrive)
+        self.__uuidDict[hardDrive.GetUuid()] = hardDrive
 
         if self.__configSync:
             config = wx.Config.Get()
@@ -82,6 +85,8 @@ class HardDriveList(object):
 
         hardDrive.SaveCategoryList()
 
+        CatalogueIndex.Get().ImportDrive(hardDrive.GetUuid(), hardDrive.GetLabel())
+
     def Edit(self, index, newHardDrive):
         """
         Edits the harddrive located at the specified index with
@@ -104,6 +109,8 @@ class HardDriveList(object):
         hardDrive.SetCategoryList(newHardDrive.GetCategoryList())
         hardDrive.SaveCategoryList()
 
+        CatalogueIndex.Get().SetDriveLabel(hardDrive.GetUuid(), hardDrive.GetLabel())
+
         if self.__configSync:
             hddUuid = hardDrive.GetUuid()
 
@@ -127,6 +134,9 @@ class HardDriveList(object):
                 config.DeleteGroup(hdd.GetUuid())
 
         del self.__container[index]
+        del self.__uuidDict[hdd.GetUuid()]
+
+        CatalogueIndex.Get().RemoveDrive(hdd.GetUuid())
 
         stdPaths = wx.StandardPaths_Get()
         dbPath = os.path.join(stdPaths.GetUserLocalDataDir(), "databases", hdd.GetUuid())
@@ -143,11 +153,19 @@ class HardDriveList(object):
         Return: (Boolean) true if such a hdd exists, false otherwise.
         """
 
-        for hdd in self.__container:
-            if hdd.GetUuid() == uuid:
-                return True
+        return uuid in self.__uuidDict
+
+    def GetHardDrive(self, uuid):
+        """
+        Gets the Hdd of this list with the specified uuid.
+        ---
+        Params:
+            @ uuid (String) - UUID of the harddrive
+        ---
+        Return: (HardDrive) The hdd or None if there is no such hdd.
+        """
 
-        return False
+        return self.__uuidDict.get(uuid)
 
     def SaveToConfig(self, configSync = True):
         """
@@ -185,6 +203,7 @@ class HardDriveList(object):
         self.__logger.debug("Loading Harddrive list from config file")
 
         self.__container = []
+        self.__uuidDict = dict()
         self.__configSync = configSync
 
         config = wx.Config.Get()
@@ -197,6 +216,7 @@ class HardDriveList(object):
 
             if hdd.GetLabel() and hdd.GetPath():
                 self.__container.append(hdd)
+                self.__uuidDict[uuid] = hdd
         
             (moreDrives, uuid, nextDriveIndex) = config.GetNextGroup(nextDriveIndex)
 
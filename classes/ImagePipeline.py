@@ -0,0 +1,246 @@
+#! /usr/bin/env python
+
+"""
+File: ImagePipeline.py
+Author: Revolt
+--------------------------
+Desc:
+    This file contains the definition and implementation of the pipeline
+    through which cover images go before being shown: they are downloaded
+    concurrently, decoded and scaled down to thumbnails in worker threads
+    so that the GUI thread only has to draw them.
+--------------------------
+Copyright (C) 2010 Revolt
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import io, logging, wx
+from classes.WorkerPool import *
+from classes.infoproviders import tmdb
+
+class ImagePipeline(object):
+    """ The ImagePipeline class """
+
+    # The box thumbnails are scaled down to fit in. Twice the size of the
+    # cover in the details panel so that they still look sharp when the
+    # panel is enlarged.
+    thumbnailSize = (280, 320)
+
+    def __init__(self, maxDownloads = 4, maxDecoders = 2):
+        """
+        Initializes a new ImagePipeline instance.
+        ---
+        Params:
+            @ maxDownloads (Integer) - The maximum number of images downloaded
+                                       at the same time.
+            @ maxDecoders (Integer) - The maximum number of thumbnails loaded
+                                      at the same time.
+        """
+
+        self.__logger = logging.getLogger("mhdd.imagepipeline")
+        self.__downloadPool = WorkerPool(maxDownloads)
+        # Loaded thumbnails are handed to their callback instead
+        self.__decodePool = WorkerPool(maxDecoders, False)
+        self.__pendingDownloads = 0
+
+    # -- Get Properties --
+    def GetPendingDownloads(self):
+        """
+        Return: (Integer) The number of downloads whose result wasn't read
+                 yet (see GetResult).
+        """
+
+        return self.__pendingDownloads
+
+    # -- Methods --
+    def Download(self, tag, url):
+        """
+        Submits the download of an image. The thumbnail of the image is made
+        by the same worker thread once it's downloaded.
+        ---
+        Params:
+            @ tag - A value identifying the download in its result.
+            @ url (String) - The URL of the image.
+        """
+
+        self.__pendingDownloads += 1
+        self.__downloadPool.Submit(tag, self.__DownloadImage, url)
+
+    def GetResult(self, timeout = None):
+        """
+        Gets the result of a finished download, in the order they finish.
+        ---
+        Params:
+            @ timeout (Float) - How many seconds to wait for a download to
+                                finish. If None, waits for as long as needed.
+        ---
+        Return: (Tuple) A (tag, result, exception) tuple where result is an
+                 (image data, thumbnail data) tuple and exception is the
+                 exception raised by the download or None, or None if no
+                 download finished before the timeout.
+        """
+
+        result = self.__downloadPool.GetResult(timeout)
+
+        if result is not None:
+            self.__pendingDownloads -= 1
+
+        return result
+
+    def CancelDownloads(self):
+        """
+        Discards the submitted downloads that haven't started yet.
+        ---
+        Return: (Integer) The number of downloads discarded.
+        """
+
+        cancelled = self.__downloadPool.Cancel()
+        self.__pendingDownloads -= cancelled
+
+        return cancelled
+
+    def LoadThumbnail(self, movie, callback):
+        """
+        Loads the thumbnail of the image of a movie in a worker thread. If
+        the movie doesn't have a thumbnail yet, it's made from the image and
+        stored along with it.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail we want.
+            @ callback (Function) - Called in the GUI thread with the movie
+                                    and the decoded thumbnail (wx.Image) or
+                                    None if the movie has no image.
+        """
+
+        self.__decodePool.Submit(movie, self.__LoadThumbnail, movie, callback)
+
+    def CancelLoads(self):
+        """
+        Discards the thumbnail loads that haven't started yet. Their
+        callbacks won't be called.
+        """
+
+        self.__decodePool.Cancel()
+
+    def Shutdown(self, wait = True):
+        """
+        Discards pending work and stops the worker threads.
+        ---
+        Params:
+            @ wait (Boolean) - Whether to wait for the worker threads to stop.
+        """
+
+        self.__downloadPool.Shutdown(wait)
+        self.__decodePool.Shutdown(wait)
+        self.__pendingDownloads = 0
+
+    @staticmethod
+    def DecodeImage(imageData):
+        """
+        Decodes an image. Safe to call outside the GUI thread.
+        ---
+        Params:
+            @ imageData (Bytes) - The encoded image.
+        ---
+        Return: (wx.Image) The decoded image or None if it's not valid.
+        """
+
+        image = wx.ImageFromStream(io.BytesIO(bytearray(imageData)))
+
+        if not image.IsOk():
+            return None
+
+        return image
+
+    @staticmethod
+    def MakeThumbnail(imageData, size = None):
+        """
+        Scales an image down to fit in the provided size. Safe to call
+        outside the GUI thread.
+        ---
+        Params:
+            @ imageData (Bytes) - The encoded image.
+            @ size (Tuple) - The (width, height) the thumbnail must fit in.
+                             Defaults to thumbnailSize.
+        ---
+        Return: (Bytes) The thumbnail encoded as JPEG (the image itself if
+                 it already fits) or None if the image isn't valid.
+        """
+
+        (maxW, maxH) = size or ImagePipeline.thumbnailSize
+        image = ImagePipeline.DecodeImage(imageData)
+
+        if image is None:
+            return None
+
+        (imageW, imageH) = image.GetSize()
+
+        if imageW <= maxW and imageH <= maxH:
+            return str(imageData)
+
+        ratio = min(float(maxW) / imageW, float(maxH) / imageH)
+        image.Rescale(max(1, int(imageW * ratio)), max(1, int(imageH * ratio)),
+                      wx.IMAGE_QUALITY_HIGH)
+
+        thumbnailStream = io.BytesIO()
+
+        if not image.SaveStream(thumbnailStream, wx.BITMAP_TYPE_JPEG):
+            return None
+
+        return thumbnailStream.getvalue()
+
+    def __DownloadImage(self, url):
+        """
+        Downloads an image and makes its thumbnail. Run by the workers.
+        ---
+        Params:
+            @ url (String) - The URL of the image.
+        ---
+        Return: (Tuple) The (image data, thumbnail data) of the image.
+        """
+
+        imageData = tmdb.fetchUrl(url)
+
+        return (imageData, self.MakeThumbnail(imageData))
+
+    def __LoadThumbnail(self, movie, callback):
+        """
+        Reads (or makes) and decodes the thumbnail of the image of a movie
+        and hands it to the callback. Run by the workers.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail we want.
+            @ callback (Function) - See LoadThumbnail.
+        """
+
+        imageHash = movie.GetImageHash()
+        thumbnailData = movie.GetThumbnailData()
+
+        if thumbnailData is None:
+            imageData = movie.GetImageData()
+
+            if imageData is not None:
+                thumbnailData = self.MakeThumbnail(imageData)
+
+                if thumbnailData is not None:
+                    self.__logger.debug("Made thumbnail of '%s' cover", movie.GetName())
+                    movie.SetThumbnailData(thumbnailData, imageHash)
+
+        image = None
+
+        if thumbnailData is not None:
+            image = self.DecodeImage(thumbnailData)
+
+        wx.CallAfter(callback, movie, image)
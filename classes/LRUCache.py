@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+
+"""
+File: LRUCache.py
+Author: Revolt
+--------------------------
+Desc:
+    This file contains the definition and implementation of a bounded
+    cache that discards the least recently used entries first.
+--------------------------
+Copyright (C) 2010 Revolt 
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict
+
+class LRUCache(object):
+    """ The LRUCache class """
+
+    def __init__(self, capacity):
+        """
+        Initializes a new LRUCache instance.
+        ---
+        Params:
+            @ capacity (Integer) - The maximum number of entries kept in the
+                                   cache. A capacity of 0 disables caching.
+        """
+
+        self.__capacity = capacity
+        self.__entries = OrderedDict()
+
+    def __len__(self):
+        """ Returns the number of entries in the cache """
+
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        """ Checks if the cache has an entry with the specified key """
+
+        return key in self.__entries
+
+    # -- Get Properties --
+    def GetCapacity(self):
+        """
+        Return: (Integer) The maximum number of entries kept in the cache.
+        """
+
+        return self.__capacity
+
+    # -- Methods --
+    def Get(self, key, default = None):
+        """
+        Gets the value associated with a key, marking it as the most
+        recently used.
+        ---
+        Params:
+            @ key - The key of the entry.
+            @ default - The value to return if the key isn't in the cache.
+        ---
+        Return: The cached value or default if there is none.
+        """
+
+        try:
+            value = self.__entries.pop(key)
+        except KeyError, e:
+            return default
+
+        self.__entries[key] = value
+
+        return value
+
+    def Set(self, key, value):
+        """
+        Associates a value with a key, discarding the least recently used
+        entries if the cache grows over its capacity.
+        ---
+        Params:
+            @ key - The key of the entry.
+            @ value - The value to cache.
+        """
+
+        if self.__capacity <= 0:
+            return
+
+        self.__entries.pop(key, None)
+        self.__entries[key] = value
+
+        while len(self.__entries) > self.__capacity:
+            self.__entries.popitem(last = False)
+
+    def Remove(self, key):
+        """
+        Removes the entry with the specified key from the cache, if present.
+        ---
+        Params:
+            @ key - The key of the entry.
+        """
+
+        self.__entries.pop(key, None)
+
+    def Clear(self):
+        """
+        Removes all entries from the cache.
+        """
+
+        self.__entries.clear()
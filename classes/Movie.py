@@ -21,13 +21,30 @@ Copyright (C) 2010 Revolt
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os, urllib, logging
+import os, urllib, logging, hashlib, time
 from datetime import datetime
 from infoproviders import tmdb
 
 class Movie(object):
     """ The Movie class """
 
+    # Catalogues hold many movies, so their attributes are kept in slots
+    # instead of a per instance dict
+    __slots__ = ("__category", "__name", "__path", "__dirtyFields", "__modDate",
+                 "__title", "__imdbID", "__tmdbID", "__year", "__rating",
+                 "__genres", "__overview", "__directors", "__actors",
+                 "__imageData", "__imageHash", "__imageProvider", "__thumbnailData")
+
+    __logger = logging.getLogger("mhdd.movie")
+
+    # The info fields in the order used by info rows (see GetInfoRow)
+    infoFields = ("title", "tmdb", "year", "rating", "genres", "overview",
+                  "directors", "actors", "moddate")
+
+    # Genre and person names repeat a lot between movies, so all movies
+    # share a single copy of each one
+    __nameTable = dict()
+
     def __init__(self, cat, name, path):
         """
         Constructor
@@ -42,19 +59,21 @@ class Movie(object):
         self.__category = cat
         self.__name = name
         self.__path = path
-        self.__dirty = True
-        self.__modDate = datetime.fromtimestamp(0)
+        self.__dirtyFields = frozenset()
+        self.__modDate = 0.0
         self.__title = u""
         self.__imdbID = u""
         self.__tmdbID = u""
         self.__year = u""
         self.__rating = 0
-        self.__genres = []
+        self.__genres = ()
         self.__overview = u""
-        self.__directors = []
-        self.__actors = []
+        self.__directors = ()
+        self.__actors = ()
         self.__imageData = None
-        self.__logger = logging.getLogger("mhdd.movie")
+        self.__imageHash = None
+        self.__imageProvider = None
+        self.__thumbnailData = None
 
     # -- Properties (Get) --
     def GetCategory(self):
@@ -91,6 +110,13 @@ class Movie(object):
         Return: (datetime) The date of last modification.
         """
 
+        return datetime.fromtimestamp(self.__modDate)
+
+    def GetModificationTimestamp(self):
+        """
+        Return: (Float) The date of last modification as a timestamp.
+        """
+
         return self.__modDate
 
     def GetTitle(self):
@@ -123,7 +149,7 @@ class Movie(object):
 
     def GetGenres(self):
         """
-        Return: (List of UStrings) The genres of the movie.
+        Return: (Tuple of UStrings) The genres of the movie.
         """
 
         return self.__genres
@@ -137,24 +163,99 @@ class Movie(object):
 
     def GetDirectors(self):
         """
-        Return: (List of UStrings) The directors of the movie.
+        Return: (Tuple of UStrings) The directors of the movie.
         """
 
         return self.__directors
 
     def GetActors(self):
         """
-        Return: (List) A list of actors in the movie.
+        Return: (Tuple) The actors in the movie.
         """
 
         return self.__actors
 
     def GetImageData(self):
         """
-        Return: (Buffer) The image representing this movie.
+        Return: (Buffer) The image representing this movie. If no image was
+                set on this movie, it is read from its image provider
+                each time it is requested.
+        """
+
+        if self.__imageData is not None:
+            return self.__imageData
+        elif self.__imageProvider is not None:
+            return self.__imageProvider.GetMovieImageData(self)
+        else:
+            return None
+
+    def GetImageHash(self):
+        """
+        Return: (String) The sha1 digest of the image of the movie or None
+                if the movie has no image. If the digest isn't known yet, it
+                is computed from the image data.
+        """
+
+        if self.__imageHash is None:
+            imageData = self.GetImageData()
+
+            if imageData is not None:
+                self.__imageHash = hashlib.sha1(imageData).hexdigest()
+
+        return self.__imageHash
+
+    def GetImageProvider(self):
+        """
+        Return: (Provider) The provider from which the image of the movie is
+                read or None if the image was set directly on the movie.
+        """
+
+        return self.__imageProvider
+
+    def GetThumbnailData(self):
+        """
+        Return: (Buffer) The thumbnail of the image of this movie (see
+                ImagePipeline) or None if there is none. If the image was
+                read from a provider, so is the thumbnail.
+        """
+
+        if self.__imageData is not None:
+            return self.__thumbnailData
+        elif self.__imageProvider is not None:
+            return self.__imageProvider.GetMovieThumbnailData(self)
+        else:
+            return None
+
+    def GetInfoRow(self):
+        """
+        Return: (Tuple) The info of the movie in the order of infoFields, as
+                it is stored by the providers: list fields joined with '||'
+                and the modification date as a timestamp.
+        """
+
+        separator = u"||"
+
+        return (self.__title, self.__tmdbID, self.__year, self.__rating,
+                separator.join(self.__genres), self.__overview,
+                separator.join(self.__directors), separator.join(self.__actors),
+                self.__modDate)
+
+    def IsDirty(self):
+        """
+        Return: (Boolean) Whether any info of the movie changed since it was
+                last loaded or saved.
         """
 
-        return self.__imageData
+        return len(self.__dirtyFields) > 0
+
+    def GetDirtyFields(self):
+        """
+        Return: (Set of Strings) The info dict keys of the fields changed
+                since the movie was last loaded or saved ('image' if the
+                image changed).
+        """
+
+        return self.__dirtyFields
 
     # -- Properties (Set) --
     def SetModificationDate(self, date):
@@ -162,17 +263,17 @@ class Movie(object):
         Sets the modification date of the movie.
         ---
         Params:
-            @ date (datetime) - The new date of modification of the movie.
+            @ date (datetime) - The new date of modification of the movie,
+                                either as a datetime or a timestamp.
         """
 
         if isinstance(date, datetime):
-            self.__modDate = date
+            self.__modDate = time.mktime(date.timetuple())
         else:
             try:
-                timestamp = float(date)
-                self.__modDate = datetime.fromtimestamp(timestamp)
+                self.__modDate = float(date)
             except ValueError, e:
-                self.__modDate = datetime.fromtimestamp(0)
+                self.__modDate = 0.0
 
     def SetTitle(self, title):
         """
@@ -182,8 +283,9 @@ class Movie(object):
             @ title (UString) - The title of the movie.
         """
 
-        self.__dirty = True
-        self.__title = title
+        if title != self.__title:
+            self.__MarkDirty("title")
+            self.__title = title
 
     def SetTMDBID(self, id):
         """
@@ -193,8 +295,9 @@ class Movie(object):
             @ url (UString) - The TMDB id of the movie.
         """
 
-        self.__dirty = True
-        self.__tmdbID = id
+        if id != self.__tmdbID:
+            self.__MarkDirty("tmdb")
+            self.__tmdbID = id
 
     def SetYear(self, year):
         """
@@ -204,8 +307,9 @@ class Movie(object):
             @ year (UString) - The year of release of the movie.
         """
 
-        self.__dirty = True
-        self.__year = year
+        if year != self.__year:
+            self.__MarkDirty("year")
+            self.__year = year
 
     def SetRating(self, rating):
         """
@@ -224,8 +328,9 @@ class Movie(object):
         if rating < 1 or rating > 10:
             return
 
-        self.__dirty = True
-        self.__rating = rating
+        if rating != self.__rating:
+            self.__MarkDirty("rating")
+            self.__rating = rating
 
     def SetGenres(self, genres):
         """
@@ -236,11 +341,15 @@ class Movie(object):
         """
 
         if isinstance(genres, basestring):
-            self.__dirty = True
             separator = u"||"
-            self.__genres = genres.split(separator)
-        elif isinstance(genres, list):
-            self.__dirty = True
+            genres = genres.split(separator)
+        elif not isinstance(genres, (list, tuple)):
+            return
+
+        genres = self.__InternNames(genres)
+
+        if genres != self.__genres:
+            self.__MarkDirty("genres")
             self.__genres = genres
 
     def SetOverview(self, overview):
@@ -251,8 +360,9 @@ class Movie(object):
             @ overview (UString) - The overview of the movie.
         """
         
-        self.__dirty = True
-        self.__overview = overview
+        if overview != self.__overview:
+            self.__MarkDirty("overview")
+            self.__overview = overview
 
     def SetDirectors(self, directors):
         """
@@ -263,11 +373,15 @@ class Movie(object):
         """
 
         if isinstance(directors, basestring):
-            self.__dirty = True
             separator = u"||"
-            self.__directors = directors.split(separator)
-        elif isinstance(directors, list):
-            self.__dirty = True
+            directors = directors.split(separator)
+        elif not isinstance(directors, (list, tuple)):
+            return
+
+        directors = self.__InternNames(directors)
+
+        if directors != self.__directors:
+            self.__MarkDirty("directors")
             self.__directors = directors
 
     def SetActors(self, actors):
@@ -279,11 +393,15 @@ class Movie(object):
         """
 
         if isinstance(actors, basestring):
-            self.__dirty = True
             separator = u"||"
-            self.__actors = actors.split(separator)
-        elif isinstance(actors, list):
-            self.__dirty = True
+            actors = actors.split(separator)
+        elif not isinstance(actors, (list, tuple)):
+            return
+
+        actors = self.__InternNames(actors)
+
+        if actors != self.__actors:
+            self.__MarkDirty("actors")
             self.__actors = actors
 
     def SetImageData(self, image):
@@ -294,55 +412,109 @@ class Movie(object):
             @ image (Bytes) - Bytes containing image data.
         """
 
-        self.__dirty = True
+        imageHash = hashlib.sha1(image).hexdigest()
+
+        # Setting the image the movie already has doesn't change anything
+        if imageHash == self.GetImageHash():
+            return
+
+        self.__MarkDirty("image")
         self.__imageData = buffer(image)
+        self.__imageHash = imageHash
+        self.__imageProvider = None
+        self.__thumbnailData = None
 
-    # -- Methods --
-    def GetInfoDict(self):
+    def SetImageHash(self, imageHash):
         """
-        Return: (Dict) An info dict containing all info of this movie
-                object.
+        Sets the digest of the image of the movie as stored by its provider,
+        so that it doesn't have to be computed from the image data.
+        ---
+        Params:
+            @ imageHash (String) - The sha1 digest of the image.
         """
 
-        global getMethodsDict
-        infoDict = dict()
+        self.__imageHash = imageHash
 
-        for key, value in getMethodsDict.iteritems():
-            infoDict[key] = value(self)
+    def SetImageProvider(self, provider):
+        """
+        Sets the provider from which the image of the movie is read when
+        requested. Any image previously set on the movie is discarded.
+        ---
+        Params:
+            @ provider (Provider) - The provider holding the movie image.
+        """
 
-        return infoDict
+        self.__imageData = None
+        self.__imageHash = None
+        self.__imageProvider = provider
+        self.__thumbnailData = None
 
-    def SetInfoFromDict(self, infoDict, dirty = False):
+    def SetThumbnailData(self, thumbnailData, imageHash = None):
         """
-        Sets movie info from an info dict.
+        Sets the thumbnail of the image of the movie. If the image was set
+        on the movie, the thumbnail is saved along with it, otherwise it's
+        stored right away by the provider of the image.
         ---
         Params:
-            @ infodict (Dict) - A dict object containing movie info.
-            @ dirty (Boolean) - Is the dict coming directly from the
-                                provider (thus not dirty) or from another
-                                source (thus dirty).
+            @ thumbnailData (Bytes) - The thumbnail data.
+            @ imageHash (String) - The digest of the image the thumbnail was
+                                   made from. If provided, the thumbnail is
+                                   discarded if the image has changed since.
         ---
-        Return: (Boolean) True if info was loaded successfully,
-                          False otherwise.
+        Return: (Boolean) True if the thumbnail was set, False otherwise.
         """
 
-        global setMethodsDict
-
-        if infoDict is not None:
-            for key, value in infoDict.iteritems():
-                if value is None:
-                    continue
-                try:
-                    function = setMethodsDict[key]
-                    function(self, value)
-                except KeyError, e:
-                    pass
+        if imageHash is not None and imageHash != self.GetImageHash():
+            return False
 
-            self.__dirty = dirty
+        if self.__imageData is not None:
+            self.__thumbnailData = buffer(thumbnailData)
             return True
+        elif self.__imageProvider is not None:
+            return self.__imageProvider.SaveMovieThumbnailData(self, thumbnailData)
         else:
             return False
 
+    # -- Methods --
+    def SetInfoFromRow(self, infoRow):
+        """
+        Sets movie info from an info row as read by a provider. The movie
+        isn't marked as changed.
+        ---
+        Params:
+            @ infoRow (Sequence) - The info values in the order of infoFields
+                                   (see GetInfoRow). Extra values at the end
+                                   are ignored, None values are skipped.
+        """
+
+        separator = u"||"
+
+        # Assigned directly since the values are known to be unchanged
+        title, tmdbID, year, rating, genres, overview, directors, actors, modDate = \
+            infoRow[0], infoRow[1], infoRow[2], infoRow[3], infoRow[4], \
+            infoRow[5], infoRow[6], infoRow[7], infoRow[8]
+
+        if title is not None:
+            self.__title = title
+        if tmdbID is not None:
+            self.__tmdbID = tmdbID
+        if year is not None:
+            self.__year = year
+        if rating is not None:
+            self.__rating = int(rating)
+        if genres is not None:
+            self.__genres = self.__InternNames(genres.split(separator))
+        if overview is not None:
+            self.__overview = overview
+        if directors is not None:
+            self.__directors = self.__InternNames(directors.split(separator))
+        if actors is not None:
+            self.__actors = self.__InternNames(actors.split(separator))
+        if modDate is not None:
+            self.__modDate = float(modDate)
+
+        self.__dirtyFields = frozenset()
+
     def LoadInfoFromHdd(self):
         """
         Loads movie info from the Hdd.
@@ -351,12 +523,10 @@ class Movie(object):
                            False otherwise.
         """
 
-        if not self.__dirty:
+        if not self.IsDirty():
             return True
 
-        infoDict = self.__category.GetHdd().LoadMovieInfo(self)
-
-        return self.LoadInfoFromDict(infoDict)
+        return self.__category.GetHdd().LoadMovieInfo(self)
 
     def SaveInfoToHdd(self):
         """
@@ -366,12 +536,27 @@ class Movie(object):
                  to be saved, False if there was an error
         """
 
-        if self.__dirty:
-            self.SetModificationDate(datetime.now())
-            return self.__category.GetHdd().SaveMovieInfo(self)
-        else:
+        if not self.IsDirty():
             return True
 
+        self.SetModificationDate(datetime.now())
+
+        hdd = self.__category.GetHdd()
+
+        if not hdd.SaveMovieInfo(self):
+            return False
+
+        self.__dirtyFields = frozenset()
+
+        # Now that the HDD has the image, it's read back from there when
+        # requested instead of being kept in memory
+        if self.__imageData is not None:
+            self.__imageData = None
+            self.__thumbnailData = None
+            self.__imageProvider = hdd
+
+        return True
+
     def LoadInfoFromIMDB(self):
         """
         Loads the movie info from IMDB.
@@ -387,16 +572,18 @@ class Movie(object):
         self.__title = imdbMovieObj['title']
         self.__year = unicode(imdbMovieObj['year'])
         self.__rating = int(round(float(imdbMovieObj['rating']), 0))
-        self.__genres = imdbMovieObj['genres']
+        self.__genres = self.__InternNames(imdbMovieObj['genres'])
         self.__overview = imdbMovieObj['overview'][0]
         
-        self.__directors = []
+        directors = []
         for director in imdbMovieObj['director']:
-            self.__directors.append(director['name'])
+            directors.append(director['name'])
+        self.__directors = self.__InternNames(directors)
 
-        self.__actors = []
+        actors = []
         for actor in imdbMovieObj['cast']:
-            self.__actors.append(actor['name'])
+            actors.append(actor['name'])
+        self.__actors = self.__InternNames(actors)
 
         img = None
 
@@ -410,12 +597,21 @@ class Movie(object):
             if img is not None:
                 img.close()
 
-        self.__dirty = True
+        self.__dirtyFields = self.__dirtyFields.union(["title", "year", "rating",
+                                                       "genres", "overview",
+                                                       "directors", "actors"])
 
-    def LoadInfoFromTMDB(self):
+    def LoadInfoFromTMDB(self, imagePipeline = None):
         """
         Loads the movie info from TMDB.
         ---
+        Params:
+            @ imagePipeline (ImagePipeline) - If provided, the cover image is
+                                              downloaded by it (tagged with
+                                              this movie) instead of before
+                                              returning. The caller is then
+                                              responsible for setting it.
+        ---
         Return: (Boolean) true on success, false otherwise
         """
 
@@ -462,44 +658,46 @@ class Movie(object):
             pass
         self.SetActors(actors)
 
-        img = None
+        try:
+            coverURL = movieInfo['images'][0]['cover']
+        except (KeyError, IndexError), e:
+            return True
+
+        if imagePipeline is not None:
+            imagePipeline.Download(self, coverURL)
+            return True
 
         try:
-            img = urllib.urlopen(movieInfo['images'][0]['cover'])
-            imgData = img.read()
+            # Downloaded through the connection pool of the TMDB client so
+            # that refreshing several movies reuses the same connections
+            imgData = tmdb.fetchUrl(coverURL)
             self.SetImageData(imgData)
-        except KeyError, e:
-            pass
-        except IOError, e:
+        except tmdb.TmdHttpError, e:
             self.__logger.exception("Error reading cover image")
             pass
-        finally:
-            if img is not None:
-                img.close()
 
-        self.__dirty = True
         return True
 
-setMethodsDict = dict()
-setMethodsDict['title'] = Movie.SetTitle
-setMethodsDict['tmdb'] = Movie.SetTMDBID
-setMethodsDict['year'] = Movie.SetYear
-setMethodsDict['rating'] = Movie.SetRating
-setMethodsDict['overview'] = Movie.SetOverview
-setMethodsDict['genres'] = Movie.SetGenres
-setMethodsDict['directors'] = Movie.SetDirectors
-setMethodsDict['actors'] = Movie.SetActors
-setMethodsDict['image'] = Movie.SetImageData
-setMethodsDict['moddate'] = Movie.SetModificationDate
-
-getMethodsDict = dict()
-getMethodsDict['title'] = Movie.GetTitle
-getMethodsDict['tmdb'] = Movie.GetTMDBID
-getMethodsDict['year'] = Movie.GetYear
-getMethodsDict['rating'] = Movie.GetRating
-getMethodsDict['overview'] = Movie.GetOverview
-getMethodsDict['genres'] = Movie.GetGenres
-getMethodsDict['directors'] = Movie.GetDirectors
-getMethodsDict['actors'] = Movie.GetActors
-getMethodsDict['image'] = Movie.GetImageData
-getMethodsDict['moddate'] = Movie.GetModificationDate
+    def __MarkDirty(self, field):
+        """
+        Marks a field of the movie as changed.
+        ---
+        Params:
+            @ field (String) - The info dict key of the field.
+        """
+
+        self.__dirtyFields = self.__dirtyFields.union([field])
+
+    def __InternNames(self, names):
+        """
+        Replaces each name by the copy shared by all movies.
+        ---
+        Params:
+            @ names (List of UStrings) - The names to intern.
+        ---
+        Return: (Tuple of UStrings) The shared copies of the names.
+        """
+
+        nameTable = self.__nameTable
+
+        return tuple([nameTable.setdefault(name, name) for name in names])
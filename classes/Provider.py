@@ -24,9 +24,14 @@ Copyright (C) 2010 Revolt
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from classes.Movie import *
+
 class Provider(object):
     """ The Provider class """
 
+    # How many movies are loaded between calls to a progress callback
+    progressChunkSize = 200
+
     def __init__(self, hdd):
         """
         Initializes a new Provider instance.
@@ -81,30 +86,36 @@ class Provider(object):
 
         raise NotImplementedError()
 
-    def GetCategoryMovieList(self, cat):
+    def GetCategoryMovieList(self, cat, progress = None):
         """
         Gets a list of all movies contained in the provided category.
         ---
         Params:
              @ cat (Category) - The category whose movies we wish to load.
+             @ progress (Function) - Called with each chunk of movies loaded
+                                     (see ReportProgress). Loading is
+                                     cancelled if it returns False.
         ---
-        Return: (List of Movies) List of movies contained in the category.
+        Return: (List of Movies) List of movies contained in the category
+                 or None if loading failed or was cancelled.
         """
         
         raise NotImplementedError()
 
-    def LoadCategoryMovieList(self, cat):
+    def LoadCategoryMovieList(self, cat, progress = None):
         """
         Loads all movies contained in the provided category and sets them to
         the provided category.
         ---
         Params:
             @ cat (Category) - The category whose movies we want to load.
+            @ progress (Function) - Called with each chunk of movies loaded.
+                                    Loading is cancelled if it returns False.
         ---
         Return: (Boolean) True if successful, False otherwise
         """
 
-        movieList = self.GetCategoryMovieList(cat)
+        movieList = self.GetCategoryMovieList(cat, progress)
 
         if movieList is None:
             return False
@@ -113,14 +124,60 @@ class Provider(object):
 
         return True
 
-    def GetMovieInfoDict(self, movie):
+    def ReportProgress(self, progress, movieList, reported, final = False):
+        """
+        Passes the movies loaded since the last report to a progress callback,
+        once there are at least progressChunkSize of them.
+        ---
+        Params:
+            @ progress (Function) - The callback (None if there is none).
+            @ movieList (List of Movies) - The movies loaded so far.
+            @ reported (Integer) - How many of them were already reported.
+            @ final (Boolean) - Whether loading is done, so that the last
+                                movies are reported however few they are.
+        ---
+        Return: (Integer) How many movies were reported so far or None if
+                 the callback asked to cancel loading.
+        """
+
+        if progress is None:
+            return reported
+
+        if len(movieList) - reported < self.progressChunkSize and \
+           not (final and len(movieList) > reported):
+            return reported
+
+        if progress(movieList[reported:]) is False:
+            return None
+
+        return len(movieList)
+
+    def SearchCategoryMovies(self, cat, query):
+        """
+        Searches the movies of the provided category matching a query.
+        Providers without a search index don't support searching.
+        ---
+        Params:
+            @ cat (Category) - The category whose movies we want to search.
+            @ query (String) - The words to look for.
+        ---
+        Return: (List of Strings) The relative paths of the movies found, the
+                 most relevant first, or None if searching isn't supported.
+        """
+
+        return None
+
+    def GetMovieInfoRow(self, movie):
         """
-        Gets the info of the provided movie and returns it in a dict.
+        Gets the info of the provided movie as it is stored by the provider.
         ---
         Params:
             @ movie (Movie) - The movie whose info we wish to load.
         ---
-        Return: (Dict) A dict containing movie info.
+        Return: (Sequence) The info of the movie in the order of
+                 Movie.infoFields followed by the digest of its image (see
+                 Movie.SetInfoFromRow), with None for missing values, or None
+                 if the info couldn't be read.
         """
 
         raise NotImplementedError()
@@ -135,8 +192,55 @@ class Provider(object):
         Return: (Boolean) True on success, False otherwise
         """
 
-        return movie.SetInfoFromDict(self.GetMovieInfoDict(movie))
+        infoRow = self.GetMovieInfoRow(movie)
+
+        if infoRow is None:
+            return False
+
+        movie.SetImageProvider(self)
+        movie.SetInfoFromRow(infoRow)
+        movie.SetImageHash(infoRow[len(Movie.infoFields)])
+
+        return True
+
+    def GetMovieImageData(self, movie):
+        """
+        Reads the image of the provided movie. Images aren't part of the
+        info dict so that they are only loaded when actually needed.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose image we want.
+        ---
+        Return: (Bytes) The image data or None if the movie has no image.
+        """
+
+        raise NotImplementedError()
+
+    def GetMovieThumbnailData(self, movie):
+        """
+        Reads the thumbnail of the image of the provided movie (see
+        ImagePipeline). Providers that don't store thumbnails have none.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail we want.
+        ---
+        Return: (Bytes) The thumbnail data or None if there is none.
+        """
+
+        return None
 
+    def SaveMovieThumbnailData(self, movie, thumbnailData):
+        """
+        Stores the thumbnail of the image of a movie read from this provider.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail to store.
+            @ thumbnailData (Bytes) - The thumbnail data.
+        ---
+        Return: (Boolean) True if the thumbnail was stored, False otherwise.
+        """
+
+        return False
 
     def SaveMovieInfo(self, movie):
         """
@@ -150,6 +254,16 @@ class Provider(object):
 
         raise NotImplementedError()
 
+    def Flush(self):
+        """
+        Waits until all pending saves have been written to the media storage.
+        Providers that don't write in the background have nothing to flush.
+        ---
+        Return: (Boolean) True on success, False otherwise
+        """
+
+        return True
+
     def CleanAllInfo(self):
         """
         Cleans all MHDD Organizer info from the media storage.
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+"""
+File: RateLimiter.py
+Author: Revolt
+--------------------------
+Desc:
+    This file contains the definition and implementation of a limiter
+    of how often something (for example a request to an online service)
+    is done, shared by several threads.
+--------------------------
+Copyright (C) 2010 Revolt
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading, time
+from collections import deque
+
+class RateLimiter(object):
+    """ The RateLimiter class """
+
+    def __init__(self, maxCalls, period):
+        """
+        Initializes a new RateLimiter instance.
+        ---
+        Params:
+            @ maxCalls (Integer) - How many calls are allowed in each period.
+                                   If 0 or less, calls aren't limited.
+            @ period (Float) - The length of the period in seconds.
+        """
+
+        self.__maxCalls = maxCalls
+        self.__period = period
+        self.__lock = threading.Lock()
+        self.__callTimes = deque()
+
+    # -- Methods --
+    def Wait(self):
+        """
+        Waits until another call is allowed and counts it as done. Calls are
+        allowed once there were less than maxCalls calls in the last period.
+        """
+
+        if self.__maxCalls <= 0:
+            return
+
+        while True:
+            with self.__lock:
+                now = time.time()
+
+                while len(self.__callTimes) > 0 and \
+                      self.__callTimes[0] <= now - self.__period:
+                    self.__callTimes.popleft()
+
+                if len(self.__callTimes) < self.__maxCalls:
+                    self.__callTimes.append(now)
+                    return
+
+                delay = self.__callTimes[0] + self.__period - now
+
+            time.sleep(delay)
@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+
+"""
+File: WorkerPool.py
+Author: Revolt
+--------------------------
+Desc:
+    This file contains the definition and implementation of a pool
+    of worker threads that run submitted jobs concurrently.
+--------------------------
+Copyright (C) 2010 Revolt 
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading, logging, Queue
+
+class WorkerPool(object):
+    """ The WorkerPool class """
+
+    def __init__(self, maxWorkers, keepResults = True):
+        """
+        Initializes a new WorkerPool instance. Worker threads are only
+        started as jobs are submitted.
+        ---
+        Params:
+            @ maxWorkers (Integer) - The maximum number of jobs running at
+                                     the same time.
+            @ keepResults (Boolean) - Whether the results of the jobs are kept
+                                      until read with GetResult. Pools whose
+                                      jobs deliver their results themselves
+                                      should not keep them.
+        """
+
+        self.__logger = logging.getLogger("mhdd.workerpool")
+        self.__maxWorkers = max(1, maxWorkers)
+        self.__workerList = []
+        self.__jobQueue = Queue.Queue()
+        self.__resultQueue = Queue.Queue()
+        self.__keepResults = keepResults
+
+    # -- Get Properties --
+    def GetMaxWorkers(self):
+        """
+        Return: (Integer) The maximum number of jobs running at the same time.
+        """
+
+        return self.__maxWorkers
+
+    # -- Methods --
+    def Submit(self, tag, function, *args):
+        """
+        Submits a new job to the pool.
+        ---
+        Params:
+            @ tag - A value identifying the job in its result.
+            @ function (Callable) - The function to run.
+            @ args - The arguments with which to call the function.
+        """
+
+        self.__jobQueue.put((tag, function, args))
+
+        if len(self.__workerList) < self.__maxWorkers:
+            worker = threading.Thread(target = self.__WorkerLoop)
+            worker.setDaemon(True)
+            worker.start()
+            self.__workerList.append(worker)
+
+    def GetResult(self, timeout = None):
+        """
+        Gets the result of a finished job, in the order jobs finish.
+        ---
+        Params:
+            @ timeout (Float) - How many seconds to wait for a job to finish.
+                                If None, waits for as long as needed.
+        ---
+        Return: (Tuple) A (tag, result, exception) tuple where exception is
+                 the exception raised by the job or None, or None if no job
+                 finished before the timeout.
+        """
+
+        try:
+            return self.__resultQueue.get(True, timeout)
+        except Queue.Empty, e:
+            return None
+
+    def Cancel(self):
+        """
+        Discards all submitted jobs that haven't started yet.
+        ---
+        Return: (Integer) The number of jobs discarded.
+        """
+
+        cancelled = 0
+
+        while True:
+            try:
+                self.__jobQueue.get_nowait()
+                cancelled += 1
+            except Queue.Empty, e:
+                return cancelled
+
+    def Shutdown(self, wait = True):
+        """
+        Discards pending jobs and stops the worker threads once they finish
+        the jobs they are running.
+        ---
+        Params:
+            @ wait (Boolean) - Whether to wait for the worker threads to stop.
+        """
+
+        self.Cancel()
+
+        for worker in self.__workerList:
+            self.__jobQueue.put(None)
+
+        if wait:
+            for worker in self.__workerList:
+                worker.join()
+
+        self.__workerList = []
+
+    def __WorkerLoop(self):
+        """
+        The loop run by each worker thread.
+        """
+
+        while True:
+            job = self.__jobQueue.get()
+
+            if job is None:
+                return
+
+            tag, function, args = job
+
+            try:
+                result = function(*args)
+                exception = None
+            except Exception, e:
+                self.__logger.exception("Error running job in worker pool")
+                result = None
+                exception = e
+
+            if self.__keepResults:
+                self.__resultQueue.put((tag, result, exception))
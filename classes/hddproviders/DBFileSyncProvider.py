@@ -23,7 +23,7 @@ Copyright (C) 2010 Revolt
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os, logging, time, sqlite3, wx
+import os, logging, time, threading, sqlite3, wx
 from datetime import datetime
 from classes.Provider import *
 from classes.hddproviders.FileProvider import *
@@ -46,6 +46,9 @@ class DBFileSyncProvider(Provider):
         self.__logger = logging.getLogger("mhdd.providers.dbfile")
         self.__dbProvider = DatabaseProvider(hdd)
         self.__fileProvider = FileProvider(hdd)
+        # One lock per category (by relative path), see GetCategoryMovieList
+        self.__catLockDict = dict()
+        self.__catLockDictLock = threading.Lock()
         
     # -- Methods --
     def GetCategoryList(self):
@@ -93,83 +96,208 @@ class DBFileSyncProvider(Provider):
 
         return True
 
-    def GetCategoryMovieList(self, cat):
+    def GetCategoryMovieList(self, cat, progress = None):
         """
         Loads all movies contained in the provided category and returns a list
         with them.
+        A manifest of the category directory tree is kept in the DB so that
+        directories that didn't change since the last sync aren't listed
+        again and info files that weren't modified aren't read again (the
+        info in the DB is used instead).
         ---
         Params:
             @ cat (Category) - The category whose movies we want.
+            @ progress (Function) - Called with each chunk of movies loaded.
+                                    Loading is cancelled if it returns False,
+                                    in which case nothing is synced.
         ---
-        Return: (List of Movies) The movies contained in the category.
+        Return: (List of Movies) The movies contained in the category or None
+                 if loading failed or was cancelled.
+        """
+
+        # Two syncs of the same category would both insert its new movies, so
+        # a sync waits for the previous one (for example one being cancelled)
+        with self.__catLockDictLock:
+            catLock = self.__catLockDict.setdefault(cat.GetRelativePath(), threading.Lock())
+
+        with catLock:
+            return self.__SyncCategoryMovieList(cat, progress)
+
+    def __SyncCategoryMovieList(self, cat, progress):
+        """
+        Does the work of GetCategoryMovieList, once no other sync of the
+        category is running.
+        ---
+        Params:
+            @ cat (Category) - The category whose movies we want.
+            @ progress (Function) - See GetCategoryMovieList.
+        ---
+        Return: (List of Movies) See GetCategoryMovieList.
         """
 
         self.__logger.debug("Geting category movie list from category (%s)", cat.GetName())
 
-        hddMovieList = self.__fileProvider.GetCategoryMovieList(cat)
+        manifest = self.__dbProvider.GetCategoryManifest(cat)
+        newManifest = dict()
+        failedDirs = []
         dbMovieList = self.__dbProvider.GetCategoryMovieList(cat)
         movieList = []
+        reported = 0
+
+        if dbMovieList is None:
+            return None
+        hddSaveList = []
+        dbSaveList = []
+
+        # Index the DB movies by relative path so that each HDD movie can be
+        # matched in constant time
+        dbMovieDict = dict()
+
+        for dbMovie in dbMovieList:
+            dbMovieDict[dbMovie.GetRelativePath()] = dbMovie
+
+        for movieDirRelPath in self.__fileProvider.WalkMovieDirs(cat.GetFullPath(), manifest,
+                                                                 newManifest, failedDirs):
+            # Report the movies matched in the previous iterations
+            reported = self.ReportProgress(progress, movieList, reported)
+
+            if reported is None:
+                self.__logger.debug("Sync of category '%s' cancelled", cat.GetName())
+                return None
+
+            dbMovie = dbMovieDict.pop(movieDirRelPath, None)
+            entry = newManifest[movieDirRelPath]
+            oldEntry = manifest.get(movieDirRelPath)
+
+            if dbMovie is not None and oldEntry is not None and oldEntry[1] and \
+               oldEntry[2] == entry[2] and oldEntry[3] is not None:
+                # The info file wasn't touched since the last sync so the info
+                # it holds is the one we saw back then
+                dbModDate = dbMovie.GetModificationTimestamp()
+                newManifest[movieDirRelPath] = entry[:3] + (dbModDate,)
+                movieList.append(dbMovie)
+
+                if dbModDate > oldEntry[3]:
+                    # But the info in the DB was changed since then
+                    hddSaveList.append(dbMovie)
 
-        for hddMovie in hddMovieList:
-            j = 0
-            found = False
-
-            for dbMovie in dbMovieList:
-                if hddMovie.GetRelativePath() == dbMovie.GetRelativePath():
-                    # If we found the same movie in both lists...
-                    found = True
-
-                    if dbMovie.GetModificationDate() > hddMovie.GetModificationDate():
-                        # If the info in the DB is more recent than the info on the HDD...
-                        movieList.append(dbMovie)
-                        # Update the info in the HDD right now
-                        self.__fileProvider.SaveMovieInfo(dbMovie)
-                    elif dbMovie.GetModificationDate() < hddMovie.GetModificationDate():
-                        # Else the HDD info is more recent than the info in the DB
-                        movieList.append(hddMovie)
-                        # Update the info in the DB right now
-                        self.__dbProvider.SaveMovieInfo(hddMovie)
-                    else:
-                        # If both have the same modification date then just return one of
-                        # them
-                        movieList.append(dbMovie)
-
-                    dbMovieList.pop(j)
-                    break
-
-                j += 1
-
-            if not found:
-                # If we haven't found a matching movie in the dbList then this is a new
+                continue
+
+            hddMovie = self.__fileProvider.GetMovie(cat, movieDirRelPath)
+            newManifest[movieDirRelPath] = entry[:3] + \
+                                           (hddMovie.GetModificationTimestamp(),)
+
+            if dbMovie is None:
+                # If we haven't found a matching movie in the DB then this is a new
                 # movie so add it to the movieList and update the DB
                 movieList.append(hddMovie)
-                self.__dbProvider.SaveMovieInfo(hddMovie)
-
-        for movie in dbMovieList:
-            # Since we delete matches in dbMovieList as we find them, the movies
-            # left in dbMovieList are those that are no longer present in the HDD
-            self.__dbProvider.DeleteMovieInfo(movie)
+                dbSaveList.append(hddMovie)
+            elif dbMovie.GetModificationTimestamp() > hddMovie.GetModificationTimestamp():
+                # If the info in the DB is more recent than the info on the HDD...
+                movieList.append(dbMovie)
+                hddSaveList.append(dbMovie)
+                newManifest[movieDirRelPath] = entry[:3] + \
+                                               (dbMovie.GetModificationTimestamp(),)
+            elif dbMovie.GetModificationTimestamp() < hddMovie.GetModificationTimestamp():
+                # Else the HDD info is more recent than the info in the DB
+                movieList.append(hddMovie)
+                dbSaveList.append(hddMovie)
+            else:
+                # If both have the same modification date then just return one of
+                # them
+                movieList.append(dbMovie)
+
+        # The movies under directories that couldn't be read may well still
+        # be there, so they are kept instead of being deleted as orphans
+        for movieRelPath in dbMovieDict.keys():
+            if self.__IsUnderDirs(movieRelPath, failedDirs):
+                movieList.append(dbMovieDict.pop(movieRelPath))
+
+        if self.ReportProgress(progress, movieList, reported, True) is None:
+            self.__logger.debug("Sync of category '%s' cancelled", cat.GetName())
+            return None
+
+        self.__logger.debug("Sync of category '%s': %d to HDD, %d to DB, %d removed",
+                            cat.GetName(), len(hddSaveList), len(dbSaveList),
+                            len(dbMovieDict))
+
+        for movie in hddSaveList:
+            self.__fileProvider.SaveMovieInfo(movie)
+
+        # All DB changes of the category are written in a single transaction,
+        # holding the DB lock so that concurrent syncs don't interleave. If
+        # any of them fails none is kept, otherwise the manifest could claim
+        # that movies that weren't saved are in sync.
+        with self.__dbProvider.GetLock():
+            # Since we remove matches from dbMovieDict as we find them, the movies
+            # left in it are those that are no longer present in the HDD
+            if not self.__dbProvider.SaveMovieInfoBatch(dbSaveList, False) or \
+               not self.__dbProvider.DeleteMovieInfoBatch(dbMovieDict.values(), False) or \
+               not self.__dbProvider.SaveCategoryManifest(cat, newManifest, manifest, False):
+                self.__logger.error("Error saving sync of category '%s' to the DB",
+                                    cat.GetName())
+                self.__dbProvider.Rollback()
+                return None
+
+            if not self.__dbProvider.Commit():
+                return None
 
         return movieList
 
-    def GetMovieInfoDict(self, movie):
+    def __IsUnderDirs(self, relPath, dirList):
         """
-        Loads all info of the provided movie and returns it as a dict
-        to the caller.
+        Checks if a path is one of the provided directories or under them.
+        ---
+        Params:
+            @ relPath (String) - The path, relative to the category.
+            @ dirList (List of Strings) - The directory paths, relative to the
+                                          category.
+        ---
+        Return: (Boolean) True if the path is under a directory of the list.
+        """
+
+        for dirRelPath in dirList:
+            if dirRelPath == os.curdir or relPath == dirRelPath or \
+               relPath.startswith(dirRelPath + os.sep):
+                return True
+
+        return False
+
+    def SearchCategoryMovies(self, cat, query):
+        """
+        Searches the movies of the provided category in the database cache.
+        ---
+        Params:
+            @ cat (Category) - The category whose movies we want to search.
+            @ query (String) - The words to look for.
+        ---
+        Return: (List of Strings) The relative paths of the movies found, the
+                 most relevant first, or None if searching isn't supported.
+        """
+
+        return self.__dbProvider.SearchCategoryMovies(cat, query)
+
+    def GetMovieInfoRow(self, movie):
+        """
+        Gets the info of the provided movie from the HDD or the database,
+        whichever was modified last.
         ---
         Params:
             @ movie (Movie) - The movie whose info we wish to load.
         ---
-        Return: (Dict) A dict object containing movie info.
+        Return: (Sequence) The info of the movie in the order of
+                 Movie.infoFields followed by the digest of its image.
         """
 
         self.__logger.debug("Getting movie info (%s)", movie.GetName())
 
-        hddInfo = self.__fileProvider.GetMovieInfoDict(movie)
-        dbInfo = self.__dbProvider.GetMovieInfoDict(movie)
+        hddInfo = self.__fileProvider.GetMovieInfoRow(movie)
+        dbInfo = self.__dbProvider.GetMovieInfoRow(movie)
 
         if hddInfo is not None and dbInfo is not None:
-            if hddInfo['moddate'] >= dbInfo['moddate']:
+            modDateIndex = Movie.infoFields.index("moddate")
+
+            if (hddInfo[modDateIndex] or 0.0) >= (dbInfo[modDateIndex] or 0.0):
                 return hddInfo
             else:
                 return dbInfo
@@ -178,6 +306,51 @@ class DBFileSyncProvider(Provider):
         else:
             return dbInfo
 
+    def GetMovieImageData(self, movie):
+        """
+        Reads the cover image of the provided movie from the database cache,
+        falling back to the HDD if it isn't cached.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose image we want.
+        ---
+        Return: (Bytes) The image data or None if the movie has no image.
+        """
+
+        imageData = self.__dbProvider.GetMovieImageData(movie)
+
+        if imageData is None:
+            imageData = self.__fileProvider.GetMovieImageData(movie)
+
+        return imageData
+
+    def GetMovieThumbnailData(self, movie):
+        """
+        Reads the thumbnail of the cover image of the provided movie from the
+        database cache. Thumbnails are never stored on the HDD.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail we want.
+        ---
+        Return: (Bytes) The thumbnail data or None if there is none.
+        """
+
+        return self.__dbProvider.GetMovieThumbnailData(movie)
+
+    def SaveMovieThumbnailData(self, movie, thumbnailData):
+        """
+        Stores the thumbnail of the cover image of a movie in the database
+        cache only, so that browsing movies doesn't write to the HDD.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail to store.
+            @ thumbnailData (Bytes) - The thumbnail data.
+        ---
+        Return: (Boolean) True if the thumbnail was stored, False otherwise.
+        """
+
+        return self.__dbProvider.SaveMovieThumbnailData(movie, thumbnailData)
+
     def SaveMovieInfo(self, movie):
         """
         Saves a single movie to the HDD.
@@ -193,6 +366,15 @@ class DBFileSyncProvider(Provider):
 
         return True
 
+    def Flush(self):
+        """
+        Waits until all pending saves have been written to the HDD.
+        ---
+        Return: (Boolean) True on success, false otherwise
+        """
+
+        return self.__fileProvider.Flush()
+
     def CleanAllInfo(self):
         """
         Deletes all info stored on the database and harddrive.
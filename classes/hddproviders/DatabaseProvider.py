@@ -23,15 +23,67 @@ Copyright (C) 2010 Revolt
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os, logging, time, sqlite3, wx
+import os, re, logging, time, sqlite3, hashlib, threading, wx
 from datetime import datetime
 from classes.Provider import *
 from classes.Category import *
 from classes.Movie import *
+from classes.CatalogueIndex import *
+
+def Synchronized(method):
+    """
+    Decorates a DatabaseProvider method so that it runs while holding the
+    provider lock.
+    """
+
+    def SynchronizedMethod(self, *args, **kwargs):
+        with self.GetLock():
+            return method(self, *args, **kwargs)
+
+    SynchronizedMethod.__name__ = method.__name__
+    SynchronizedMethod.__doc__ = method.__doc__
+
+    return SynchronizedMethod
 
 class DatabaseProvider(Provider):
     """ The DatabaseProvider class """
 
+    # Columns of the movies table holding movie info (the image is left out).
+    # The info fields come first so that rows can be passed directly to
+    # Movie.SetInfoFromRow
+    __infoColumns = ", ".join(["movies." + field for field in Movie.infoFields]) + \
+                    ", movies.imagehash, movies.id, movies.cat, movies.name, movies.path"
+
+    # Statements taking the info row of a movie followed by the parameters
+    # in their names
+    __insertInfoImageCatNamePath = "INSERT INTO movies (" + ", ".join(Movie.infoFields) + \
+                                   ", imagehash, cat, name, path) VALUES (" + \
+                                   ", ".join(["?"] * (len(Movie.infoFields) + 4)) + ")"
+    __updateInfoImageWhereCatPath = "UPDATE movies SET " + \
+                                    ", ".join([field + " = ?" for field in Movie.infoFields]) + \
+                                    ", imagehash = ? WHERE cat = ? AND path = ?"
+    __updateInfoWhereCatPath = "UPDATE movies SET " + \
+                               ", ".join([field + " = ?" for field in Movie.infoFields]) + \
+                               " WHERE cat = ? AND path = ?"
+
+    # The info columns which can be updated on their own
+    __fieldColumns = frozenset(["title", "tmdb", "year", "rating", "genres",
+                                "overview", "directors", "actors"])
+
+    # The info columns also kept in the catalogue index
+    __indexColumns = frozenset(["title", "tmdb", "year"])
+
+    # How many movie paths are looked up with a single query, below SQLite's
+    # default limit of 999 parameters per statement
+    __pathChunkSize = 500
+
+    # The columns of the full-text search index and the weight of each one
+    # when ranking the results
+    __searchColumns = ("name", "title", "overview", "genres", "actors", "directors")
+    __searchWeights = (10.0, 10.0, 1.0, 2.0, 2.0, 2.0)
+
+    __searchTokenPattern = re.compile(r"\w+", re.UNICODE)
+
     def __init__(self, hdd):
         """
         Initializes a new DatabaseProvider instance.
@@ -56,8 +108,17 @@ class DatabaseProvider(Provider):
 
         dbPath = os.path.join(dbFolder, hdd.GetUuid())
 
-        self.__dbConn = sqlite3.connect(dbPath)
+        # The connection is shared by all threads using this provider (for
+        # example when loading several categories at once), access to it is
+        # serialized through the provider lock
+        self.__lock = threading.RLock()
+        self.__dbConn = sqlite3.connect(dbPath, check_same_thread = False)
         self.__dbConn.row_factory = sqlite3.Row
+        self.__hasSearchIndex = False
+
+        # Catalogue index changes of batches saved with commit = False, only
+        # applied once their transaction is committed
+        self.__pendingIndexUpdates = []
 
         self.InitializeDatabase()
 
@@ -69,16 +130,80 @@ class DatabaseProvider(Provider):
         self.__logger.debug("Destroying DatabaseProvider...")
         self.__dbConn.close()
 
+    # -- Get Properties --
+    def GetLock(self):
+        """
+        Return: (RLock) The lock which must be held while using the database
+                 connection. Holding it across several calls makes them
+                 atomic in regard to other threads.
+        """
+
+        return self.__lock
+
     # -- Methods --
     def InitializeDatabase(self):
         """
-        Initializes a new database creating all necessary tables.
+        Initializes the database, creating all necessary tables or upgrading
+        the ones of an existing database to the current schema version.
+        The schema version is kept in the user_version pragma of the DB
+        (databases created before it was used have version 0).
         """
 
         self.__logger.debug("Initializing database tables")
 
+        migrationList = [self.__CreateTables,
+                         self.__CreateMovieIndexes,
+                         self.__CreateImageStore,
+                         self.__CreateManifest,
+                         self.__CreateSearchIndex,
+                         self.__CreateThumbnailStore]
+
         dbCursor = self.__dbConn.cursor()
 
+        dbCursor.execute("PRAGMA user_version")
+        version = dbCursor.fetchone()[0]
+
+        if version > len(migrationList):
+            self.__logger.warning("Database schema version (%d) is newer than " + \
+                                  "the one supported (%d)", version, len(migrationList))
+
+        # Take manual control of the transactions so that each migration
+        # is applied atomically along with its version change
+        self.__dbConn.isolation_level = None
+
+        try:
+            for newVersion in range(version + 1, len(migrationList) + 1):
+                self.__logger.debug("Upgrading database schema to version %d", newVersion)
+
+                dbCursor.execute("BEGIN")
+                migrationList[newVersion - 1](dbCursor)
+                dbCursor.execute("PRAGMA user_version = %d" % newVersion)
+                dbCursor.execute("COMMIT")
+        except sqlite3.Error, e:
+            self.__logger.exception("Error upgrading database schema")
+            dbCursor.execute("ROLLBACK")
+            raise e
+        finally:
+            self.__dbConn.isolation_level = ""
+
+        # The search index isn't available if SQLite was built without FTS5
+        dbCursor.execute("SELECT name FROM sqlite_master WHERE name = 'movies_search'")
+        self.__hasSearchIndex = dbCursor.fetchone() is not None
+
+        if not self.__hasSearchIndex:
+            self.__logger.info("Full-text search isn't available, searches will only " + \
+                               "look at the movie names")
+
+        dbCursor.close()
+
+    def __CreateTables(self, dbCursor):
+        """
+        Schema version 1: Creates the categories and movies tables.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the changes.
+        """
+
         sql = "CREATE TABLE IF NOT EXISTS categories " + \
               "(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, " + \
               "path TEXT UNIQUE);"
@@ -92,10 +217,147 @@ class DatabaseProvider(Provider):
 
         dbCursor.execute(sql)
 
-        self.__dbConn.commit()
+    def __CreateMovieIndexes(self, dbCursor):
+        """
+        Schema version 2: Makes (cat, path) unique in the movies table and
+        indexes the tmdb column.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the changes.
+        """
 
-        dbCursor.close()
+        # Older versions could leave duplicate rows of the same movie behind,
+        # keep only the most recently modified one (the last inserted if they
+        # were modified at the same time) so the unique index can be created.
+        # A temporary index keeps the lookup of the other rows of each movie fast
+        dbCursor.execute("CREATE INDEX movies_dedup ON movies (cat, path, moddate, id)")
+        dbCursor.execute("DELETE FROM movies WHERE EXISTS (SELECT 1 FROM movies AS other " + \
+                         "WHERE other.cat = movies.cat AND other.path = movies.path AND " + \
+                         "(IFNULL(other.moddate, 0) > IFNULL(movies.moddate, 0) OR " + \
+                         "(IFNULL(other.moddate, 0) = IFNULL(movies.moddate, 0) AND " + \
+                         "other.id > movies.id)))")
+        dbCursor.execute("DROP INDEX movies_dedup")
+
+        dbCursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS movies_cat_path " + \
+                         "ON movies (cat, path)")
+        dbCursor.execute("CREATE INDEX IF NOT EXISTS movies_tmdb ON movies (tmdb)")
+
+    def __CreateImageStore(self, dbCursor):
+        """
+        Schema version 3: Moves the cover images out of the movies table into
+        the images table, where each distinct image is stored once keyed by
+        its hash. The movies table is rebuilt without the image column and
+        only references its image by hash.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the changes.
+        """
+
+        dbCursor.execute("CREATE TABLE images (hash TEXT PRIMARY KEY, data BLOB)")
+
+        dbCursor.execute("CREATE TABLE movies_new " + \
+                         "(id INTEGER PRIMARY KEY AUTOINCREMENT, cat INT, name TEXT, path TEXT," + \
+                         "imagehash TEXT, title TEXT, tmdb TEXT, year TEXT, rating INT, " + \
+                         "genres TEXT, overview TEXT, directors TEXT, actors TEXT, moddate INT);")
 
+        dbCursor.execute("INSERT INTO movies_new (id, cat, name, path, title, tmdb, year, " + \
+                         "rating, genres, overview, directors, actors, moddate) " + \
+                         "SELECT id, cat, name, path, title, tmdb, year, rating, genres, " + \
+                         "overview, directors, actors, moddate FROM movies")
+
+        imageCursor = self.__dbConn.cursor()
+        imageCursor.execute("SELECT id, image FROM movies WHERE image IS NOT NULL")
+
+        for row in imageCursor:
+            imageHash = self.GetImageHash(row['image'])
+            dbCursor.execute("INSERT OR IGNORE INTO images (hash, data) VALUES (?, ?)",
+                             [imageHash, row['image']])
+            dbCursor.execute("UPDATE movies_new SET imagehash = ? WHERE id = ?",
+                             [imageHash, row['id']])
+
+        imageCursor.close()
+
+        dbCursor.execute("DROP TABLE movies")
+        dbCursor.execute("ALTER TABLE movies_new RENAME TO movies")
+
+        dbCursor.execute("CREATE UNIQUE INDEX movies_cat_path ON movies (cat, path)")
+        dbCursor.execute("CREATE INDEX movies_tmdb ON movies (tmdb)")
+        dbCursor.execute("CREATE INDEX movies_imagehash ON movies (imagehash)")
+
+    def __CreateManifest(self, dbCursor):
+        """
+        Schema version 4: Creates the manifest table where the state of the
+        category directory trees on the HDD is kept between syncs.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the changes.
+        """
+
+        dbCursor.execute("CREATE TABLE manifest (cat INT, path TEXT, dirmtime REAL, " + \
+                         "ismovie INT, infomtime REAL, moddate INT, PRIMARY KEY (cat, path))")
+
+    def __CreateSearchIndex(self, dbCursor):
+        """
+        Schema version 5: Creates the full-text search index of the movies
+        (an FTS5 table using the movies table as its content) along with
+        the triggers keeping it up to date. Nothing is created if SQLite
+        doesn't support FTS5.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the changes.
+        """
+
+        columns = ", ".join(self.__searchColumns)
+        newValues = ", ".join(["new." + column for column in self.__searchColumns])
+        oldValues = ", ".join(["old." + column for column in self.__searchColumns])
+
+        try:
+            dbCursor.execute("CREATE VIRTUAL TABLE movies_search USING fts5(" + columns + \
+                             ", content = 'movies', content_rowid = 'id', " + \
+                             "tokenize = 'unicode61 remove_diacritics 1')")
+        except sqlite3.OperationalError, e:
+            self.__logger.warning("Unable to create the full-text search index: %s", e)
+            return
+
+        dbCursor.execute("CREATE TRIGGER movies_search_insert AFTER INSERT ON movies BEGIN " + \
+                         "INSERT INTO movies_search (rowid, " + columns + ") " + \
+                         "VALUES (new.id, " + newValues + "); END")
+        dbCursor.execute("CREATE TRIGGER movies_search_delete AFTER DELETE ON movies BEGIN " + \
+                         "INSERT INTO movies_search (movies_search, rowid, " + columns + ") " + \
+                         "VALUES ('delete', old.id, " + oldValues + "); END")
+        dbCursor.execute("CREATE TRIGGER movies_search_update AFTER UPDATE OF " + columns + \
+                         " ON movies BEGIN " + \
+                         "INSERT INTO movies_search (movies_search, rowid, " + columns + ") " + \
+                         "VALUES ('delete', old.id, " + oldValues + "); " + \
+                         "INSERT INTO movies_search (rowid, " + columns + ") " + \
+                         "VALUES (new.id, " + newValues + "); END")
+
+        dbCursor.execute("INSERT INTO movies_search (movies_search) VALUES ('rebuild')")
+
+    def __CreateThumbnailStore(self, dbCursor):
+        """
+        Schema version 6: Creates the thumbnails table where the thumbnail of
+        each stored image is kept, keyed by the hash of the image.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the changes.
+        """
+
+        dbCursor.execute("CREATE TABLE thumbnails (hash TEXT PRIMARY KEY, data BLOB)")
+
+    def GetImageHash(self, imageData):
+        """
+        Calculates the hash with which an image is stored in the DB.
+        ---
+        Params:
+            @ imageData (Bytes) - The image data.
+        ---
+        Return: (String) The hexadecimal SHA-1 digest of the image data.
+        """
+
+        return hashlib.sha1(imageData).hexdigest()
+
+    @Synchronized
     def GetCategoryList(self):
         """
         Gets the category list of the HDD and returns it.
@@ -120,6 +382,7 @@ class DatabaseProvider(Provider):
 
         return categoryList
 
+    @Synchronized
     def SaveCategoryList(self):
         """
         Saves category list of the associated hdd into the DB.
@@ -164,6 +427,10 @@ class DatabaseProvider(Provider):
             catid = result['id']
             dbCursor.execute("DELETE FROM categories WHERE id = ?", [catid])
             dbCursor.execute("DELETE FROM movies WHERE cat = ?", [catid])
+            dbCursor.execute("DELETE FROM manifest WHERE cat = ?", [catid])
+
+        if len(deleteList) > 0:
+            self.__DeleteUnusedImages(dbCursor)
 
         for cat in insertList:
             dbCursor.execute("INSERT INTO categories (name, path) " + \
@@ -171,21 +438,28 @@ class DatabaseProvider(Provider):
 
         self.__dbConn.commit()
 
+        CatalogueIndex.Get().SetDriveCategories(self.GetHdd().GetUuid(),
+                                                self.GetHdd().GetCategoryList())
+
         self.__logger.debug("Successfully wrote %d categories to the DB (%s)", 
                             len(updateList) + len(insertList),
                             self.GetHdd().GetLabel())
 
         return True
 
-    def GetCategoryMovieList(self, cat):
+    @Synchronized
+    def GetCategoryMovieList(self, cat, progress = None):
         """
         Loads all movies contained in the provided category and returns them
         in a list.
         ---
         Params:
             @ cat (Category) - The category whose movies we want to load.
+            @ progress (Function) - Called with each chunk of movies loaded.
+                                    Loading is cancelled if it returns False.
         ---
-        Return: (List of Movies) - Movies contained in the category.
+        Return: (List of Movies) - Movies contained in the category or None
+                 if loading failed or was cancelled.
         """
 
         self.__logger.debug("Loading movie list from category '%s'", cat.GetName())
@@ -195,49 +469,203 @@ class DatabaseProvider(Provider):
             return None
 
         movieList = []
+        reported = 0
 
         dbCursor = self.__dbConn.cursor()
 
-        dbCursor.execute("SELECT movies.name, movies.path FROM movies INNER JOIN categories " + \
-                         "ON categories.id = movies.cat WHERE categories.path = ?",
+        # Fetch all the info of the category's movies in a single query. Images
+        # are left out and only read when requested (see GetMovieImageData)
+        dbCursor.execute("SELECT " + self.__infoColumns + " FROM movies INNER JOIN " + \
+                         "categories ON categories.id = movies.cat WHERE categories.path = ?",
                          [cat.GetRelativePath()])
 
         for movieData in dbCursor:
             movie = Movie(cat, movieData['name'], movieData['path'])
-            self.LoadMovieInfo(movie)
+            movie.SetImageProvider(self)
+            movie.SetInfoFromRow(movieData)
+            movie.SetImageHash(movieData['imagehash'])
             movieList.append(movie)
+            reported = self.ReportProgress(progress, movieList, reported)
 
-        self.__logger.debug("Loaded %d movies from category '%s'", len(movieList), cat.GetName())
+            if reported is None:
+                break
+        else:
+            reported = self.ReportProgress(progress, movieList, reported, True)
 
         dbCursor.close()
 
+        if reported is None:
+            self.__logger.debug("Loading of category '%s' cancelled", cat.GetName())
+            return None
+
+        self.__logger.debug("Loaded %d movies from category '%s'", len(movieList), cat.GetName())
+
         return movieList
 
-    def GetMovieInfoDict(self, movie):
+    @Synchronized
+    def SearchCategoryMovies(self, cat, query):
+        """
+        Searches the movies of a category whose name, title, overview, genres,
+        actors or directors contain words starting with every word of the query.
+        ---
+        Params:
+            @ cat (Category) - The category whose movies we want to search.
+            @ query (String) - The words to look for.
+        ---
+        Return: (List of Strings) The relative paths of the movies found, the
+                 most relevant first, or None if searching isn't supported.
+        """
+
+        if not self.__hasSearchIndex:
+            return None
+
+        # Every word is quoted (so that FTS operators are taken literally)
+        # and matched as a prefix
+        tokens = self.__searchTokenPattern.findall(query)
+
+        if len(tokens) == 0:
+            return []
+
+        match = u" ".join([u'"%s"*' % token for token in tokens])
+
+        dbCursor = self.__dbConn.cursor()
+
+        try:
+            catid = self.__GetCategoryId(dbCursor, cat)
+
+            if catid is None:
+                return []
+
+            dbCursor.execute("SELECT movies.path FROM movies_search INNER JOIN movies " + \
+                             "ON movies.id = movies_search.rowid WHERE movies_search MATCH ? " + \
+                             "AND movies.cat = ? ORDER BY bm25(movies_search, " + \
+                             ", ".join([str(weight) for weight in self.__searchWeights]) + ")",
+                             [match, catid])
+
+            return [row[0] for row in dbCursor]
+        except sqlite3.Error, e:
+            self.__logger.exception("Error searching movies in the DB")
+            return None
+        finally:
+            dbCursor.close()
+
+    @Synchronized
+    def GetMovieInfoRow(self, movie):
         """
-        Gets the info of the provided movie and returns it in a dict.
+        Gets the info of the provided movie from the database.
         ---
         Params:
             @ movie (Movie) - The movie whose info we wish to load.
         ---
-        Return: (Dict) A dict containing movie info.
+        Return: (Row) The info of the movie in the order of Movie.infoFields
+                 followed by the digest of its image, or None if the movie
+                 isn't in the database.
         """
 
         self.__logger.debug("Getting movie '%s' info", movie.GetName()) 
 
         dbCursor = self.__dbConn.cursor()
 
-        dbCursor.execute("SELECT * FROM movies WHERE movies.path = ?", [movie.GetRelativePath()])
+        dbCursor.execute("SELECT " + self.__infoColumns + " FROM movies INNER JOIN " + \
+                         "categories ON categories.id = movies.cat WHERE categories.path = ? " + \
+                         "AND movies.path = ?",
+                         [movie.GetCategory().GetRelativePath(), movie.GetRelativePath()])
 
-        movieDict = dict()
         row = dbCursor.fetchone()
-        
-        for key in row.keys():
-            movieDict[key] = row[key]
 
         dbCursor.close()
 
-        return movieDict
+        if row is None:
+            self.__logger.debug("Movie isn't present in the DB")
+
+        return row
+
+    @Synchronized
+    def GetMovieImageData(self, movie):
+        """
+        Reads the cover image of the provided movie from the database.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose image we want.
+        ---
+        Return: (Bytes) The image data or None if the movie has no image.
+        """
+
+        dbCursor = self.__dbConn.cursor()
+
+        dbCursor.execute("SELECT images.data FROM movies INNER JOIN categories " + \
+                         "ON categories.id = movies.cat INNER JOIN images " + \
+                         "ON images.hash = movies.imagehash WHERE categories.path = ? " + \
+                         "AND movies.path = ?",
+                         [movie.GetCategory().GetRelativePath(), movie.GetRelativePath()])
+
+        row = dbCursor.fetchone()
+
+        dbCursor.close()
+
+        if row is None:
+            return None
+
+        return row['data']
+
+    @Synchronized
+    def GetMovieThumbnailData(self, movie):
+        """
+        Reads the thumbnail of the cover image of the provided movie from
+        the database.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail we want.
+        ---
+        Return: (Bytes) The thumbnail data or None if there is none.
+        """
+
+        imageHash = movie.GetImageHash()
+
+        if imageHash is None:
+            return None
+
+        dbCursor = self.__dbConn.cursor()
+        dbCursor.execute("SELECT data FROM thumbnails WHERE hash = ?", [imageHash])
+        row = dbCursor.fetchone()
+        dbCursor.close()
+
+        if row is None:
+            return None
+
+        return row['data']
+
+    @Synchronized
+    def SaveMovieThumbnailData(self, movie, thumbnailData):
+        """
+        Stores the thumbnail of the cover image of a movie, provided the
+        image itself is stored.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail to store.
+            @ thumbnailData (Bytes) - The thumbnail data.
+        ---
+        Return: (Boolean) True if the thumbnail was stored, False otherwise.
+        """
+
+        imageHash = movie.GetImageHash()
+
+        if imageHash is None:
+            return False
+
+        dbCursor = self.__dbConn.cursor()
+
+        try:
+            dbCursor.execute("INSERT OR REPLACE INTO thumbnails (hash, data) SELECT hash, ? " + \
+                             "FROM images WHERE hash = ?", [buffer(thumbnailData), imageHash])
+            self.__dbConn.commit()
+            return dbCursor.rowcount > 0
+        except sqlite3.Error, e:
+            self.__logger.exception("Error saving thumbnail to the DB")
+            self.__dbConn.rollback()
+            return False
+        finally:
+            dbCursor.close()
 
     def SaveMovieInfo(self, movie):
         """
@@ -251,50 +679,138 @@ class DatabaseProvider(Provider):
 
         self.__logger.debug("Saving movie '%s' info", movie.GetName()) 
 
+        return self.SaveMovieInfoBatch([movie])
+
+    @Synchronized
+    def SaveMovieInfoBatch(self, movieList, commit = True):
+        """
+        Saves several movies to the database in a single transaction.
+        The category id of each category is only looked up once and the
+        rows are written with one INSERT and one UPDATE statement per
+        category.
+        Movies read from this provider only have the fields that changed
+        since then updated. The image of a movie is only written if its
+        digest differs from the stored one and no identical image is
+        stored yet.
+        ---
+        Params:
+            @ movieList (List of Movies) - The movies to save.
+            @ commit (Boolean) - Whether to commit the transaction when done.
+                                 If False, the caller is responsible for
+                                 calling Commit.
+        ---
+        Return: (Boolean) True on success, false otherwise
+        """
+
+        if len(movieList) == 0:
+            return True
+
+        self.__logger.debug("Saving info of %d movies", len(movieList))
+
         dbCursor = self.__dbConn.cursor()
 
-        dbCursor.execute("SELECT id FROM categories WHERE path = ?",
-                         [movie.GetCategory().GetRelativePath()])
+        # The movies whose catalogue index entry must be updated
+        indexList = []
 
-        result = dbCursor.fetchone()
-        catid = result['id']
-        
-        dbCursor.execute("SELECT id FROM movies WHERE cat = ? " + \
-                         " AND path = ?", [catid, movie.GetRelativePath()])
+        try:
+            for cat, catMovieList in self.__GroupByCategory(movieList):
+                catid = self.__GetCategoryId(dbCursor, cat)
 
-        result = dbCursor.fetchone()
+                if catid is None:
+                    self.__logger.error("Category '%s' isn't present in the DB", cat.GetName())
+                    self.Rollback()
+                    return False
 
-        separator = u"||"
+                storedImageHashes = self.__GetStoredImageHashes(dbCursor, catid,
+                                                                [movie.GetRelativePath()
+                                                                 for movie in catMovieList])
 
-        movieDict = {'cat':catid, 'name':movie.GetName(), 'path':movie.GetRelativePath()}
+                insertList = []
+                updateList = []
+                updateInfoList = []
+                imageList = []
+                thumbnailList = []
+                fieldUpdateDict = dict()
 
-        infoDict = movie.GetInfoDict()
-        for key, value in infoDict.iteritems():
-            if isinstance(value, list):
-                infoDict[key] = separator.join(value)
-            elif isinstance(value, datetime):
-                infoDict[key] = time.mktime(value.timetuple())
+                for movie in catMovieList:
+                    infoRow = movie.GetInfoRow()
+                    moviePath = movie.GetRelativePath()
 
-        parameterDict = dict(infoDict)
-        parameterDict.update(movieDict)
+                    if moviePath in storedImageHashes and movie.GetImageProvider() is self:
+                        # Grouped by the fields that changed so that each group
+                        # is still written with a single statement
+                        columns = tuple(sorted(movie.GetDirtyFields() & self.__fieldColumns))
 
-        if result is None:
-            # If the movie we are saving isn't present in the DB, INSERT
-            dbCursor.execute("INSERT INTO movies (cat, name, path, image, title, " + \
-                             "tmdb, year, rating, genres, overview, directors, actors, " + \
-                             "moddate) VALUES (:cat, :name, :path, :image, :title, " + \
-                             ":tmdb, :year, :rating, :genres, :overview, :directors, " + \
-                             ":actors, :moddate)", parameterDict)
-        else:
-            # Else, if the movie is present in the DB, UPDATE
-            dbCursor.execute("UPDATE movies SET image = :image, title = :title, " + \
-                             "tmdb = :tmdb, year = :year, rating = :rating, " +  \
-                             "genres = :genres, overview = :overview, directors = :directors, " + \
-                             "actors = :actors, moddate = :moddate WHERE cat = :cat " +  \
-                             "AND path = :path", parameterDict)
+                        if len(columns) > 0:
+                            fieldUpdateDict.setdefault(columns, []).append(infoRow + \
+                                                                           (catid, moviePath))
 
-        self.__dbConn.commit()
-        dbCursor.close()
+                            if not self.__indexColumns.isdisjoint(columns):
+                                indexList.append(movie)
+
+                        continue
+
+                    indexList.append(movie)
+                    imageHash = movie.GetImageHash()
+
+                    if moviePath in storedImageHashes and \
+                       storedImageHashes[moviePath] == imageHash:
+                        updateInfoList.append(infoRow + (catid, moviePath))
+                        continue
+
+                    if imageHash is not None and not self.__IsImageStored(dbCursor, imageHash):
+                        imageData = movie.GetImageData()
+
+                        if imageData is not None:
+                            imageList.append((imageHash, buffer(imageData)))
+                            thumbnailData = movie.GetThumbnailData()
+
+                            if thumbnailData is not None:
+                                thumbnailList.append((imageHash, buffer(thumbnailData)))
+                        else:
+                            imageHash = None
+
+                    if moviePath not in storedImageHashes:
+                        insertList.append(infoRow + (imageHash, catid, movie.GetName(), moviePath))
+                        storedImageHashes[moviePath] = imageHash
+                    else:
+                        updateList.append(infoRow + (imageHash, catid, moviePath))
+
+                # Identical images are only stored once
+                dbCursor.executemany("INSERT OR IGNORE INTO images (hash, data) VALUES (?, ?)",
+                                     imageList)
+                dbCursor.executemany("INSERT OR IGNORE INTO thumbnails (hash, data) " + \
+                                     "VALUES (?, ?)", thumbnailList)
+
+                # Movies not present in the DB yet are INSERTed
+                dbCursor.executemany(self.__insertInfoImageCatNamePath, insertList)
+
+                # The ones already present are UPDATEd
+                dbCursor.executemany(self.__updateInfoImageWhereCatPath, updateList)
+
+                # Leaving their image untouched if it didn't change
+                dbCursor.executemany(self.__updateInfoWhereCatPath, updateInfoList)
+
+                # And only the fields that changed of the movies read from here
+                for columns, parameterList in fieldUpdateDict.iteritems():
+                    self.__UpdateFields(dbCursor, columns, parameterList)
+
+                if len(updateList) > 0:
+                    self.__DeleteUnusedImages(dbCursor)
+
+            self.__pendingIndexUpdates.append((CatalogueIndex.Get().UpdateMovies, indexList))
+
+            if commit:
+                self.__dbConn.commit()
+        except sqlite3.Error, e:
+            self.__logger.exception("Error saving movie info to the DB")
+            self.Rollback()
+            return False
+        finally:
+            dbCursor.close()
+
+        if commit:
+            self.__ApplyIndexUpdates()
 
         return True
 
@@ -316,23 +832,308 @@ class DatabaseProvider(Provider):
         self.__logger.debug("Deleting movie '%s' from database",
                             movie.GetName())
 
-        cat = movie.GetCategory()
+        return self.DeleteMovieInfoBatch([movie])
+
+    @Synchronized
+    def DeleteMovieInfoBatch(self, movieList, commit = True):
+        """
+        Deletes several movies from the database in a single transaction.
+        ---
+        Params:
+            @ movieList (List of Movies) - The movies whose info we wish to remove.
+            @ commit (Boolean) - Whether to commit the transaction when done.
+                                 If False, the caller is responsible for
+                                 calling Commit.
+        ---
+        Return: (Boolean) True on success, false otherwise
+        """
+
+        if len(movieList) == 0:
+            return True
+
+        self.__logger.debug("Deleting %d movies from database", len(movieList))
+
+        dbCursor = self.__dbConn.cursor()
+
+        try:
+            for cat, catMovieList in self.__GroupByCategory(movieList):
+                catid = self.__GetCategoryId(dbCursor, cat)
+
+                if catid is None:
+                    continue
+
+                dbCursor.executemany("DELETE FROM movies WHERE path = ? AND cat = ?", 
+                                     [(movie.GetRelativePath(), catid) for movie in catMovieList])
+
+            self.__DeleteUnusedImages(dbCursor)
+
+            self.__pendingIndexUpdates.append((CatalogueIndex.Get().RemoveMovies, movieList))
+
+            if commit:
+                self.__dbConn.commit()
+        except sqlite3.Error, e:
+            self.__logger.exception("Error deleting movie info from the DB")
+            self.Rollback()
+            return False
+        finally:
+            dbCursor.close()
+
+        if commit:
+            self.__ApplyIndexUpdates()
+
+        return True
+
+    @Synchronized
+    def GetCategoryManifest(self, cat):
+        """
+        Gets the manifest of the directory tree of a category, as saved on
+        the last sync with the HDD.
+        ---
+        Params:
+            @ cat (Category) - The category whose manifest we want.
+        ---
+        Return: (Dict) The relative path of each directory mapped to a
+                 (directory mtime, is movie directory, info file mtime,
+                 info modification date) tuple.
+        """
+
+        manifest = dict()
 
         dbCursor = self.__dbConn.cursor()
 
-        dbCursor.execute("SELECT id FROM categories WHERE path = ?", 
+        dbCursor.execute("SELECT manifest.* FROM manifest INNER JOIN categories " + \
+                         "ON categories.id = manifest.cat WHERE categories.path = ?",
                          [cat.GetRelativePath()])
-        result = dbCursor.fetchone()
-        catid = result['id']
 
-        dbCursor.execute("DELETE FROM movies WHERE path = ? AND cat = ?", 
-                         [movie.GetRelativePath(), catid])
+        for row in dbCursor:
+            manifest[row['path']] = (row['dirmtime'], bool(row['ismovie']),
+                                     row['infomtime'], row['moddate'])
 
-        self.__dbConn.commit()
         dbCursor.close()
 
+        return manifest
+
+    @Synchronized
+    def SaveCategoryManifest(self, cat, manifest, oldManifest = None, commit = True):
+        """
+        Saves the manifest of the directory tree of a category.
+        ---
+        Params:
+            @ cat (Category) - The category whose manifest we are saving.
+            @ manifest (Dict) - The manifest to save (see GetCategoryManifest).
+            @ oldManifest (Dict) - The manifest currently saved. If provided,
+                                   only the entries that changed are written.
+            @ commit (Boolean) - Whether to commit the transaction when done.
+                                 If False, the caller is responsible for
+                                 calling Commit.
+        ---
+        Return: (Boolean) True on success, false otherwise
+        """
+
+        dbCursor = self.__dbConn.cursor()
+
+        try:
+            catid = self.__GetCategoryId(dbCursor, cat)
+
+            if catid is None:
+                self.__logger.error("Category '%s' isn't present in the DB", cat.GetName())
+                return False
+
+            if oldManifest is None:
+                dbCursor.execute("DELETE FROM manifest WHERE cat = ?", [catid])
+                oldManifest = dict()
+
+            dbCursor.executemany("DELETE FROM manifest WHERE cat = ? AND path = ?",
+                                 [(catid, path) for path in oldManifest.iterkeys()
+                                                if path not in manifest])
+
+            dbCursor.executemany("INSERT OR REPLACE INTO manifest (cat, path, dirmtime, " + \
+                                 "ismovie, infomtime, moddate) VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(catid, path) + entry for path, entry in manifest.iteritems()
+                                                        if oldManifest.get(path) != entry])
+
+            if commit:
+                self.__dbConn.commit()
+        except sqlite3.Error, e:
+            self.__logger.exception("Error saving category manifest to the DB")
+            self.Rollback()
+            return False
+        finally:
+            dbCursor.close()
+
+        if commit:
+            self.__ApplyIndexUpdates()
+
         return True
 
+    @Synchronized
+    def Commit(self):
+        """
+        Commits the pending transaction, if any. Only needed after calling
+        one of the batch methods with commit = False.
+        ---
+        Return: (Boolean) True on success, false otherwise (in which case
+                 the transaction is rolled back).
+        """
+
+        try:
+            self.__dbConn.commit()
+        except sqlite3.Error, e:
+            self.__logger.exception("Error committing to the DB")
+            self.Rollback()
+            return False
+
+        self.__ApplyIndexUpdates()
+
+        return True
+
+    @Synchronized
+    def Rollback(self):
+        """
+        Discards the pending transaction, if any. Used when one of several
+        batch methods called with commit = False fails.
+        """
+
+        self.__dbConn.rollback()
+        self.__pendingIndexUpdates = []
+
+    def __ApplyIndexUpdates(self):
+        """
+        Applies to the catalogue index the changes of the batches whose
+        transaction was just committed, in the order they were made.
+        """
+
+        driveUuid = self.GetHdd().GetUuid()
+
+        for update, movieList in self.__pendingIndexUpdates:
+            update(driveUuid, movieList)
+
+        self.__pendingIndexUpdates = []
+
+    def __DeleteUnusedImages(self, dbCursor):
+        """
+        Deletes the images (and their thumbnails) no longer referenced by any movie.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the changes.
+        """
+
+        dbCursor.execute("DELETE FROM images WHERE hash NOT IN " + \
+                         "(SELECT imagehash FROM movies WHERE imagehash IS NOT NULL)")
+        dbCursor.execute("DELETE FROM thumbnails WHERE hash NOT IN (SELECT hash FROM images)")
+
+    def __GetStoredImageHashes(self, dbCursor, catid, pathList):
+        """
+        Looks up which of the provided movies of a category are already
+        stored, through the (cat, path) index, so that saving a few movies
+        doesn't read the whole category.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the query.
+            @ catid (Integer) - The id of the category of the movies.
+            @ pathList (List of Strings) - The relative paths of the movies.
+        ---
+        Return: (Dict) The path of each stored movie mapped to the hash of
+                 its image.
+        """
+
+        storedImageHashes = dict()
+        pathList = list(set(pathList))
+
+        for start in xrange(0, len(pathList), self.__pathChunkSize):
+            pathChunk = pathList[start:start + self.__pathChunkSize]
+            dbCursor.execute("SELECT path, imagehash FROM movies WHERE cat = ? AND path IN (" + \
+                             ", ".join(["?"] * len(pathChunk)) + ")", [catid] + pathChunk)
+
+            for row in dbCursor:
+                storedImageHashes[row['path']] = row['imagehash']
+
+        return storedImageHashes
+
+    def __IsImageStored(self, dbCursor, imageHash):
+        """
+        Checks if an image is already present in the images table.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the query.
+            @ imageHash (String) - The hash of the image.
+        ---
+        Return: (Boolean) True if the image is stored, False otherwise.
+        """
+
+        dbCursor.execute("SELECT 1 FROM images WHERE hash = ?", [imageHash])
+
+        return dbCursor.fetchone() is not None
+
+    def __GroupByCategory(self, movieList):
+        """
+        Splits a list of movies according to their category.
+        ---
+        Params:
+            @ movieList (List of Movies) - The movies to split.
+        ---
+        Return: (List of Tuples) (category, movies of that category) pairs.
+        """
+
+        groupList = []
+        groupDict = dict()
+
+        for movie in movieList:
+            cat = movie.GetCategory()
+            catPath = cat.GetRelativePath()
+
+            if catPath not in groupDict:
+                groupDict[catPath] = []
+                groupList.append((cat, groupDict[catPath]))
+
+            groupDict[catPath].append(movie)
+
+        return groupList
+
+    def __GetCategoryId(self, dbCursor, cat):
+        """
+        Gets the DB id of the provided category.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the query.
+            @ cat (Category) - The category whose id we want.
+        ---
+        Return: (Integer) The id of the category or None if it isn't in the DB.
+        """
+
+        dbCursor.execute("SELECT id FROM categories WHERE path = ?",
+                         [cat.GetRelativePath()])
+
+        result = dbCursor.fetchone()
+
+        if result is None:
+            return None
+
+        return result['id']
+
+    def __UpdateFields(self, dbCursor, columns, parameterList):
+        """
+        Updates some of the info fields of several movies, along with their
+        modification date.
+        ---
+        Params:
+            @ dbCursor (Cursor) - The cursor with which to perform the changes.
+            @ columns (Tuple of Strings) - The info fields to update.
+            @ parameterList (List of Tuples) - The info row of each movie
+                                               followed by its category id
+                                               and path.
+        """
+
+        indexList = [Movie.infoFields.index(column) for column in columns + ("moddate",)]
+        fieldCount = len(Movie.infoFields)
+
+        dbCursor.executemany("UPDATE movies SET " + \
+                             ", ".join([column + " = ?" for column in columns]) + \
+                             ", moddate = ? WHERE cat = ? AND path = ?",
+                             (tuple([parameters[index] for index in indexList]) + \
+                              parameters[fieldCount:] for parameters in parameterList))
+
+    @Synchronized
     def CleanAllInfo(self):
         """
         Deletes all info stored on the database.
@@ -343,10 +1144,15 @@ class DatabaseProvider(Provider):
         self.__logger.debug("Deleting all mhdd organizer info from database")
 
         dbCursor = self.__dbConn.cursor()
-        dbCursor.execute("DELETE * FROM categories")
-        dbCursor.execute("DELETE * FROM movies")
+        dbCursor.execute("DELETE FROM categories")
+        dbCursor.execute("DELETE FROM movies")
+        dbCursor.execute("DELETE FROM images")
+        dbCursor.execute("DELETE FROM thumbnails")
+        dbCursor.execute("DELETE FROM manifest")
 
         self.__dbConn.commit()
         dbCursor.close()
 
+        CatalogueIndex.Get().SetDriveCategories(self.GetHdd().GetUuid(), [])
+
         return True
@@ -23,15 +23,38 @@ Copyright (C) 2010 Revolt
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os, ConfigParser, logging, time, codecs, sys, shutil
+import os, ConfigParser, logging, time, codecs, sys, shutil, hashlib
+from itertools import izip
 from datetime import datetime
 from classes.Provider import *
 from classes.Category import *
 from classes.Movie import *
+from classes.FileWriteQueue import *
+from classes.hddproviders.InfoFile import *
+
+# scandir gets the type of each directory entry without an extra stat call.
+# It is part of the os module since python 3.5 and is available as a
+# separate module for older versions.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 class FileProvider(Provider):
     """ The FileProvider class """
 
+    movieExtensions = frozenset(["avi", "mpeg", "mpg", "mkv", "m4v", "mp4",
+                                 "wmv", "mov", "qt", "rm", "3gp", "ogm"])
+    infoFolderName = ".mhddorganizer"
+
+    # The keys of info.ini for movies with a cover image
+    __imageInfoFields = Movie.infoFields + ("imagehash",)
+    __ratingIndex = Movie.infoFields.index("rating")
+    __modDateIndex = Movie.infoFields.index("moddate")
+
     def __init__(self, hdd):
         """
         Initializes a new FileProvider instance.
@@ -42,6 +65,7 @@ class FileProvider(Provider):
 
         super(FileProvider, self).__init__(hdd)
         self.__logger = logging.getLogger("mhdd.providers.file")
+        self.__writeQueue = FileWriteQueue()
 
     # -- Methods --
     def GetCategoryList(self):
@@ -141,15 +165,18 @@ class FileProvider(Provider):
 
         return True
 
-    def GetCategoryMovieList(self, cat):
+    def GetCategoryMovieList(self, cat, progress = None):
         """
         Loads all movies contained in the provided category and returns a list
         with them.
         ---
         Params:
             @ cat (Category) - The category whose movies we want.
+            @ progress (Function) - Called with each chunk of movies loaded.
+                                    Loading is cancelled if it returns False.
         ---
-        Return: (List of Movies) The movies contained in the category.
+        Return: (List of Movies) The movies contained in the category or None
+                 if loading failed or was cancelled.
         """
 
         self.__logger.debug("Loading movie list from category '%s'", cat.GetName())
@@ -159,40 +186,228 @@ class FileProvider(Provider):
             return None
 
         movieList = []
-        movieExtensions = ["avi", "mpeg", "mpg", "mkv", "m4v", "mp4",
-                           "wmv", "mov", "qt", "rm", "3gp", "ogm"]
+        reported = 0
 
-        catFullPath = cat.GetFullPath()
-        items = os.listdir(catFullPath)
+        for movieDirRelPath in self.WalkMovieDirs(cat.GetFullPath()):
+            movieList.append(self.GetMovie(cat, movieDirRelPath))
+            reported = self.ReportProgress(progress, movieList, reported)
 
-        for root, dirs, files in os.walk(catFullPath):
-            self.__logger.debug("Reading directory: %s", root)
+            if reported is None:
+                self.__logger.debug("Loading of category '%s' cancelled", cat.GetName())
+                return None
 
-            for f in files:
-                name, extension = os.path.splitext(f)
-                extension = extension[1:].lower()
-                if extension in movieExtensions:
-                    self.__logger.debug("Found a movie in the directory: %s", f)
-                    movieDirRelPath = os.path.relpath(root, catFullPath)
-                    movieName = movieDirRelPath.replace("/", " ")
-                    movieName = movieName.replace("\\", " ")
-                    movie = Movie(cat, movieName, movieDirRelPath)
-                    self.LoadMovieInfo(movie)
-                    movieList.append(movie)
-                    break
+        if self.ReportProgress(progress, movieList, reported, True) is None:
+            self.__logger.debug("Loading of category '%s' cancelled", cat.GetName())
+            return None
 
         self.__logger.debug("Loaded %d movies from category '%s'", len(movieList), cat.GetName())
 
         return movieList
 
-    def GetMovieInfoDict(self, movie):
+    def GetMovie(self, cat, movieDirRelPath):
+        """
+        Creates the movie contained in the provided directory and loads its
+        info from the HDD.
+        ---
+        Params:
+            @ cat (Category) - The category of the movie.
+            @ movieDirRelPath (String) - The path of the movie directory
+                                         relative to the category path.
+        ---
+        Return: (Movie) The movie contained in the directory.
+        """
+
+        self.__logger.debug("Found a movie in the directory: %s", movieDirRelPath)
+
+        movieName = movieDirRelPath.replace("/", " ")
+        movieName = movieName.replace("\\", " ")
+        movie = Movie(cat, movieName, movieDirRelPath)
+        self.LoadMovieInfo(movie)
+
+        return movie
+
+    def WalkMovieDirs(self, rootPath, manifest = None, newManifest = None, failedDirs = None):
+        """
+        Walks the directory tree under the provided root looking for movie
+        directories (directories directly containing a movie file).
+        Metadata folders aren't descended into and neither are movie
+        directories, since a movie directory can't contain other movies.
+
+        If a manifest of a previous walk is provided, directories whose
+        modification time didn't change since then aren't listed again:
+        whether they are movie directories and which subdirectories they
+        have is taken from the manifest instead.
+
+        Directories that can't be read are skipped. Their entries (and those
+        of the directories under them) are carried over from the previous
+        manifest and their parent is marked as changed, so that they are
+        walked again on the next walk.
+        ---
+        Params:
+            @ rootPath (String) - The full path of the directory tree root.
+            @ manifest (Dict) - The manifest of a previous walk.
+            @ newManifest (Dict) - If provided, it is filled with the manifest
+                                   of this walk. Each directory relative path
+                                   is mapped to a (directory mtime, is movie
+                                   directory, info file mtime, None) tuple.
+                                   The last element is left for the caller.
+            @ failedDirs (List) - If provided, the relative paths of the
+                                  directories that couldn't be read are
+                                  appended to it.
+        ---
+        Return: (Generator of Strings) The paths of the movie directories
+                 relative to the root.
+        """
+
+        pendingDirs = [os.curdir]
+        manifestSubDirDict = dict()
+
+        if manifest is not None:
+            for dirRelPath in manifest.iterkeys():
+                if dirRelPath != os.curdir:
+                    parentRelPath = os.path.dirname(dirRelPath) or os.curdir
+                    subDirName = os.path.basename(dirRelPath)
+                    manifestSubDirDict.setdefault(parentRelPath, []).append(subDirName)
+
+        while pendingDirs:
+            dirRelPath = pendingDirs.pop()
+            dirFullPath = os.path.join(rootPath, dirRelPath)
+
+            try:
+                if newManifest is None:
+                    dirMTime = None
+                else:
+                    dirMTime = os.stat(dirFullPath).st_mtime
+
+                entry = None
+
+                if manifest is not None:
+                    entry = manifest.get(dirRelPath)
+
+                if entry is not None and entry[0] == dirMTime:
+                    isMovieDir = entry[1]
+                    subDirList = manifestSubDirDict.get(dirRelPath, [])
+                else:
+                    self.__logger.debug("Reading directory: %s", dirRelPath)
+                    isMovieDir, subDirList = self.__ScanDir(dirFullPath)
+            except OSError, e:
+                self.__logger.exception("Error reading directory '%s'", dirRelPath)
+
+                if failedDirs is not None:
+                    failedDirs.append(dirRelPath)
+
+                if newManifest is not None:
+                    self.__KeepManifestSubtree(dirRelPath, manifest, newManifest)
+
+                continue
+
+            if newManifest is not None:
+                infoMTime = None
+
+                if isMovieDir:
+                    infoFilePath = os.path.join(dirFullPath, self.infoFolderName, "info.ini")
+
+                    try:
+                        infoMTime = os.stat(infoFilePath).st_mtime
+                    except OSError, e:
+                        pass
+
+                newManifest[dirRelPath] = (dirMTime, isMovieDir, infoMTime, None)
+
+            if isMovieDir:
+                yield dirRelPath
+                continue
+
+            # Reversed so that directories are walked in the order they were listed
+            for subDirName in reversed(subDirList):
+                if dirRelPath == os.curdir:
+                    pendingDirs.append(subDirName)
+                else:
+                    pendingDirs.append(os.path.join(dirRelPath, subDirName))
+
+    def __KeepManifestSubtree(self, dirRelPath, manifest, newManifest):
+        """
+        Carries the manifest entries of a directory that couldn't be read,
+        and of the directories under it, over to the new manifest. Its
+        parent is given no modification time so that it's listed again on
+        the next walk.
+        ---
+        Params:
+            @ dirRelPath (String) - The relative path of the directory.
+            @ manifest (Dict) - The manifest of the previous walk or None.
+            @ newManifest (Dict) - The manifest of the current walk.
+        """
+
+        if manifest is not None:
+            prefix = dirRelPath + os.sep
+
+            for entryRelPath, entry in manifest.iteritems():
+                if dirRelPath == os.curdir or entryRelPath == dirRelPath or \
+                   entryRelPath.startswith(prefix):
+                    newManifest.setdefault(entryRelPath, entry)
+
+        if dirRelPath != os.curdir:
+            parentRelPath = os.path.dirname(dirRelPath) or os.curdir
+            parentEntry = newManifest.get(parentRelPath)
+
+            if parentEntry is not None:
+                newManifest[parentRelPath] = (None,) + parentEntry[1:]
+
+    def __ScanDir(self, dirPath):
+        """
+        Lists a single directory, checking if it contains a movie file.
+        ---
+        Params:
+            @ dirPath (String) - The full path of the directory.
+        ---
+        Return: (Boolean, List of Strings) Whether the directory contains a
+                 movie file and, if it doesn't, the names of the subdirectories
+                 worth descending into.
+        """
+
+        subDirList = []
+
+        if scandir is not None:
+            for entry in scandir(dirPath):
+                if entry.is_dir(follow_symlinks = False):
+                    if entry.name != self.infoFolderName:
+                        subDirList.append(entry.name)
+                elif self.__IsMovieFile(entry.name):
+                    return True, []
+        else:
+            for name in os.listdir(dirPath):
+                if os.path.isdir(os.path.join(dirPath, name)):
+                    if name != self.infoFolderName and \
+                       not os.path.islink(os.path.join(dirPath, name)):
+                        subDirList.append(name)
+                elif self.__IsMovieFile(name):
+                    return True, []
+
+        return False, subDirList
+
+    def __IsMovieFile(self, fileName):
         """
-        Gets the info of the provided movie and returns it in a dict.
+        Checks if a file is a movie according to its extension.
+        ---
+        Params:
+            @ fileName (String) - The name of the file.
+        ---
+        Return: (Boolean) True if the file is a movie, False otherwise.
+        """
+
+        extension = os.path.splitext(fileName)[1][1:].lower()
+
+        return extension in self.movieExtensions
+
+    def GetMovieInfoRow(self, movie):
+        """
+        Reads the info of the provided movie from its info file.
         ---
         Params:
             @ movie (Movie) - The movie whose info we wish to load.
         ---
-        Return: (Dict) A dict containing movie info.
+        Return: (List) The info of the movie in the order of Movie.infoFields
+                 followed by the digest of its image, or None on error.
         """
 
         self.__logger.debug("Loading movie '%s' info", movie.GetName()) 
@@ -201,127 +416,163 @@ class FileProvider(Provider):
 
         infoFolderPath = os.path.join(moviePath, ".mhddorganizer")
         infoFilePath = os.path.join(infoFolderPath, "info.ini")
+        pendingData = self.__writeQueue.GetPendingData(infoFilePath)
 
-        if not os.path.exists(infoFilePath):
+        if pendingData is not None:
+            infoRow = InfoFile.Parse(pendingData.decode("utf-8"),
+                                     fields = self.__imageInfoFields)
+        elif not os.path.exists(infoFilePath):
             self.__logger.debug("Movie doesn't have info in the HDD")
-            return dict()
+            return [None] * len(self.__imageInfoFields)
+        else:
+            try:
+                infoRow = InfoFile.Read(infoFilePath, fields = self.__imageInfoFields)
+            except IOError, e:
+                self.__logger.exception("Error reading info file")
+                return None
 
-        infoFile = None
-        infoDict = dict()
+        if infoRow is None:
+            self.__logger.error("Didn't find info section in info file")
+            return None
 
-        try:
-            infoFile = codecs.open(infoFilePath, "r", "utf-8")
-            movieInfoParser = ConfigParser.ConfigParser()
-            movieInfoParser.readfp(infoFile)
+        # Converted to the types used by info rows, following the rules of
+        # Movie.SetRating and Movie.SetModificationDate
+        if infoRow[self.__ratingIndex] is not None:
+            try:
+                rating = int(float(infoRow[self.__ratingIndex]))
+            except ValueError, e:
+                rating = 0
 
-            infoEntries = movieInfoParser.items("info")
-            separator = u"||"
+            if rating < 1 or rating > 10:
+                rating = None
 
-            for entry in infoEntries:
-                name, value = entry
-                infoDict[name] = value
+            infoRow[self.__ratingIndex] = rating
 
-        except IOError, e:
-            self.__logger.exception("Error reading info file")
-            return None
-        except ConfigParser.NoSectionError, e:
-            self.__logger.exception("Didn't find info section in info file")
-            return None
-        finally:
-            if infoFile is not None:
-                infoFile.close()
+        if infoRow[self.__modDateIndex] is not None:
+            try:
+                infoRow[self.__modDateIndex] = float(infoRow[self.__modDateIndex])
+            except ValueError, e:
+                infoRow[self.__modDateIndex] = 0.0
+
+        return infoRow
 
-        imageFilePath = os.path.join(infoFolderPath, "cover.jpg")
+    def GetMovieImageData(self, movie):
+        """
+        Reads the cover image of the provided movie from the HDD.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose image we want.
+        ---
+        Return: (Bytes) The image data or None if the movie has no image.
+        """
 
-        if os.path.exists(imageFilePath):
-            imageFile = None
+        imageFilePath = os.path.join(movie.GetFullPath(), ".mhddorganizer", "cover.jpg")
+        pendingData = self.__writeQueue.GetPendingData(imageFilePath)
 
-            try:
-                imageFile = open(imageFilePath, "rb")
-                imageData = imageFile.read()
-                infoDict['image'] = imageData
-            except IOError, e:
-                self.__logger.exception("Error reading cover image")
+        if pendingData is not None:
+            return pendingData
 
-        return infoDict
+        if not os.path.exists(imageFilePath):
+            return None
+
+        imageFile = None
+
+        try:
+            imageFile = open(imageFilePath, "rb")
+            return imageFile.read()
+        except IOError, e:
+            self.__logger.exception("Error reading cover image")
+            return None
+        finally:
+            if imageFile is not None:
+                imageFile.close()
 
     def SaveMovieInfo(self, movie):
         """
-        Saves a single movie to the HDD.
+        Queues a single movie to be saved to the HDD. The files are written
+        in the background, call Flush to wait for them.
+        The cover image is only written if its digest differs from the one
+        of the image already on the HDD.
         ---
         Params:
             @ movie (Movie) - The movie to save.
         """
 
+        imageFromHdd = movie.GetImageProvider() is self
+
+        if imageFromHdd and not movie.IsDirty():
+            # Nothing changed since the movie was read from the HDD
+            return True
+
         self.__logger.debug("Saving movie '%s' info", movie.GetName()) 
 
-        moviePath = movie.GetFullPath()
+        infoFolderPath = os.path.join(movie.GetFullPath(), ".mhddorganizer")
 
-        infoFolderPath = os.path.join(moviePath, ".mhddorganizer")
-        infoFilePath = os.path.join(infoFolderPath, "info.ini")
+        infoKeys = Movie.infoFields
+        infoRow = movie.GetInfoRow()
+        imageHash = movie.GetImageHash()
 
-        if not os.path.isdir(infoFolderPath):
-            try:
-                os.mkdir(infoFolderPath)
-            except OSError, e:
-                self.__logger.exception("Error creating movie data folder")
-                return False
+        if imageHash is not None:
+            infoKeys = self.__imageInfoFields
+            infoRow += (imageHash,)
 
-        infoFile = None
+            if not imageFromHdd and imageHash != self.__GetStoredImageHash(movie):
+                imageData = movie.GetImageData()
 
-        try:
-            infoFile = open(infoFilePath, "w")
-        except IOError, e:
-            self.__logger.exception("Error opening info file for writing")
-            return False
+                if imageData is not None:
+                    self.__writeQueue.Write(os.path.join(infoFolderPath, "cover.jpg"),
+                                            str(imageData))
 
-        movieInfoParser = ConfigParser.ConfigParser()
-        infoSection = "info"
+        # Written in text mode to keep the line endings ConfigParser used
+        self.__writeQueue.Write(os.path.join(infoFolderPath, "info.ini"),
+                                InfoFile.Format(izip(infoKeys, infoRow)), False)
 
-        if not movieInfoParser.has_section(infoSection):
-            movieInfoParser.add_section(infoSection)
+        return True
 
-        separator = u"||"
+    def __GetStoredImageHash(self, movie):
+        """
+        Gets the digest of the cover image of a movie currently on the HDD.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose image digest we want.
+        ---
+        Return: (String) The digest or None if the movie has no cover image.
+        """
 
-        infoDict = movie.GetInfoDict()
-        imageData = infoDict['image']
-        del infoDict['image']
+        imageFilePath = os.path.join(movie.GetFullPath(), ".mhddorganizer", "cover.jpg")
 
-        for key, value in infoDict.iteritems():
-            if isinstance(value, unicode):
-                value = value.encode("utf-8")
-            elif isinstance(value, list):
-                value = separator.join(value).encode("utf-8")
-            elif isinstance(value, datetime):
-                value = time.mktime(value.timetuple())
+        if self.__writeQueue.GetPendingData(imageFilePath) is None and \
+           not os.path.exists(imageFilePath):
+            return None
 
-            movieInfoParser.set(infoSection, key, value)
+        infoRow = self.GetMovieInfoRow(movie)
 
-        movieInfoParser.write(infoFile)
+        if infoRow is not None and infoRow[-1] is not None:
+            return infoRow[-1]
 
-        infoFile.close()
+        # Info files written by older versions don't have the digest
+        imageData = self.GetMovieImageData(movie)
 
-        imageData = movie.GetImageData()
+        if imageData is None:
+            return None
 
-        if imageData is not None:
-            imageFilePath = os.path.join(infoFolderPath, "cover.jpg")
-            imageFile = None
+        return hashlib.sha1(imageData).hexdigest()
 
-            try:
-                imageFile = open(imageFilePath, "wb")
-                imageFile.write(imageData)
-            except IOError, e:
-                self.__logger.exception("Error writing cover image")
-                return False
-            finally:
-                if imageFile is not None:
-                    imageFile.close()
+    def Flush(self):
+        """
+        Waits until all queued movie saves are written to the HDD.
+        ---
+        Return: (Boolean) True if all of them were written, False otherwise.
+        """
 
-        return True
+        return self.__writeQueue.Flush()
 
     def CleanAllInfo(self):
         self.__logger.debug("Cleaning all mhdd organizer info")
 
+        # Pending saves would recreate the folders we are about to remove
+        self.Flush()
+
         hdd = self.GetHdd()
         success = True
 
@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+
+"""
+File: InfoFile.py
+Author: Revolt
+--------------------------
+Desc:
+    This file contains the definition and implementation of the reader
+    and writer of the info.ini files kept in each movie's info folder.
+    It handles a single section and produces the same bytes as
+    ConfigParser, so files written by older versions keep working.
+--------------------------
+Copyright (C) 2010 Revolt
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+class InfoFile(object):
+    """ The InfoFile class """
+
+    # The characters ConfigParser treats as whitespace. It works on the
+    # encoded bytes, so other unicode spaces (like \x85 or \u2028) are
+    # part of the values.
+    whitespace = u" \t\n\r\x0b\x0c"
+
+    # -- Methods --
+    @staticmethod
+    def Parse(text, section = u"info", fields = None):
+        """
+        Parses the entries of a section from the text of an ini file
+        following the same rules as ConfigParser (case insensitive keys,
+        '#' and ';' comments, indented continuation lines).
+        ---
+        Params:
+            @ text (String) - The unicode text of the file.
+            @ section (String) - The name of the section to read.
+            @ fields (Tuple of Strings) - If provided, the entries are
+                                          returned as a row in the order of
+                                          these keys instead of a dict.
+                                          Other keys are ignored and missing
+                                          ones are None.
+        ---
+        Return: (Dict or List) The entries of the section or None if the
+                file doesn't have that section.
+        """
+
+        whitespace = InfoFile.whitespace
+        entries = None
+        inSection = False
+        key = None
+
+        # Where each entry is stored: its key in a dict or its index in a row
+        if fields is not None:
+            fieldIndex = dict([(field, index) for index, field in enumerate(fields)])
+
+        # Only split on "\n" like file.readline does, unlike splitlines
+        for line in text.split(u"\n"):
+            if line[-1:] == u"\r":
+                line = line[:-1]
+
+            if not line:
+                continue
+
+            first = line[0]
+
+            if first == u"#" or first == u";":
+                continue
+
+            if first in whitespace:
+                # Continuation of the previous value
+                value = line.strip(whitespace)
+
+                if inSection and key is not None and value:
+                    entries[key] = u"%s\n%s" % (entries[key], value)
+
+                continue
+
+            if first == u"[":
+                end = line.find(u"]", 1)
+
+                if end > 1:
+                    inSection = line[1:end] == section
+                    key = None
+
+                    if inSection and entries is None:
+                        if fields is None:
+                            entries = dict()
+                        else:
+                            entries = [None] * len(fields)
+
+                continue
+
+            if not inSection or (line[:3].lower() == u"rem" and
+                                 (len(line) == 3 or line[3] in whitespace)):
+                continue
+
+            equalPos = line.find(u"=")
+            colonPos = line.find(u":")
+
+            if equalPos == -1 or (colonPos != -1 and colonPos < equalPos):
+                equalPos = colonPos
+
+            if equalPos <= 0:
+                continue
+
+            key = line[:equalPos].rstrip(whitespace).lower()
+
+            if fields is not None:
+                key = fieldIndex.get(key)
+
+                if key is None:
+                    continue
+
+            value = line[equalPos + 1:].lstrip(whitespace)
+
+            commentPos = value.find(u";")
+
+            if commentPos != -1 and value[commentPos - 1] in whitespace:
+                value = value[:commentPos]
+
+            value = value.strip(whitespace)
+
+            if value == u'""':
+                value = u""
+
+            entries[key] = value
+
+        return entries
+
+    @staticmethod
+    def Read(path, section = u"info", fields = None):
+        """
+        Reads the entries of a section from an ini file.
+        ---
+        Params:
+            @ path (String) - The path of the file.
+            @ section (String) - The name of the section to read.
+            @ fields (Tuple of Strings) - See Parse.
+        ---
+        Return: (Dict or List) The entries of the section or None if the
+                file doesn't have that section.
+        ---
+        Raises: IOError if the file can't be read.
+        """
+
+        infoFile = open(path, "rb")
+
+        try:
+            data = infoFile.read()
+        finally:
+            infoFile.close()
+
+        return InfoFile.Parse(data.decode("utf-8-sig", "replace"), section, fields)
+
+    @staticmethod
+    def Format(items, section = "info"):
+        """
+        Formats a section of an ini file exactly like ConfigParser writes it.
+        ---
+        Params:
+            @ items (Iterable) - The (key, value) pairs of the section.
+                                 Unicode values are encoded as utf-8, other
+                                 values are converted with str().
+            @ section (String) - The name of the section.
+        ---
+        Return: (Bytes) The formatted section.
+        """
+
+        lines = ["[%s]\n" % section]
+
+        for key, value in items:
+            if isinstance(value, unicode):
+                value = value.encode("utf-8")
+            else:
+                value = str(value)
+
+            lines.append("%s = %s\n" % (key, value.replace("\n", "\n\t")))
+
+        lines.append("\n")
+
+        return "".join(lines)
@@ -18,7 +18,25 @@ config['urls']['movie.getInfo'] = "http://api.themoviedb.org/2.1/Movie.getInfo/e
 config['urls']['media.getInfo'] = "http://api.themoviedb.org/2.1/Media.getInfo/en/xml/%(apikey)s/%%s/%%s" % (config)
 config['urls']['imdb.lookUp'] = "http://api.themoviedb.org/2.1/Movie.imdbLookup/en/xml/%(apikey)s/%%s" % (config)
 
-import os,struct,urllib,urllib2,xml.etree.cElementTree as ElementTree
+# Responses are only cached once a ResponseCache is set here
+config['cache'] = None
+# How long (in seconds) the cached responses of each endpoint are used before
+# asking the server again
+config['ttls'] = {}
+config['ttls']['movie.search'] = 24 * 3600
+config['ttls']['movie.getInfo'] = 7 * 24 * 3600
+config['ttls']['media.getInfo'] = 30 * 24 * 3600
+config['ttls']['imdb.lookUp'] = 30 * 24 * 3600
+# When offline, cached responses are used however old they are and nothing
+# is requested from the server
+config['offline'] = False
+# The connections to each host kept open between requests (see ConnectionPool)
+config['connections'] = 4
+# If set, its Wait() method is called before each request sent to the API,
+# so that responses answered from the cache aren't throttled
+config['limiter'] = None
+
+import os,struct,time,threading,socket,sqlite3,httplib,urlparse,urllib,urllib2,cStringIO,xml.etree.cElementTree as ElementTree
 
 class TmdBaseError(Exception):
     pass
@@ -62,27 +80,267 @@ def opensubtitleHashFile(name):
     f.close()
     return  "%016x" % fhash
 
+class ResponseCache:
+    """Stores the responses of the API in a SQLite database, along with their
+    validators (ETag and Last-Modified) so that expired responses can be
+    revalidated instead of downloaded again.
+    The least recently used responses are dropped once there are more than
+    max_entries of them. Safe to use from several threads.
+    """
+    def __init__(self, path, max_entries = 20000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, "
+                           "data BLOB, fetched REAL, used REAL, etag TEXT, modified TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, url):
+        """Returns a (data, fetched, etag, modified) tuple for the cached
+        response of url, fetched being when it was last checked with the
+        server, or None if url isn't cached.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT data, fetched, etag, modified FROM responses "
+                                     "WHERE url = ?", [url]).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET used = ? WHERE url = ?", [time.time(), url])
+            self._conn.commit()
+        return (str(row[0]), row[1], row[2], row[3])
+
+    def set(self, url, data, etag = None, modified = None):
+        """Stores the response of url, evicting the least recently used
+        responses if the cache is full."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute("UPDATE responses SET data = ?, fetched = ?, used = ?, "
+                                        "etag = ?, modified = ? WHERE url = ?",
+                                        [buffer(data), now, now, etag, modified, url])
+            if cursor.rowcount == 0:
+                self._conn.execute("INSERT INTO responses (url, data, fetched, used, etag, modified) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)",
+                                   [url, buffer(data), now, now, etag, modified])
+                self._count += 1
+            if self._count > self.max_entries:
+                # Evicts a tenth of the cache at once so that it isn't done on every set
+                evicted = self._count - self.max_entries + self.max_entries / 10
+                self._conn.execute("DELETE FROM responses WHERE url IN (SELECT url FROM "
+                                   "responses ORDER BY used LIMIT ?)", [evicted])
+                self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            self._conn.commit()
+
+    def touch(self, url):
+        """Marks the cached response of url as checked with the server now"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE responses SET fetched = ?, used = ? WHERE url = ?",
+                               [now, now, url])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._count = 0
+
+class ConnectionPool:
+    """Keeps HTTP/1.1 connections open between requests so that requests to
+    the same host don't pay for a new connection (and TCP handshake) each.
+    Connections are taken by one thread at a time, so the pool can be shared
+    by several threads; up to max_idle connections per host are kept open.
+    """
+    max_redirects = 5
+
+    def __init__(self, max_idle = 4, timeout = 30):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _getConnection(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return (idle.pop(), True)
+        scheme, host = key
+        if scheme == "https":
+            return (httplib.HTTPSConnection(host, timeout = self.timeout), False)
+        return (httplib.HTTPConnection(host, timeout = self.timeout), False)
+
+    def _putConnection(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _request(self, url, headers):
+        scheme, host, path, query, fragment = urlparse.urlsplit(url)
+        if scheme not in ("http", "https"):
+            raise TmdHttpError("Unsupported URL: %s" % url)
+        key = (scheme, host)
+        if query:
+            path += "?" + query
+        while True:
+            conn, reused = self._getConnection(key)
+            try:
+                conn.request("GET", path or "/", headers = headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error), errormsg:
+                conn.close()
+                # The server may have closed an idle connection, which is only
+                # noticed when using it again
+                if reused:
+                    continue
+                raise TmdHttpError(errormsg)
+            if response.will_close:
+                conn.close()
+            else:
+                self._putConnection(key, conn)
+            return (response, data)
+
+    def fetch(self, url, headers = None):
+        """Requests url, following redirects, and returns a (status, headers,
+        data) tuple with the response. Raises TmdHttpError if the server
+        can't be reached.
+        """
+        headers = dict(headers or {})
+        headers.setdefault("User-Agent", "Python-urllib/%s" % urllib2.__version__)
+        for i in range(self.max_redirects + 1):
+            response, data = self._request(url, headers)
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307) and location:
+                url = urlparse.urljoin(url, location)
+                continue
+            return (response.status, response.msg, data)
+        raise TmdHttpError("Too many redirects requesting %s" % url)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connList in idle.values():
+            for conn in connList:
+                conn.close()
+
+_pool = None
+_poolLock = threading.Lock()
+
+def getPool():
+    """Returns the ConnectionPool shared by all requests of this module"""
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = ConnectionPool(config['connections'])
+        return _pool
+
+def fetchUrl(url):
+    """Returns the body of url (e.g. a cover image) fetched through the shared
+    connection pool. Raises TmdHttpError on failure."""
+    status, headers, data = getPool().fetch(url)
+    if status >= 400:
+        raise TmdHttpError("HTTP status code was %d" % status)
+    return data
+
 class XmlHandler:
     """Deals with retrieval of XML files from API"""
-    def __init__(self, url):
+    def __init__(self, url, endpoint = None):
         self.url = url
+        self.endpoint = endpoint
 
-    def _grabUrl(self, url):
+    def _grabUrl(self, url, cached = None):
+        """Returns a (data, etag, modified) tuple with the response of url.
+        If a cached response is given, the server is asked to only send the
+        response if it changed since, and data is None if it didn't.
+        """
+        headers = {}
+        if cached is not None:
+            if cached[2]:
+                headers["If-None-Match"] = cached[2]
+            if cached[3]:
+                headers["If-Modified-Since"] = cached[3]
+        if config['limiter'] is not None:
+            config['limiter'].Wait()
+        status, headers, data = getPool().fetch(url, headers)
+        if status == 304 and cached is not None:
+            return (None, cached[2], cached[3])
+        if status >= 400:
+            raise TmdHttpError("HTTP status code was %d" % status)
+        return (data, headers.getheader("ETag"), headers.getheader("Last-Modified"))
+
+    def _parse(self, xml):
         try:
-            urlhandle = urllib2.urlopen(url)
-        except IOError, errormsg:
-            raise TmdHttpError(errormsg)
-        if urlhandle.code >= 400:
-            raise TmdHttpError("HTTP status code was %d" % urlhandle.code)
-        return urlhandle.read()
+            et = ElementTree.fromstring(xml)
+        except SyntaxError, errormsg:
+            raise TmdXmlError(errormsg)
+        return et
+
+    def _getXml(self):
+        """Returns a (xml, validators) tuple. validators is the (etag,
+        modified) tuple of a response just downloaded, which should be
+        cached (see _store) once parsed, or None if there's nothing to cache.
+        """
+        cache = config['cache']
+        if cache is None:
+            return (self._grabUrl(self.url)[0], None)
+
+        cached = cache.get(self.url)
+        if cached is not None:
+            ttl = config['ttls'].get(self.endpoint, 0)
+            if config['offline'] or time.time() - cached[1] < ttl:
+                return (cached[0], None)
+        elif config['offline']:
+            raise TmdHttpError("No cached response for %s while offline" % self.url)
+
+        try:
+            xml, etag, modified = self._grabUrl(self.url, cached)
+        except TmdHttpError:
+            # A stale response beats no response at all
+            if cached is None:
+                raise
+            return (cached[0], None)
+
+        if xml is None:
+            cache.touch(self.url)
+            return (cached[0], None)
+
+        return (xml, (etag, modified))
+
+    def _store(self, xml, validators):
+        # Only responses that could be parsed are worth caching
+        if validators is not None and config['cache'] is not None:
+            config['cache'].set(self.url, xml, validators[0], validators[1])
 
     def getEt(self):
-        xml = self._grabUrl(self.url)
+        xml, validators = self._getXml()
+        et = self._parse(xml)
+        self._store(xml, validators)
+        return et
+
+    def iterMovies(self, parse):
+        """Parses the <movie> elements of the response one at a time, yielding
+        parse(element) as soon as each element is closed. Elements are
+        cleared once parsed, so only one movie is kept in memory at a time
+        instead of the whole tree.
+        """
+        xml, validators = self._getXml()
         try:
-            et = ElementTree.fromstring(xml)
+            # Only end events are asked for, start events would double the
+            # parsing time. Cleared movies stay in <movies> as empty elements.
+            for event, elem in ElementTree.iterparse(cStringIO.StringIO(xml)):
+                if elem.tag == "movie":
+                    result = parse(elem)
+                    elem.clear()
+                    yield result
         except SyntaxError, errormsg:
             raise TmdXmlError(errormsg)
-        return et
+        self._store(xml, validators)
 
 class SearchResults(list):
     """Stores a list of Movie's that matched the search"""
@@ -214,7 +472,23 @@ class CrewRoleList(dict):
     >>> tmdb.getMovieInfo(550)['cast'].keys()[:5]
     ['casting', 'producer', 'author', 'sound editor', 'actor']
     """
-    pass
+    def set(self, person_et):
+        """Takes an elementtree Element ('person') and adds a Person to the
+        CrewList of its job.
+        For example:
+        <person url="http://www.themoviedb.org/person/287" name="Brad Pitt" job="Actor" character="Tyler Durden" id="287"/>
+        ..becomes:
+        cast['actor'][0] = <actor (id 287): Brad Pitt (as Tyler Durden)>
+        """
+        job = person_et.get("job").lower()
+        p = Person(
+            job = job,
+            _id = person_et.get("id"),
+            name = person_et.get("name"),
+            character = person_et.get("character"),
+            url = person_et.get("url"),
+        )
+        self.setdefault(job, CrewList()).append(p)
 
 class CrewList(list):
     """Stores list of crew in specific role
@@ -244,94 +518,64 @@ class MovieDb:
     The search() method searches for the film by title.
     The getMovieInfo() method retrieves information about a specific movie using themoviedb id.
     """
-    def _parseSearchResults(self, movie_element):
-        cur_movie = MovieResult()
-        cur_images = ImagesList()
-        for item in movie_element.getchildren():
-                if item.tag.lower() == "images":
-                    for subitem in item.getchildren():
-                        cur_images.set(subitem)
-                else:
-                    cur_movie[item.tag] = item.text
-        cur_movie['images'] = cur_images
+    # The child elements of a <movie> holding a collection, by tag (lower
+    # case), with the class storing it. Any other child is a simple field.
+    _searchCollections = {"images": ImagesList}
+    _movieCollections = {"categories": Categories, "studios": Studios,
+                         "countries": Countries, "images": ImagesList,
+                         "cast": CrewRoleList}
+
+    def _parseElement(self, cur_movie, movie_element, collection_types):
+        collections = dict((tag, cls()) for tag, cls in collection_types.iteritems())
+        for item in movie_element:
+            collection = collections.get(item.tag.lower())
+            if collection is None:
+                cur_movie[item.tag] = item.text
+            else:
+                for subitem in item:
+                    collection.set(subitem)
+        cur_movie.update(collections)
         return cur_movie
 
+    def _parseSearchResults(self, movie_element):
+        return self._parseElement(MovieResult(), movie_element, self._searchCollections)
+
     def _parseMovie(self, movie_element):
-        cur_movie = Movie()
-        cur_categories = Categories()
-        cur_studios = Studios()
-        cur_countries = Countries()
-        cur_images = ImagesList()
-        cur_cast = CrewRoleList()
-        for item in movie_element.getchildren():
-            if item.tag.lower() == "categories":
-                for subitem in item.getchildren():
-                    cur_categories.set(subitem)
-            elif item.tag.lower() == "studios":
-                for subitem in item.getchildren():
-                    cur_studios.set(subitem)
-            elif item.tag.lower() == "countries":
-                for subitem in item.getchildren():
-                    cur_countries.set(subitem)
-            elif item.tag.lower() == "images":
-                for subitem in item.getchildren():
-                    cur_images.set(subitem)
-            elif item.tag.lower() == "cast":
-                for subitem in item.getchildren():
-                    job = subitem.get("job").lower()
-                    p = Person(
-                        job = job,
-                        _id = subitem.get("id"),
-                        name = subitem.get("name"),
-                        character = subitem.get("character"),
-                        url = subitem.get("url"),
-                    )
-                    cur_cast.setdefault(job, CrewList()).append(p)
-            else:
-                cur_movie[item.tag] = item.text
+        return self._parseElement(Movie(), movie_element, self._movieCollections)
 
-        cur_movie['categories'] = cur_categories
-        cur_movie['studios'] = cur_studios
-        cur_movie['countries'] = cur_countries
-        cur_movie['images'] = cur_images
-        cur_movie['cast'] = cur_cast
-        return cur_movie
-        
-    def search(self, title):
+    def iterSearch(self, title):
         """Searches for a film by its title.
-        Returns SearchResults (a list) containing all matches (Movie instances)
+        Yields each match (MovieResult instances) as soon as it's parsed
         """
         title = urllib.quote(title.encode("utf-8"))
         url = config['urls']['movie.search'] % (title)
-        etree = XmlHandler(url).getEt()
-        search_results = SearchResults()
-        for cur_result in etree.find("movies").findall("movie"):
-            cur_movie = self._parseSearchResults(cur_result)
-            search_results.append(cur_movie)
-        return search_results
+        return XmlHandler(url, 'movie.search').iterMovies(self._parseSearchResults)
+
+    def search(self, title):
+        """Searches for a film by its title.
+        Returns SearchResults (a list) containing all matches (Movie instances)
+        """
+        return SearchResults(self.iterSearch(title))
     
     def getMovieInfo(self, id):
         """Returns movie info by it's TheMovieDb ID.
         Returns a Movie instance
         """
         url = config['urls']['movie.getInfo'] % (id)
-        etree = XmlHandler(url).getEt()
-        moviesTree = etree.find("movies").findall("movie")
-
-        if len(moviesTree) == 0:
+        movies = list(XmlHandler(url, 'movie.getInfo').iterMovies(self._parseMovie))
+        if len(movies) == 0:
             raise TmdNoResults("No results for id %s" % id)
-        return self._parseMovie(moviesTree[0])
+        return movies[0]
 
     def mediaGetInfo(self, hash, size):
         """Used to retrieve specific information about a movie but instead of
         passing a TMDb ID, you pass a file hash and filesize in bytes
         """
         url = config['urls']['media.getInfo'] % (hash, size)
-        etree = XmlHandler(url).getEt()
-        moviesTree = etree.find("movies").findall("movie")
-        if len(moviesTree) == 0:
+        movies = list(XmlHandler(url, 'media.getInfo').iterMovies(self._parseMovie))
+        if len(movies) == 0:
             raise TmdNoResults("No results for hash %s" % hash)
-        return [self._parseMovie(x) for x in moviesTree]
+        return movies
         
     def imdbLookup(self,id=0,title=False):
         if id > 0:
@@ -339,12 +583,7 @@ class MovieDb:
         else:
             _imdb_id = self.search(title)[0]["imdb_id"]
             url = config['urls']['imdb.lookUp'] % (_imdb_id)
-        etree = XmlHandler(url).getEt()
-        lookup_results = SearchResults()
-        for cur_lookup in etree.find("movies").findall("movie"):
-            cur_movie = self._parseSearchResults(cur_lookup)
-            lookup_results.append(cur_movie)
-        return lookup_results
+        return SearchResults(XmlHandler(url, 'imdb.lookUp').iterMovies(self._parseSearchResults))
   
 # Shortcuts for tmdb search method
 # using:
@@ -6,7 +6,8 @@ Author: Revolt
 --------------------------
 Desc:
     This file contains the definition and implementation of an image
-    viewer control.
+    viewer control. The image is shown scaled down to fit the control,
+    the scaled bitmaps are cached by control size.
 --------------------------
 Copyright (C) 2010 Revolt 
 
@@ -26,12 +27,17 @@ Copyright (C) 2010 Revolt
 
 
 import wx, logging
+from classes.LRUCache import *
 
 class ImageViewer(wx.Control):
     """ The ImageViewer class """
 
+    # Time (in ms) without resize events after which the resizing is
+    # considered finished and the image is rescaled in high quality
+    RESIZE_DELAY = 200
+
     def __init__(self, parent, id = -1, image = wx.NullImage, pos = wx.DefaultPosition,
-                 size = wx.DefaultSize, style = wx.BORDER_NONE, label = ""):
+                 size = wx.DefaultSize, style = wx.BORDER_NONE, label = "", cacheSize = 8):
         """ 
         Constructor of an ImageViewer control.
         ---
@@ -39,6 +45,9 @@ class ImageViewer(wx.Control):
             @ parent (wx.Window) - The parent window of this control.
             @ image (wx.Image) - An image to be shown in the control.
             @ label (String) - A label for the image to be shown.
+            @ cacheSize (Integer) - How many high quality bitmaps of the image
+                                    (each for a different control size) to
+                                    keep.
         """
 
         wx.Control.__init__(self, parent, id, pos, size, style)
@@ -46,6 +55,11 @@ class ImageViewer(wx.Control):
         self.__startX = self.__startY = 0
         self.__image = image
         self.__cachedBitmap = wx.NullBitmap
+        # The control size and quality the cached bitmap was made with
+        self.__bitmapSize = None
+        self.__bitmapQuality = None
+        self.__bitmapCache = LRUCache(cacheSize)
+        self.__resizeTimer = None
 
         self.SetLabel(label)
         self.SetMinSize(size)
@@ -73,43 +87,76 @@ class ImageViewer(wx.Control):
         """
 
         self.__image = image
+        self.__bitmapCache.Clear()
         self.CreateBitmap()
         self.Refresh()
 
     # -- METHODS --
-    def CreateBitmap(self):
+    def CreateBitmap(self, quality = wx.IMAGE_QUALITY_HIGH):
         """
         This method (re)creates the cached bitmap to reflect size
         changes and also (re) calculates the startX and startY
         attributes so that the image is centered on the control.
+        High quality bitmaps are kept by control size so that going back
+        to a previous size doesn't rescale the image again.
+        ---
+        Params:
+            @ quality (Integer) - The wx.IMAGE_QUALITY_* with which to scale
+                                  the image. wx.IMAGE_QUALITY_NORMAL is
+                                  much faster but looks worse.
         """
 
+        controlSize = tuple(self.GetSize())
+        self.__bitmapSize = controlSize
+        self.__bitmapQuality = wx.IMAGE_QUALITY_HIGH
+
+        cached = self.__bitmapCache.Get(controlSize)
+
+        if cached is not None:
+            (self.__cachedBitmap, self.__startX, self.__startY) = cached
+            return
+
         self.__cachedBitmap = wx.NullBitmap
         self.__startX = self.__startY = 0
 
-        image = self.__image.Copy()
+        if not self.__image.IsOk():
+            return
+
+        image = self.__image
         (imageW, imageH) = image.GetSize()
 
         if imageW == 0 or imageH == 0:
             return
 
-        (controlW, controlH) = self.GetSize()
+        (controlW, controlH) = controlSize
 
         if imageW > controlW or imageH > controlH:
             ratio = float(imageW) / imageH
 
             if imageW > imageH:
                 imageW = controlW
-                imageH = imageW / ratio
+                imageH = int(imageW / ratio)
             else:
                 imageH = controlH
-                imageW = imageH * ratio
+                imageW = int(imageH * ratio)
 
-            image = image.Rescale(imageW, imageH)
+            if imageW <= 0 or imageH <= 0:
+                return
+
+            # Scale returns a scaled copy, leaving the original untouched
+            image = image.Scale(imageW, imageH, quality)
+        else:
+            # Not scaled, so the quality doesn't matter
+            quality = wx.IMAGE_QUALITY_HIGH
 
         self.__startX = (controlW - imageW) / 2
         self.__startY = (controlH - imageH) / 2
         self.__cachedBitmap = image.ConvertToBitmap()
+        self.__bitmapQuality = quality
+
+        if quality == wx.IMAGE_QUALITY_HIGH:
+            self.__bitmapCache.Set(controlSize, (self.__cachedBitmap,
+                                                 self.__startX, self.__startY))
 
     def Render(self, dc):
         """
@@ -135,13 +182,39 @@ class ImageViewer(wx.Control):
         """
 
         paintDC = wx.PaintDC(self)
+
+        # While resizing, the image is quickly scaled for the size it has
+        # when painted (see OnResize)
+        if self.__bitmapSize != tuple(self.GetSize()):
+            self.CreateBitmap(wx.IMAGE_QUALITY_NORMAL)
+
         self.Render(paintDC)
 
     def OnResize(self, event):
         """
-        The method called when the control is resized.
+        The method called when the control is resized. The bitmap is only
+        recreated on the next paint, so that several resizes between paints
+        only rescale the image once, and in high quality once resizing stops.
         """
 
-        self.CreateBitmap()
         self.Refresh()
 
+        if self.__resizeTimer is None:
+            self.__resizeTimer = wx.CallLater(self.RESIZE_DELAY, self.OnResizeEnd)
+        else:
+            self.__resizeTimer.Restart(self.RESIZE_DELAY)
+
+    def OnResizeEnd(self):
+        """
+        The method called once the control stopped being resized.
+        """
+
+        # The control may have been destroyed in the meantime
+        if not self:
+            return
+
+        if self.__bitmapSize != tuple(self.GetSize()) or \
+           self.__bitmapQuality != wx.IMAGE_QUALITY_HIGH:
+            self.CreateBitmap()
+            self.Refresh()
+
@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+
+"""
+File: MovieListCtrl.py
+Author: Revolt
+--------------------------
+Desc:
+    This file contains the definition and implementation of the list
+    control showing the movies of a category. It's a virtual list: rows
+    aren't stored in the control but read from a list of indexes into
+    the movie list whenever they are drawn.
+--------------------------
+Copyright (C) 2010 Revolt
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import wx
+from itertools import izip
+
+class MovieListCtrl(wx.ListView):
+    """ The MovieListCtrl class """
+
+    def __init__(self, parent, id = -1, pos = wx.DefaultPosition, size = wx.DefaultSize,
+                 style = wx.LC_NO_HEADER | wx.LC_SINGLE_SEL):
+        """
+        Constructor of a MovieListCtrl control.
+        ---
+        Params:
+            @ parent (wx.Window) - The parent window of this control.
+            @ style (Integer) - The list control style. The list is always
+                                a virtual list in report mode.
+        """
+
+        wx.ListView.__init__(self, parent, id, pos, size,
+                             style | wx.LC_REPORT | wx.LC_VIRTUAL)
+
+        self.__movieList = []
+        self.__itemList = []
+        # The row in which each shown movie is, by its index in the movie list
+        self.__rowDict = dict()
+
+        self.InsertColumn(0, "Name")
+
+    # -- PROPERTIES (GET) --
+    def GetMovieList(self):
+        """
+        Return: (List of Movies) The movies whose names the list can show.
+        """
+
+        return self.__movieList
+
+    def GetItemList(self):
+        """
+        Return: (List of Integers) The indexes in the movie list of the movies
+                 shown, in the order they are shown.
+        """
+
+        return self.__itemList
+
+    def GetMovie(self, row):
+        """
+        Gets the movie shown in a row of the list.
+        ---
+        Params:
+            @ row (Integer) - The row of the list.
+        ---
+        Return: (Movie) The movie shown in that row.
+        """
+
+        return self.__movieList[self.__itemList[row]]
+
+    def GetRow(self, item):
+        """
+        Gets the row of the list in which a movie is shown.
+        ---
+        Params:
+            @ item (Integer) - The index of the movie in the movie list.
+        ---
+        Return: (Integer) The row showing the movie or -1 if it isn't shown.
+        """
+
+        return self.__rowDict.get(item, -1)
+
+    # -- PROPERTIES (SET) --
+    def SetMovieList(self, movieList):
+        """
+        Sets the movies whose names the list can show. The list is emptied
+        until the movies to show are set with SetItemList.
+        ---
+        Params:
+            @ movieList (List of Movies) - The movies.
+        """
+
+        self.__movieList = movieList if movieList is not None else []
+        self.__itemList = []
+        self.__rowDict = dict()
+
+        self.DeleteAllItems()
+
+    def SetItemList(self, itemList):
+        """
+        Sets which movies of the movie list are shown and in which order.
+        Only the visible rows are redrawn. The selected movie stays selected
+        if it's still shown.
+        ---
+        Params:
+            @ itemList (List of Integers) - The indexes in the movie list of
+                                            the movies to show.
+        """
+
+        selectedRow = self.GetFirstSelected()
+        selectedItem = None
+
+        if selectedRow != -1:
+            selectedItem = self.__itemList[selectedRow]
+            self.Select(selectedRow, False)
+
+        self.__itemList = itemList
+        self.__rowDict = dict(izip(itemList, xrange(len(itemList))))
+        self.SetItemCount(len(itemList))
+
+        if selectedItem is not None:
+            selectedRow = self.GetRow(selectedItem)
+
+            if selectedRow != -1:
+                self.Select(selectedRow)
+                self.Focus(selectedRow)
+
+        self.Refresh()
+
+    # -- METHODS --
+    def OnGetItemText(self, row, column):
+        """
+        Called by wx to get the text of a row when drawing it.
+        ---
+        Params:
+            @ row (Integer) - The row being drawn.
+            @ column (Integer) - The column being drawn.
+        ---
+        Return: (String) The name of the movie in that row.
+        """
+
+        return self.__movieList[self.__itemList[row]].GetName()
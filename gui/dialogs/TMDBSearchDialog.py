@@ -26,6 +26,7 @@ Copyright (C) 2010 Revolt
 
 import wx, logging
 from classes.infoproviders import tmdb
+from classes.WorkerPool import *
 from common import GetResultTitle, GetResultID
 from TMDBSearchResultDialog import *
 
@@ -53,7 +54,7 @@ class TMDBSearchDialog(wx.Dialog):
         self.szrBaseVert = wx.BoxSizer(wx.VERTICAL)
         self.szrListHoriz = wx.BoxSizer(wx.HORIZONTAL)
 
-        self.lstResults = wx.ListView(self, style = wx.LC_REPORT | wx.LC_SINGLE_SEL | wx.LC_SORT_ASCENDING | wx.SUNKEN_BORDER, size=(540, 200))
+        self.lstResults = wx.ListView(self, style = wx.LC_REPORT | wx.LC_SINGLE_SEL | wx.SUNKEN_BORDER, size=(540, 200))
         self.lstResults.InsertColumn(0, "Name")
         self.lstResults.SetColumnWidth(0, 180)
         self.lstResults.InsertColumn(1, "Title")
@@ -83,12 +84,24 @@ class TMDBSearchDialog(wx.Dialog):
 
     def PopulateList(self):
         """ 
-        Searches TMDB for all movies in the movie list.
+        Searches TMDB for all movies in the movie list. Several searches run at
+        the same time (see GetMaxSearches) and each row is filled as soon
+        as its search finishes.
         """
 
         self.__logger.debug("Started searching TMDB")
 
-        mdb = tmdb.MovieDb()
+        pool = WorkerPool(self.GetMaxSearches())
+
+        # Rows are added upfront, in the order of the movie list
+        self.__resultCache = [[] for movie in self.__movieList]
+
+        for index in range(len(self.__movieList)):
+            movie = self.__movieList[index]
+            self.lstResults.InsertStringItem(index, movie.GetName())
+            self.lstResults.SetItemData(index, -1)
+            self.lstResults.SetStringItem(index, 1, "Searching...")
+            pool.Submit(index, self.__SearchMovie, movie)
 
         dlgProgress = wx.ProgressDialog("Searching TMDB...", 
                                         "Preparing Search.......................................", 
@@ -96,72 +109,127 @@ class TMDBSearchDialog(wx.Dialog):
                                         wx.PD_AUTO_HIDE | wx.PD_CAN_ABORT \
                                                         | wx.PD_APP_MODAL)
 
-        i = 1
+        finished = 0
+        unfinishedSet = set(range(len(self.__movieList)))
+        failedList = []
+        message = "Preparing Search..."
+
+        while finished < len(self.__movieList):
+            # Waits briefly so that the progress dialog (and its abort button)
+            # keeps responding while the searches run
+            jobResult = pool.GetResult(0.1)
+
+            if jobResult is not None:
+                index, searchResult, error = jobResult
+                movie = self.__movieList[index]
+                finished += 1
+                unfinishedSet.discard(index)
+                message = "Searched for '" + movie.GetName() + "'..."
+
+                if error is None:
+                    self.__SetRowResult(index, *searchResult)
+                else:
+                    failedList.append(movie.GetName())
+                    self.lstResults.SetStringItem(index, 1, "Search failed")
 
-        for movie in self.__movieList:
-            shouldContinue, shouldSkip = dlgProgress.Update(i, "Searching for '" + movie.GetName() + "'...")
+            shouldContinue, shouldSkip = dlgProgress.Update(finished, message)
 
             if not shouldContinue:
-                dlgProgress.Show(False)
-                return
-
-            results = []
-
-            try:
-                results = mdb.search(movie.GetName())
-                self.__resultCache.append(results)
-            except tmdb.TmdBaseError, e:
-                self.__logger.exception("Failed to perform TMDB search.")
-                wx.MessageBox("Failed to perform TMDB search for " + movie.GetName(),
-                              "Error", wx.ID_OK | wx.ICON_ERROR, self)
+                self.__logger.debug("TMDB search aborted, %d searches cancelled",
+                                    pool.Cancel())
                 break
 
-            self.__logger.debug("Found %d results for '%s'", len(results), movie.GetName())
+        pool.Shutdown(False)
+        dlgProgress.Destroy()
 
-            index = self.lstResults.InsertStringItem(self.lstResults.GetItemCount(), movie.GetName())
+        # Rows whose search was aborted are left without a title
+        for index in unfinishedSet:
+            self.lstResults.SetStringItem(index, 1, "Not searched")
+
+        if len(failedList) == 1:
+            wx.MessageBox("Failed to perform TMDB search for " + failedList[0],
+                          "Error", wx.ID_OK | wx.ICON_ERROR, self)
+        elif len(failedList) > 1:
+            wx.MessageBox("Failed to perform TMDB search for %d movies" % len(failedList),
+                          "Error", wx.ID_OK | wx.ICON_ERROR, self)
+
+    def GetMaxSearches(self):
+        """
+        Reads from the app's config how many TMDB searches may run at the same
+        time. The requests they make are limited by tmdb.config['limiter'].
+        ---
+        Return: (Integer) The maximum number of searches running at once.
+        """
 
-            tmdbID = movie.GetTMDBID()
-            resultIndex = 0
-            resultTitle = ""
+        return wx.Config.Get().ReadInt("/tmdb/MaxSearches", 4)
+
+    def __SearchMovie(self, movie):
+        """
+        Searches TMDB for a movie. It's run by the worker threads so it must
+        not touch any control.
+        ---
+        Params:
+            @ movie (Movie) - The movie to search for.
+        ---
+        Return: (Tuple) The list of results and the index in it of the result
+                 associated with the movie (-1 if none).
+        ---
+        Raises: tmdb.TmdBaseError if a TMDB request fails.
+        """
+
+        mdb = tmdb.MovieDb()
+
+        results = mdb.search(movie.GetName())
+
+        self.__logger.debug("Found %d results for '%s'", len(results), movie.GetName())
+
+        tmdbID = movie.GetTMDBID()
+
+        # If the movie doesn't have a TMDB ID set then just use the results
+        if tmdbID == "" or tmdbID.isspace():
+            if len(results) == 0:
+                return (results, -1)
+
+            return (results, 0)
+
+        j = 0
+
+        for result in results:
+            if result['id'] == tmdbID:
+                return (results, j)
+            j += 1
+
+        # If the movie's TMDB ID isn't contained in the results, add it to it
+        results.append(mdb.getMovieInfo(tmdbID))
+
+        return (results, len(results) - 1)
+
+    def __SetRowResult(self, index, results, resultIndex):
+        """
+        Shows the results of the search of a movie in its row.
+        ---
+        Params:
+            @ index (Integer) - The index of the movie (and its row).
+            @ results (List) - The results of the search.
+            @ resultIndex (Integer) - The index of the result associated with
+                                      the movie (-1 if none).
+        """
+
+        self.__resultCache[index] = results
+
+        if resultIndex == -1:
+            resultTitle = "No title found"
             resultID = ""
+        else:
+            resultTitle = GetResultTitle(results[resultIndex])
+            resultID = GetResultID(results[resultIndex])
 
-            # If the movie doesn't have a TMDB ID set then just use the results
-            if tmdbID == "" or tmdbID.isspace():
-                if len(results) == 0:
-                    resultIndex = -1
-                    resultTitle = "No title found"
-                else:
-                    resultTitle = GetResultTitle(results[0])
-                    resultID = GetResultID(results[0])
-            else:
-                found = False
-                j = 0
-
-                for result in results:
-                    if result['id'] == tmdbID:
-                        resultIndex = j
-                        resultTitle = GetResultTitle(result)
-                        resultID = GetResultID(result)
-                        found = True
-                        break
-                    j += 1
-
-                # If the movie's TMDB ID isn't contained in the results, add it to it
-                if not found:
-                    newResult = mdb.getMovieInfo(tmdbID)
-                    results.append(newResult)
-                    resultIndex = len(results) - 1
-                    resultTitle = GetResultTitle(newResult)
-                    resultID = GetResultID(newResult)
-
-            self.__logger.debug(movie.GetName() + " - " + str(resultIndex) + ", " + resultTitle + ", " + resultID)
-
-            self.lstResults.SetItemData(index, resultIndex)
-            self.lstResults.SetStringItem(index, 1, resultTitle)
-            self.lstResults.SetStringItem(index, 2, resultID)
-
-            i += 1
+        self.__logger.debug(self.__movieList[index].GetName() + " - " + str(resultIndex) + \
+                            ", " + resultTitle + ", " + resultID)
 
+        self.lstResults.SetItemData(index, resultIndex)
+        self.lstResults.SetStringItem(index, 1, resultTitle)
+        self.lstResults.SetStringItem(index, 2, resultID)
 
     # -- EVENTS --
     def OnListItemActivated(self, event):
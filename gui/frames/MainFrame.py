@@ -25,14 +25,18 @@ Copyright (C) 2010 Revolt
 """
 
 
-import wx, sys, os, logging, subprocess
+import wx, sys, os, logging, subprocess, threading
 from appinfo import *
 from operator import methodcaller
 from gui.panels.MovieDetailsPanel import *
+from gui.controls.MovieListCtrl import *
 from gui.dialogs.HddSelectorDialog import *
 from gui.dialogs.TMDBSearchDialog import *
 from classes.filters.FilterName import *
 from classes.filters.FilterTMDB import *
+from classes.HardDriveList import *
+from classes.CatalogueIndex import *
+from classes.ImagePipeline import *
 
 # --------------------- Main frame Class -----------------------
 
@@ -43,6 +47,10 @@ class MainFrame(wx.Frame):
     ID_TMDB_SEARCHNEW = 101
     ID_TMDB_REFRESH = 102
     ID_LOGS = 103
+    ID_FIND = 104
+
+    # Time (in ms) without typing after which the search box is applied
+    SEARCH_DELAY = 250
 
     def __init__(self, parent, title):
         """ Constructor """
@@ -55,7 +63,14 @@ class MainFrame(wx.Frame):
         self.__categoryList = None
         self.__currentCategory = None
         self.__movieList = None
+        self.__movieIndexDict = None
         self.__selectedMovie = None
+        self.__searchString = None
+        self.__nameMatchList = None
+        self.__searchTimer = None
+        self.__loadGeneration = 0
+        self.__loading = False
+        self.__pendingMoviePath = None
         self.__logger = logging.getLogger("mhdd.gui.mainframe")
 
         # -- Control Initialization --
@@ -63,6 +78,7 @@ class MainFrame(wx.Frame):
         
         self.mnuMain = wx.Menu()
         self.mnuMain.Append(wx.ID_OPEN, "Select Harddrive")
+        self.mnuMain.Append(self.ID_FIND, "Find movie in all harddrives...\tCtrl+F")
         self.mnuMain.AppendSeparator()
         self.mnuMain.Append(wx.ID_EXIT, "Exit")
 
@@ -113,6 +129,8 @@ class MainFrame(wx.Frame):
 
         self.tlbMain.Realize()
 
+        self.stbMain = self.CreateStatusBar()
+
         self.sptMain = wx.SplitterWindow(self)
 
         self.pnlMovieList = wx.Panel(self.sptMain)
@@ -121,8 +139,7 @@ class MainFrame(wx.Frame):
         self.sptMain.SplitVertically(self.pnlMovieList, self.pnlMovieDetailsBase, 150)
         self.sptMain.SetSashPosition(150)
 
-        self.lstMovie = wx.ListView(self.pnlMovieList, style = wx.LC_REPORT | wx.LC_NO_HEADER | wx.LC_SINGLE_SEL | wx.LC_SORT_ASCENDING | wx.SUNKEN_BORDER)
-        self.lstMovie.InsertColumn(0, "Name")
+        self.lstMovie = MovieListCtrl(self.pnlMovieList, style = wx.LC_NO_HEADER | wx.LC_SINGLE_SEL | wx.SUNKEN_BORDER)
         self.szrBaseMovieList = wx.BoxSizer(wx.VERTICAL)
         self.szrBaseMovieList.Add(self.lstMovie, 1, wx.ALL | wx.EXPAND, 5)
 
@@ -148,6 +165,7 @@ class MainFrame(wx.Frame):
         # -- Event Binding -- 
         self.Bind(wx.EVT_MENU, self.OnMenuSelectExit, id = wx.ID_EXIT)
         self.Bind(wx.EVT_MENU, self.OnMenuSelectHardDrive, id = wx.ID_OPEN)
+        self.Bind(wx.EVT_MENU, self.OnMenuSelectFind, id = self.ID_FIND)
         self.Bind(wx.EVT_MENU, self.OnMenuSelectTMDBSearch, id = self.ID_TMDB_SEARCHNEW)
         self.Bind(wx.EVT_MENU, self.OnMenuSelectTMDBRefresh, id = self.ID_TMDB_REFRESH)
         self.Bind(wx.EVT_MENU, self.OnMovieListRefresh, id = wx.ID_REFRESH)
@@ -155,6 +173,7 @@ class MainFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, self.OnLogsOpen, id=self.ID_LOGS)
 
         self.txtSearch.Bind(wx.EVT_TEXT_ENTER, self.OnMovieSearch)
+        self.txtSearch.Bind(wx.EVT_TEXT, self.OnMovieSearchText)
         self.cmbCat.Bind(wx.EVT_COMBOBOX, self.OnCatChanged)
         self.lstMovie.Bind(wx.EVT_SIZE, self.OnMovieListResize)
         self.lstMovie.Bind(wx.EVT_LIST_ITEM_SELECTED, self.OnMovieListItemSelect)
@@ -183,7 +202,11 @@ class MainFrame(wx.Frame):
             @ hdd (HardDrive) - The new harddrive to be analysed
         """
 
-        self.lstMovie.DeleteAllItems()
+        if self.__currentHdd is not None and not self.__currentHdd.Flush():
+            self.__logger.error("Failed to write some movie info to '%s'",
+                                self.__currentHdd.GetLabel())
+
+        self.ClearMovieList()
         self.__currentHdd = None
         self.__categoryList = None
         self.cmbCat.Clear()
@@ -220,6 +243,12 @@ class MainFrame(wx.Frame):
         self.tlbMain.EnableTool(wx.ID_REFRESH, False)
         self.ChangeMovie(None)
 
+        # Cancels the loading of the previous category, if any
+        self.__loadGeneration += 1
+        self.__loading = False
+        self.__pendingMoviePath = None
+        self.stbMain.SetStatusText("")
+
         if cat is None or not isinstance(cat, Category):
             return
 
@@ -241,48 +270,356 @@ class MainFrame(wx.Frame):
         self.__selectedMovie = movie
         self.pnlMovieDetails.SetMovie(self.__selectedMovie)
 
-    def PopulateMovieList(self, condition = None):
+    def ClearMovieList(self):
+        """
+        Removes all items from the movie list and forgets the last search.
+        """
+
+        self.lstMovie.SetMovieList(self.__movieList)
+        self.__searchString = None
+        self.__nameMatchList = None
+
+    def UpdateMovieList(self, itemList):
+        """
+        Makes the movie list show the movies at the provided indexes of the
+        loaded movie list, in that order. The list is virtual so only the
+        visible rows are redrawn, whatever the number of movies.
+        ---
+        Params:
+            @ itemList (List of Integers) - The indexes of the movies to show.
+        """
+
+        self.lstMovie.SetItemList(itemList)
+
+    def PopulateMovieList(self, condition = None, candidateList = None):
         """
         Populates the movie list with movies from the selected category
         ---
         Params:
             @  condition (Filter) - The condition with which to filter the movie list
+            @  candidateList (List of Integers) - The indexes of the only movies
+                                                  which need to be tested (all
+                                                  movies if None).
         """
 
-        self.lstMovie.DeleteAllItems()
+        if self.__movieList is None:
+            self.ClearMovieList()
+            return
+
+        if candidateList is None:
+            candidateList = xrange(len(self.__movieList))
+
+        self.__logger.debug("Populating movie list with %d items", len(candidateList))
+
+        if condition is None:
+            itemList = list(candidateList)
+        else:
+            movieList = self.__movieList
+            itemList = [i for i in candidateList if condition.Test(movieList[i])]
+
+        self.UpdateMovieList(itemList)
+
+    def PopulateMovieListRanked(self, pathList):
+        """
+        Populates the movie list with the movies of the selected category found
+        by a search, keeping the order of the search results.
+        ---
+        Params:
+            @ pathList (List of Strings) - The relative paths of the movies found.
+        """
 
         if self.__movieList is None:
+            self.ClearMovieList()
             return
 
-        self.__logger.debug("Populating movie list with %d items", len(self.__movieList))
+        self.__logger.debug("Populating movie list with %d search results", len(pathList))
 
-        i = 0
+        movieIndexDict = self.__movieIndexDict
 
-        for movie in self.__movieList:
-            if condition is None or condition.Test(movie):
-                index = self.lstMovie.InsertStringItem(self.lstMovie.GetItemCount(), movie.GetName())
-                self.lstMovie.SetItemData(index, i)
+        # The search index may know movies not loaded in the list yet
+        self.UpdateMovieList([movieIndexDict[path] for path in pathList
+                              if path in movieIndexDict])
 
-            i += 1
+    def UpdateMovieSearch(self):
+        """
+        Filters the movie list with the contents of the search box, if they
+        changed since the last search. While the search only gets longer,
+        searching by name only tests the movies found by the last search.
+        """
+
+        searchString = self.txtSearch.GetValue().strip()
+
+        if searchString == self.__searchString:
+            return
+
+        if self.__searchTimer is not None:
+            self.__searchTimer.Stop()
+
+        nameMatchList = None
+
+        if not searchString or self.__currentCategory is None:
+            self.PopulateMovieList()
+        else:
+            pathList = None
+
+            # The search index is busy while the category is synced
+            if not self.__loading:
+                pathList = self.__currentCategory.SearchMovies(searchString)
+
+            # Without a search index only the movie names can be searched
+            if pathList is not None:
+                self.PopulateMovieListRanked(pathList)
+            else:
+                if self.__nameMatchList is not None and \
+                   searchString.startswith(self.__searchString):
+                    candidateList = self.__nameMatchList
+                else:
+                    candidateList = None
+
+                self.PopulateMovieList(FilterName(searchString), candidateList)
+                nameMatchList = self.lstMovie.GetItemList()
+
+        self.__searchString = searchString
+        self.__nameMatchList = nameMatchList
 
     def RefreshMovieList(self):
         """
-        (Re)reads the movie list from the HDD (or cache) and updates the listview.
+        (Re)reads the movie list from the HDD (or cache) in a background thread.
+        Movies are added to the listview as they are loaded and, once loading
+        is done, the list is sorted and the search is applied to it.
         """
 
         self.__logger.debug("Refreshing movie list")
 
-        dsbWindow = wx.WindowDisabler()
-        infBusy = wx.BusyInfo("Please wait...", self)
-        self.__movieList = self.__currentCategory.GetMovieList(True)
-        if self.__movieList is not None:
-            self.__movieList.sort(key = methodcaller("GetName"))
+        # Cancels the loading in progress, if any
+        self.__loadGeneration += 1
+        self.__loading = True
+
+        self.__movieList = []
+        self.__movieIndexDict = dict()
+        self.ClearMovieList()
+
+        cat = self.__currentCategory
+        self.stbMain.SetStatusText("Loading '%s'..." % cat.GetName())
+
+        loaderThread = threading.Thread(target = self.__LoadMovieList,
+                                        args = (cat, self.__loadGeneration))
+        loaderThread.setDaemon(True)
+        loaderThread.start()
+
+    def SelectMovie(self, path):
+        """
+        Selects a movie of the current category. If the category is still being
+        loaded, the movie is selected once loading is done.
+        ---
+        Params:
+            @ path (String) - The relative path of the movie.
+        """
+
+        if self.__loading:
+            self.__pendingMoviePath = path
+            return
+
+        if self.__movieIndexDict is None:
+            return
+
+        i = self.__movieIndexDict.get(path)
+
+        if i is None:
+            return
+
+        row = self.lstMovie.GetRow(i)
+
+        if row != -1:
+            self.lstMovie.Select(row)
+            self.lstMovie.EnsureVisible(row)
+
+    def __LoadMovieList(self, cat, generation):
+        """
+        Loads the movie list of a category. It's run by a background thread
+        and hands the movies over to the UI thread in chunks.
+        ---
+        Params:
+            @ cat (Category) - The category to load.
+            @ generation (Integer) - Identifies this load. It's cancelled once
+                                     another one starts or the category changes.
+        """
+
+        def Progress(movieChunk):
+            if generation != self.__loadGeneration:
+                return False
+
+            wx.CallAfter(self.__OnMovieChunkLoaded, generation, movieChunk)
+
+            return True
+
+        try:
+            movieList = cat.GetMovieList(True, Progress)
+        except Exception, e:
+            self.__logger.exception("Error loading the movies of category '%s'", cat.GetName())
+            movieList = None
+
+        wx.CallAfter(self.__OnMovieListLoaded, generation, movieList)
+
+    def __OnMovieChunkLoaded(self, generation, movieChunk):
+        """
+        Called in the UI thread with each chunk of movies loaded by the
+        background thread, to add them to the listview.
+        ---
+        Params:
+            @ generation (Integer) - The load which produced the chunk.
+            @ movieChunk (List of Movies) - The movies loaded.
+        """
+
+        if generation != self.__loadGeneration:
+            return
+
+        start = len(self.__movieList)
+        self.__movieList.extend(movieChunk)
+
+        for i in xrange(start, len(self.__movieList)):
+            self.__movieIndexDict[self.__movieList[i].GetRelativePath()] = i
+
+        searchString = self.txtSearch.GetValue().strip()
+        itemList = xrange(start, len(self.__movieList))
+
+        # The search index is only searched once the category is synced
+        if searchString:
+            nameFilter = FilterName(searchString)
+            itemList = [i for i in itemList if nameFilter.Test(self.__movieList[i])]
+
+        self.UpdateMovieList(self.lstMovie.GetItemList() + list(itemList))
+
+        # The movies found by the last search don't include this chunk, so
+        # the next search has to test every movie again
+        self.__nameMatchList = None
+
+        self.stbMain.SetStatusText("Loading '%s': %d movies..." % \
+                                   (self.__currentCategory.GetName(), len(self.__movieList)))
+
+    def __OnMovieListLoaded(self, generation, movieList):
+        """
+        Called in the UI thread once the background thread finished loading
+        the movie list, to show the whole (sorted) list.
+        ---
+        Params:
+            @ generation (Integer) - The load which finished.
+            @ movieList (List of Movies) - The movies of the category or None if
+                                           they couldn't be loaded.
+        """
+
+        if generation != self.__loadGeneration:
+            return
 
-        self.PopulateMovieList()
-        if self.lstMovie.GetItemCount() > 0:
+        self.__loading = False
+        catName = self.__currentCategory.GetName()
+
+        if movieList is None:
+            self.__movieList = None
+            self.__movieIndexDict = None
+            self.ClearMovieList()
+            self.stbMain.SetStatusText("Unable to load '%s'" % catName)
+            return
+
+        selectedMovie = self.__selectedMovie
+        selectedPath = self.__pendingMoviePath
+        self.__pendingMoviePath = None
+
+        if selectedPath is None and selectedMovie is not None:
+            selectedPath = selectedMovie.GetRelativePath()
+
+        movieList.sort(key = methodcaller("GetName"))
+        self.__movieList = movieList
+        self.__movieIndexDict = dict((movie.GetRelativePath(), i)
+                                     for i, movie in enumerate(movieList))
+
+        self.ClearMovieList()
+        self.UpdateMovieSearch()
+
+        if selectedPath is not None:
+            self.SelectMovie(selectedPath)
+
+        if self.lstMovie.GetFirstSelected() == -1 and self.lstMovie.GetItemCount() > 0:
             self.lstMovie.Select(0)
-        del infBusy
-        del dsbWindow
+
+        self.stbMain.SetStatusText("%d movies in '%s'" % (len(movieList), catName))
+
+    def FindMovie(self, text):
+        """
+        Looks for a movie in all registered harddrives (connected or not) and,
+        if the user picks one of the results, shows it.
+        ---
+        Params:
+            @ text (String) - The text to look for in the title or name of the movies.
+        """
+
+        hddList = HardDriveList()
+        hddList.LoadFromConfig(False)
+
+        catalogueIndex = CatalogueIndex.Get()
+        catalogueIndex.Synchronize(hddList)
+
+        results = catalogueIndex.Find(text)
+
+        if len(results) == 0:
+            wx.MessageBox("No movie matching '%s' was found." % text, "Find movie",
+                          wx.OK | wx.ICON_INFORMATION, self)
+            return
+
+        choices = []
+
+        for entry in results:
+            movieTitle = entry['title'] or entry['name']
+
+            if entry['year']:
+                movieTitle = u"%s (%s)" % (movieTitle, entry['year'])
+
+            choices.append(u"%s - %s / %s" % (movieTitle, entry['label'], entry['catname']))
+
+        dlgResults = wx.SingleChoiceDialog(self, "Movies found:", "Find movie", choices)
+
+        if dlgResults.ShowModal() == wx.ID_OK:
+            self.ShowCatalogueEntry(results[dlgResults.GetSelection()], hddList)
+
+        dlgResults.Destroy()
+
+    def ShowCatalogueEntry(self, entry, hddList):
+        """
+        Changes to the harddrive and category of a movie found in the catalogue
+        index and selects it.
+        ---
+        Params:
+            @ entry (Row) - The catalogue index entry of the movie.
+            @ hddList (HardDriveList) - The registered harddrives.
+        """
+
+        if self.__currentHdd is None or self.__currentHdd.GetUuid() != entry['drive']:
+            hdd = hddList.GetHardDrive(entry['drive'])
+
+            if hdd is None:
+                return
+
+            self.ChangeHDD(hdd)
+
+        if self.__categoryList is None:
+            return
+
+        i = 0
+
+        for category in self.__categoryList:
+            if category.GetRelativePath() == entry['category']:
+                if category is not self.__currentCategory:
+                    self.cmbCat.SetSelection(i)
+                    self.ChangeCat(category)
+                break
+
+            i += 1
+        else:
+            return
+
+        self.txtSearch.ChangeValue("")
+        self.UpdateMovieSearch()
+        self.SelectMovie(entry['path'])
 
     def ShowTMDBDialog(self, movieList):
         """
@@ -315,28 +652,102 @@ class MainFrame(wx.Frame):
 
         self.__logger.debug("Refreshing TMDB info on a list of %d movies", len(movieList))
 
+        # The last step is waiting for the covers still being downloaded
         dlgProgress = wx.ProgressDialog("Getting TMDB info...", "Preparing TMDB Loading.............................", 
-                                        len(movieList), self, wx.PD_AUTO_HIDE | 
+                                        len(movieList) + 1, self, wx.PD_AUTO_HIDE | 
                                         wx.PD_CAN_ABORT)
 
+        # Covers are downloaded (and thumbnailed) concurrently while the info
+        # of the next movies is loaded. Movies waiting for their cover are
+        # only saved once it arrives.
+        imagePipeline = ImagePipeline()
+        coverMovies = set()
+        shouldContinue = True
+
         i = 1
 
         for movie in movieList:
             shouldContinue, shouldSkip = dlgProgress.Update(i, "Getting info for '" + movie.GetName() + "'")
 
             if not shouldContinue:
-                dlgProgress.Show(False)
-                return
+                break
+
+            pendingDownloads = imagePipeline.GetPendingDownloads()
+            movie.LoadInfoFromTMDB(imagePipeline)
 
-            movie.LoadInfoFromTMDB()
-            movie.SaveInfoToHdd()
+            if imagePipeline.GetPendingDownloads() > pendingDownloads:
+                coverMovies.add(movie)
+            else:
+                self.__SaveRefreshedMovie(movie)
 
-            if movie == self.__selectedMovie:
-                # Refresh displayed info in case the refreshed movie is the active one
-                self.pnlMovieDetails.SetMovie(movie)
+            self.__SetDownloadedCovers(imagePipeline, coverMovies, 0)
 
             i += 1
 
+        while shouldContinue and imagePipeline.GetPendingDownloads() > 0:
+            shouldContinue, shouldSkip = dlgProgress.Update(len(movieList), "Waiting for %d covers" %
+                                                            imagePipeline.GetPendingDownloads())
+            self.__SetDownloadedCovers(imagePipeline, coverMovies, 0.1)
+
+        if not shouldContinue:
+            dlgProgress.Show(False)
+            imagePipeline.CancelDownloads()
+
+            # The covers being downloaded still get set
+            while imagePipeline.GetPendingDownloads() > 0:
+                self.__SetDownloadedCovers(imagePipeline, coverMovies, None)
+
+        # Movies whose cover couldn't be downloaded are saved without it
+        for movie in coverMovies:
+            self.__SaveRefreshedMovie(movie)
+
+        imagePipeline.Shutdown(False)
+        dlgProgress.Update(len(movieList) + 1)
+
+    def __SetDownloadedCovers(self, imagePipeline, coverMovies, timeout):
+        """
+        Sets the covers downloaded by an image pipeline on their movies and
+        saves them.
+        ---
+        Params:
+            @ imagePipeline (ImagePipeline) - The pipeline downloading the
+                                              covers, tagged by movie.
+            @ coverMovies (Set of Movies) - The movies waiting for their cover.
+                                            Movies are removed once saved.
+            @ timeout (Float) - How many seconds to wait for the first cover.
+        """
+
+        result = imagePipeline.GetResult(timeout)
+
+        while result is not None:
+            (movie, covers, exception) = result
+
+            if exception is None:
+                (imageData, thumbnailData) = covers
+                movie.SetImageData(imageData)
+
+                if thumbnailData is not None:
+                    movie.SetThumbnailData(thumbnailData)
+
+            coverMovies.discard(movie)
+            self.__SaveRefreshedMovie(movie)
+
+            result = imagePipeline.GetResult(0)
+
+    def __SaveRefreshedMovie(self, movie):
+        """
+        Saves a movie whose info was refreshed from TMDB.
+        ---
+        Params:
+            @ movie (Movie) - The refreshed movie.
+        """
+
+        movie.SaveInfoToHdd()
+
+        if movie == self.__selectedMovie:
+            # Refresh displayed info in case the refreshed movie is the active one
+            self.pnlMovieDetails.SetMovie(movie)
+
     # -- EVENTS --
     def OnMenuSelectHardDrive(self, event):
         """
@@ -345,6 +756,18 @@ class MainFrame(wx.Frame):
 
         self.SelectHDD()
 
+    def OnMenuSelectFind(self, event):
+        """
+        This method is called when the user clicks on the Find movie menu entry.
+        """
+
+        dlgFind = wx.TextEntryDialog(self, "Title or name of the movie:", "Find movie")
+
+        if dlgFind.ShowModal() == wx.ID_OK and dlgFind.GetValue().strip():
+            self.FindMovie(dlgFind.GetValue().strip())
+
+        dlgFind.Destroy()
+
     def OnMenuSelectTMDBSearch(self, event):
         """
         This method is called when the user clicks on the TMDB Search New menu entry.
@@ -374,7 +797,7 @@ class MainFrame(wx.Frame):
         This method is called when a user selects a new category in the combobox.
         """
 
-        self.lstMovie.DeleteAllItems()
+        self.ClearMovieList()
 
         selectedCategoryIndex = event.GetSelection()
 
@@ -395,23 +818,29 @@ class MainFrame(wx.Frame):
         This method is called when the user selects a movie from the list.
         """
 
-        selectedIndex = event.GetIndex()
-        i = self.lstMovie.GetItemData(selectedIndex)
-        self.ChangeMovie(self.__movieList[i])
+        movie = self.lstMovie.GetMovie(event.GetIndex())
+
+        # Also sent when the list is filtered and its selected movie moves
+        if movie is not self.__selectedMovie:
+            self.ChangeMovie(movie)
 
     def OnMovieSearch(self, event):
         """
         This method is called when the user clicks the search button.
         """
 
-        searchString = self.txtSearch.GetValue()
+        self.UpdateMovieSearch()
 
-        nameFilter = None
-
-        if not searchString.isspace():
-            nameFilter = FilterName(searchString)
+    def OnMovieSearchText(self, event):
+        """
+        This method is called when the user types in the search box. The search
+        only runs once the user stops typing for a moment.
+        """
 
-        self.PopulateMovieList(nameFilter)
+        if self.__searchTimer is None:
+            self.__searchTimer = wx.CallLater(self.SEARCH_DELAY, self.UpdateMovieSearch)
+        else:
+            self.__searchTimer.Restart(self.SEARCH_DELAY)
 
     def OnMovieListRefresh(self, event):
         """
@@ -459,11 +888,21 @@ class MainFrame(wx.Frame):
         This method is called when the user wants to close the mainframe.
         """
 
+        if self.__searchTimer is not None:
+            self.__searchTimer.Stop()
+
+        # Cancels the loading in progress, if any
+        self.__loadGeneration += 1
+
+        if self.__currentHdd is not None:
+            self.__currentHdd.Flush()
+
         del self.__selectedMovie
         del self.__currentCategory
         del self.__categoryList
         del self.__currentHdd
         del self.__movieList
+        del self.__movieIndexDict
 
         self.Destroy()
 
@@ -28,16 +28,28 @@ Copyright (C) 2010 Revolt
 import wx, os, io
 from gui.controls.ImageViewer import *
 from gui.dialogs.ImageSelectorDialog import *
+from classes.LRUCache import *
+from classes.ImagePipeline import *
 
 class MovieDetailsPanel(wx.Panel):
     """ The object details panel class """
 
-    def __init__(self, parent):
-        """ Constructor """
+    def __init__(self, parent, imageCacheSize = 16):
+        """
+        Constructor
+        ---
+        Params:
+            @ parent (wx.Window) - The parent window of this panel.
+            @ imageCacheSize (Integer) - How many decoded cover thumbnails to
+                                         keep in memory (0 disables the cache).
+        """
 
         # -- Private Variables --
         self.__defImage = wx.Image("gui/images/video-default.png", wx.BITMAP_TYPE_PNG)
         self.__currentMovie = None
+        self.__imageChanged = False
+        self.__imageCache = LRUCache(imageCacheSize)
+        self.__imagePipeline = ImagePipeline()
 
         # -- Panel Initialization --
         wx.Panel.__init__(self, parent)
@@ -124,6 +136,7 @@ class MovieDetailsPanel(wx.Panel):
         """
 
         self.__currentMovie = movie
+        self.__imageChanged = False
 
         if movie is None:
             self.Disable()
@@ -150,14 +163,63 @@ class MovieDetailsPanel(wx.Panel):
             self.txtDirectors.SetValue(separator.join(movie.GetDirectors()))
             self.txtActors.SetValue(separator.join(movie.GetActors()))
 
-            imageData = movie.GetImageData()
+            self.ShowMovieThumbnail(movie)
+
+    def ShowMovieThumbnail(self, movie):
+        """
+        Shows the thumbnail of the cover of a movie. Thumbnails that aren't
+        cached are read and decoded in the background, the default image is
+        shown until they are loaded.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail to show.
+        """
+
+        image = self.__imageCache.Get(self.__GetImageCacheKey(movie))
+
+        if image is not None:
+            self.imgCover.SetImage(image)
+            return
+
+        self.imgCover.SetImage(self.__defImage)
+
+        # Only the thumbnail of the movie shown now matters
+        self.__imagePipeline.CancelLoads()
+        self.__imagePipeline.LoadThumbnail(movie, self.__OnThumbnailLoaded)
+
+    def GetMovieImage(self, movie):
+        """
+        Gets the full size cover image of a movie.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose image we want.
+        ---
+        Return: (wx.Image) The cover image of the movie or the default image.
+        """
+
+        imageData = movie.GetImageData()
+
+        if imageData is None:
+            return self.__defImage
+
+        image = ImagePipeline.DecodeImage(imageData)
 
-            if imageData is not None:
-                imageStream = io.BytesIO(bytearray(imageData))
-                image = wx.ImageFromStream(imageStream)
-                self.imgCover.SetImage(image)
-            else:
-                self.imgCover.SetImage(self.__defImage)
+        if image is None:
+            return self.__defImage
+
+        return image
+
+    def __GetImageCacheKey(self, movie):
+        """
+        Params:
+            @ movie (Movie) - A movie.
+        ---
+        Return: (Tuple) The key of the thumbnail of the movie in the cache.
+        """
+
+        # Saving a movie updates its modification date, so using it in the
+        # key ensures that a changed image is never served from the cache
+        return (movie, movie.GetModificationTimestamp())
 
     def UpdateMovie(self):
         """
@@ -175,9 +237,12 @@ class MovieDetailsPanel(wx.Panel):
         self.__currentMovie.SetActors(self.txtActors.GetValue().split(", "))
         image = self.imgCover.GetImage()
         imageStream = io.BytesIO()
-        if image is not None and image != self.__defImage:
+        # Re-encoding an unchanged cover would produce different bytes and
+        # cause the image to be written again
+        if self.__imageChanged and image is not None and image != self.__defImage:
             if image.SaveStream(imageStream, wx.BITMAP_TYPE_JPEG):
                 self.__currentMovie.SetImageData(imageStream.getvalue())
+                self.__imageChanged = False
         self.__currentMovie.SaveInfoToHdd()
 
 
@@ -197,11 +262,20 @@ class MovieDetailsPanel(wx.Panel):
         if self.__currentMovie is None:
             return
 
-        dlgImageSelect = ImageSelectorDialog(self, self.imgCover.GetImage(), self.__defImage)
+        # The viewer shows a thumbnail, the dialog gets the full image
+        if self.__imageChanged:
+            image = self.imgCover.GetImage()
+        else:
+            image = self.GetMovieImage(self.__currentMovie)
+
+        dlgImageSelect = ImageSelectorDialog(self, image, self.__defImage)
 
         if dlgImageSelect.ShowModal() == wx.ID_OK:
             selectedImage = dlgImageSelect.GetImage()
-            self.imgCover.SetImage(selectedImage)
+
+            if selectedImage is not image:
+                self.imgCover.SetImage(selectedImage)
+                self.__imageChanged = True
 
     def OnLinkClick(self, event):
         """
@@ -213,3 +287,24 @@ class MovieDetailsPanel(wx.Panel):
         if not tmdbID.isspace():
             tmdbURL = "http://www.tmdb.org/movie/" + tmdbID
             wx.LaunchDefaultBrowser(tmdbURL)
+
+    def __OnThumbnailLoaded(self, movie, image):
+        """
+        Called (in the GUI thread) when the thumbnail of a movie was loaded.
+        ---
+        Params:
+            @ movie (Movie) - The movie whose thumbnail was loaded.
+            @ image (wx.Image) - The thumbnail or None if there is none.
+        """
+
+        # The panel may have been destroyed while the thumbnail was loading
+        if not self:
+            return
+
+        if image is None:
+            image = self.__defImage
+
+        self.__imageCache.Set(self.__GetImageCacheKey(movie), image)
+
+        if movie is self.__currentMovie and not self.__imageChanged:
+            self.imgCover.SetImage(image)
@@ -27,6 +27,8 @@ Copyright (C) 2010 Revolt
 import wx, os, sys, logging, logging.handlers, traceback
 from appinfo import *
 from gui.frames.MainFrame import *
+from classes.infoproviders import tmdb
+from classes.RateLimiter import *
 
 class MainApp(wx.App):
     """ Our main application class """
@@ -79,6 +81,12 @@ class MainApp(wx.App):
                                     style = wx.CONFIG_USE_LOCAL_FILE)
         wx.Config.Set(self.config)
 
+        tmdb.config['cache'] = tmdb.ResponseCache(os.path.join(appDataFolder, "tmdbcache.db"),
+                                                  self.config.ReadInt("/tmdb/CacheSize", 20000))
+        tmdb.config['offline'] = self.config.ReadBool("/tmdb/Offline", False)
+        tmdb.config['limiter'] = RateLimiter(self.config.ReadInt("/tmdb/MaxRequests", 30),
+                                             self.config.ReadInt("/tmdb/RequestPeriod", 10))
+
         self.frame = MainFrame(None, "MHDD Organizer")
         self.frame.Show(True)
         self.SetTopWindow(self.frame)